@@ -0,0 +1,59 @@
+# Compares the built-in codec stages with the external binaries.
+#
+#   python benchmarks/bench_compression.py [size in MiB]
+#
+# The input is generated once into a temporary file. Every variant reads it
+# through a redirect and writes to /dev/null.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from shalchemy import sh
+
+SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+THREADS = os.cpu_count() or 1
+
+
+def make_input(path: str):
+    # Log-like lines compress about as well as real ones
+    with open(path, 'wb') as file:
+        line = 0
+        while file.tell() < SIZE * 1024 * 1024:
+            file.write(b''.join(f'{line} GET /static/{line % 997}.js 200 {line * 7 % 10007}\n'.encode() for line in range(line, line + 10000)))
+            line += 10000
+
+
+def timed(name: str, expression) -> float:
+    start = time.perf_counter()
+    sh.run(expression > os.devnull)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<40} {elapsed:6.2f}s  {SIZE / elapsed:7.1f} MiB/s')
+    return elapsed
+
+
+def bench(directory: str):
+    source = os.path.join(directory, 'input.txt')
+    compressed = os.path.join(directory, 'input.txt.gz')
+    make_input(source)
+    sh.run(sh('gzip', '-c', source) > compressed)
+
+    timed('gzip -6 (binary)', sh('gzip', '-6') < source)
+    timed('compress gzip level=6', sh.compress('gzip', level=6) < source)
+    timed(f'compress gzip level=6 threads={THREADS}', sh.compress('gzip', level=6, threads=THREADS) < source)
+    if shutil.which('pigz'):
+        timed(f'pigz -6 -p {THREADS} (binary)', sh('pigz', '-6', '-p', str(THREADS)) < source)
+    timed('zcat (binary)', sh('zcat') < compressed)
+    timed('decompress gzip', sh.decompress('gzip') < compressed)
+    timed('zcat | wc -l (binaries)', (sh('zcat') < compressed) | sh('wc', '-l'))
+    timed('decompress gzip | wc -l', (sh.decompress('gzip') < compressed) | sh('wc', '-l'))
+    timed('xz -1 (binary)', sh('xz', '-1') < source)
+    timed('compress xz level=1', sh.compress('xz', level=1) < source)
+    timed(f'compress xz level=1 threads={THREADS}', sh.compress('xz', level=1, threads=THREADS) < source)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        bench(directory)
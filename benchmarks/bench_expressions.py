@@ -0,0 +1,68 @@
+# Measures how expensive it is to build (not run) shalchemy expressions.
+#
+#   python benchmarks/bench_expressions.py
+
+import gc
+import time
+import tracemalloc
+
+from shalchemy import sh
+
+ITEMS = 100_000
+
+
+def build_chains(count: int):
+    git = sh('git')
+    return [git.log.oneline('--max-count', str(index), author='someone') for index in range(count)]
+
+
+def build_fanout(count: int):
+    oneline = sh('git').log.oneline
+    return [oneline(str(index)) for index in range(count)]
+
+
+def build_deep(depth: int):
+    expr = sh('probe')
+    for index in range(depth):
+        expr = expr.sub(str(index))
+    return expr
+
+
+def bench_build_time():
+    start = time.perf_counter()
+    build_chains(ITEMS)
+    elapsed = time.perf_counter() - start
+    print(f'build {ITEMS} git.log.oneline(...) chains: {elapsed:.3f}s ({elapsed / ITEMS * 1e6:.2f}us each)')
+
+
+def measure(build) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    built = build(ITEMS)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return allocated / len(built)
+
+
+def bench_memory():
+    print(f'memory per git.log.oneline(...) chain: {measure(build_chains):.0f} bytes')
+    # Includes the str(index) argument itself
+    print(f'memory per node curried from a shared prefix: {measure(build_fanout):.0f} bytes')
+
+
+def bench_deep():
+    start = time.perf_counter()
+    expr = build_deep(2000)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    expr._repr(None)
+    flattened = time.perf_counter() - start
+    print(f'2000-deep curry chain: build {built * 1e3:.1f}ms, flatten {flattened * 1e3:.1f}ms')
+
+
+if __name__ == '__main__':
+    bench_build_time()
+    bench_memory()
+    bench_deep()
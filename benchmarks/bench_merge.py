@@ -0,0 +1,39 @@
+# Compares sh.merge_sorted with `sort -m` over process substitutions.
+#
+#   python benchmarks/bench_merge.py [lines per input] [inputs]
+#
+# Every input is a `seq` sorted the way the merge expects. Output goes to
+# /dev/null.
+
+import os
+import sys
+import time
+
+from shalchemy import sh
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+INPUTS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+
+def timed(name: str, expression) -> float:
+    start = time.perf_counter()
+    sh.run(expression > os.devnull)
+    elapsed = time.perf_counter() - start
+    total = LINES * INPUTS
+    print(f'{name:<40} {elapsed:6.2f}s  {total / elapsed / 1e6:6.2f} M lines/s')
+    return elapsed
+
+
+def bench():
+    plain = [sh('sh', '-c', f'seq {index} {INPUTS} {LINES * INPUTS} | LC_ALL=C sort') for index in range(INPUTS)]
+    numeric = [sh('seq', str(index), str(INPUTS), str(LINES * INPUTS)) for index in range(INPUTS)]
+
+    timed('sort -m (binary)', sh('sort', '-m', *[input.read_sub() for input in plain]).with_(env={'LC_ALL': 'C'}))
+    timed('merge_sorted', sh.merge_sorted(plain))
+    timed('sort -m -n (binary)', sh('sort', '-m', '-n', *[input.read_sub() for input in numeric]))
+    timed('merge_sorted numeric=True', sh.merge_sorted(numeric, numeric=True))
+    timed('merge_sorted key=int', sh.merge_sorted(numeric, key=int))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,58 @@
+# Measures the per-run bookkeeping cost of deep expression trees.
+#
+#   python benchmarks/bench_run_context.py
+#
+# The first number spawns real processes. The second one swaps Popen for a
+# do-nothing stand-in so only shalchemy's own bookkeeping is timed.
+
+import io
+import subprocess
+import time
+from unittest import mock
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo
+
+STAGES = 50
+ROUNDS = 200
+
+
+def pipeline(stages: int):
+    expr = echo('hello')
+    for _ in range(stages - 1):
+        expr = expr | cat
+    return expr
+
+
+class FakePopen:
+    def __init__(self, *args, **kwargs):
+        self.stdout = io.BytesIO() if kwargs.get('stdout') == subprocess.PIPE else None
+        self.returncode = 0
+
+    def wait(self):
+        return 0
+
+
+def bench_real():
+    expr = pipeline(STAGES)
+    start = time.perf_counter()
+    for _ in range(10):
+        sh.run(expr > '/dev/null')
+    elapsed = (time.perf_counter() - start) / 10
+    print(f'{STAGES}-stage pipeline, real processes: {elapsed * 1e3:.1f}ms per run')
+
+
+def bench_bookkeeping(name: str, expr):
+    from shalchemy.runner import _internal_run
+    with mock.patch('subprocess.Popen', FakePopen):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            _internal_run(expr, stdout=subprocess.DEVNULL)
+        elapsed = (time.perf_counter() - start) / ROUNDS
+    print(f'{name}, bookkeeping only: {elapsed * 1e6:.0f}us per run')
+
+
+if __name__ == '__main__':
+    bench_real()
+    bench_bookkeeping(f'{STAGES}-stage pipeline', pipeline(STAGES))
+    bench_bookkeeping(f'{STAGES * 10}-stage pipeline', pipeline(STAGES * 10))
@@ -26,6 +26,10 @@ setup(
     install_requires=[
         # -*- Extra requirements: -*-
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'shalchemyprobe=shalchemy.probe:probe_main',
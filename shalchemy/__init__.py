@@ -1,5 +1,11 @@
+import os
+
 from .runner import run, sh
 
+if os.environ.get('SHALCHEMY_TRACE'):
+    from .trace import start_from_environment
+    start_from_environment()
+
 __all__ = [
     'run',
     'sh',
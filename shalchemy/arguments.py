@@ -1,12 +1,11 @@
-from dataclasses import dataclass
 import io
 from typing import Any, cast, List, Dict, Sequence, Union, TYPE_CHECKING
 from .types import ParenthesisKind, PublicArgument, PublicKeywordArgument
-from .run_result import ReadSubstitutePreparation, WriteSubstitutePreparation
 import sys
 
 if TYPE_CHECKING:
     from .expressions import ReadSubstitute, WriteSubstitute
+    from .run_result import ReadSubstitutePreparation, WriteSubstitutePreparation
 
 
 from shalchemy.types import (
@@ -26,12 +25,22 @@ def default_kwarg_render(keyword: str, value: PublicKeywordArgument) -> Sequence
 def flatten(stuff: Sequence[Any]):
     if not isinstance(stuff, (list, tuple)):
         return stuff
-    flattened = []
+    # Most calls pass plain scalars, don't rebuild anything for those
     for x in stuff:
         if isinstance(x, (list, tuple)):
-            flattened.extend(flatten(x))
-        else:
+            break
+    else:
+        return stuff
+    flattened = []
+    stack = [iter(stuff)]
+    while stack:
+        for x in stack[-1]:
+            if isinstance(x, (list, tuple)):
+                stack.append(iter(x))
+                break
             flattened.append(x)
+        else:
+            stack.pop()
     return flattened
 
 
@@ -41,9 +50,7 @@ def compile_arguments(
     _kwarg_render: KeywordArgumentRenderer = default_kwarg_render
 ) -> List[InternalArgument]:
     from .expressions import ReadSubstitute, WriteSubstitute
-    result: List[InternalArgument] = []
-    for arg in flatten(args):
-        result.append(arg)
+    result: List[InternalArgument] = list(flatten(args))
     for key, value in kwargs.items():
         if isinstance(value, (str, int, float, bool)):
             result.extend(_kwarg_render(key, value))
@@ -57,10 +64,17 @@ def compile_arguments(
     return result
 
 
-@dataclass
 class ArgumentCompilationResult:
     args: Sequence[str]
-    prepared_args: List[Union[WriteSubstitutePreparation, ReadSubstitutePreparation]]
+    prepared_args: List[Union['WriteSubstitutePreparation', 'ReadSubstitutePreparation']]
+
+    def __init__(
+        self,
+        args: Sequence[str],
+        prepared_args: List[Union['WriteSubstitutePreparation', 'ReadSubstitutePreparation']],
+    ):
+        self.args = args
+        self.prepared_args = prepared_args
 
 
 UncompiledKeywordArgument = Union[
@@ -86,7 +100,7 @@ class UncompiledArgument:
     def _repr(self, paren: ParenthesisKind = None):
         render: KeywordArgumentRenderer = getattr(self, 'render')
         fname = f'{self.value._repr(ParenthesisKind.ALWAYS)}'
-        return render(self.key, fname)
+        return ' '.join(render(self.key, fname))
 
     def __repr__(self):
-        return self._repr
+        return self._repr()
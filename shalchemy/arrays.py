@@ -0,0 +1,148 @@
+from typing import Any, List, Optional, TYPE_CHECKING
+
+import io
+import os
+import subprocess
+
+if TYPE_CHECKING:
+    from .expressions import ShalchemyExpression
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Initial capacity in elements, doubled whenever the array fills up
+INITIAL_CAPACITY = 4096
+
+
+def _import_numpy() -> Any:
+    try:
+        import numpy
+    except ImportError as exc:
+        raise ImportError('to_numpy requires numpy. Install it with `pip install shalchemy[numpy]`') from exc
+    return numpy
+
+
+class GrowableArray:
+    # Amortized O(1) appends of whole numpy arrays into one preallocated buffer
+    def __init__(self, np: Any, dtype: Any, capacity: int = INITIAL_CAPACITY):
+        self.np = np
+        self.size = 0
+        self.data = np.empty(capacity, dtype=dtype)
+
+    def reserve(self, extra: int):
+        needed = self.size + extra
+        if needed <= len(self.data):
+            return
+        capacity = max(needed, 2 * len(self.data))
+        grown = self.np.empty(capacity, dtype=self.data.dtype)
+        grown[:self.size] = self.data[:self.size]
+        self.data = grown
+
+    def extend(self, values: Any):
+        self.reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def finish(self) -> Any:
+        self.data.resize(self.size, refcheck=False)
+        return self.data
+
+
+def read_binary(np: Any, stdout: io.IOBase, dtype: Any) -> Any:
+    dtype = np.dtype(dtype)
+    buffer = GrowableArray(np, np.uint8, capacity=max(DEFAULT_CHUNK_SIZE, dtype.itemsize))
+    # Read straight into the array's memory, bypassing the buffered reader
+    raw = io.FileIO(stdout.fileno(), 'rb', closefd=False)
+    while True:
+        if buffer.size == len(buffer.data):
+            buffer.reserve(len(buffer.data))
+        count = raw.readinto(memoryview(buffer.data[buffer.size:]))
+        if not count:
+            break
+        buffer.size += count
+    if buffer.size % dtype.itemsize:
+        raise ValueError(f'Output is {buffer.size} bytes which is not a multiple of {dtype.itemsize} ({dtype})')
+    return buffer.finish().view(dtype)
+
+
+def line_shape(np: Any, text: bytes, delimiter: Optional[bytes]) -> Any:
+    # Values on every line of `text`, which ends with a newline. Blank lines
+    # come back as 0. Raises if a delimited line has an empty field.
+    data = np.frombuffer(text, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    separator = (data == ord(' ')) | (data == ord('\t')) | (data == ord('\n')) | (data == ord('\r'))
+    if delimiter is not None:
+        separator |= data == delimiter[0]
+    starts = ~separator
+    starts[1:] &= separator[:-1]
+    tokens = np.diff(np.concatenate(([0], np.cumsum(starts)[newlines])))
+    if delimiter is not None:
+        fields = np.diff(np.concatenate(([0], np.cumsum(data == delimiter[0])[newlines]))) + 1
+        bad = (fields != tokens) & ((tokens > 0) | (fields > 1))
+        if bad.any():
+            raise ValueError('Empty field in delimited input', text.split(b'\n')[int(np.argmax(bad))])
+    return tokens
+
+
+def read_text(np: Any, stdout: io.IOBase, dtype: Any, delimiter: Optional[str]) -> Any:
+    delimiter_byte: Optional[bytes] = None
+    table = None
+    if delimiter is not None and not delimiter.isspace():
+        delimiter_byte = delimiter.encode()
+        if len(delimiter_byte) != 1:
+            raise ValueError('delimiter must be a single byte', delimiter)
+        table = bytes.maketrans(delimiter_byte, b' ')
+    values = GrowableArray(np, dtype)
+    # The first line with values decides how many columns the result has
+    columns = 0
+    fd = stdout.fileno()
+    pending: List[bytes] = []
+    while True:
+        chunk = os.read(fd, DEFAULT_CHUNK_SIZE)
+        if chunk:
+            # Only parse complete lines, carry the rest into the next chunk
+            end = chunk.rfind(b'\n')
+            if end == -1:
+                pending.append(chunk)
+                continue
+            text = b''.join(pending) + chunk[:end + 1]
+            pending = [chunk[end + 1:]]
+        else:
+            text = b''.join(pending)
+            if not text.strip():
+                break
+            text += b'\n'
+        counts = line_shape(np, text, delimiter_byte)
+        counts = counts[counts > 0]
+        if len(counts):
+            if not columns:
+                columns = int(counts[0])
+            if (counts != columns).any():
+                raise ValueError(f'Expected {columns} values on every line', int(counts[np.argmax(counts != columns)]))
+            if table is not None:
+                text = text.translate(table)
+            values.extend(np.fromstring(text, dtype=dtype, sep=' '))
+        if not chunk:
+            break
+    result = values.finish()
+    if columns > 1:
+        result = result.reshape(-1, columns)
+    return result
+
+
+def to_numpy(
+    expression: 'ShalchemyExpression',
+    dtype: Any = 'float64',
+    binary: bool = False,
+    delimiter: Optional[str] = None,
+) -> Any:
+    np = _import_numpy()
+    from .runner import _internal_run
+    result = _internal_run(expression, stdout=subprocess.PIPE)
+    stdout = result.main.stdout
+    try:
+        if binary:
+            return read_binary(np, stdout, dtype)
+        return read_text(np, stdout, dtype, delimiter)
+    finally:
+        stdout.close()
+        result.wait()
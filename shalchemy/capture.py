@@ -0,0 +1,287 @@
+from typing import Callable, Optional, Sequence, TYPE_CHECKING
+
+import io
+import os
+import subprocess
+
+if TYPE_CHECKING:
+    from .expressions import ShalchemyExpression
+    from .run_result import RunResult
+    from .threaded import ThreadedProcess
+
+
+# What happens to output past a limit:
+#   raise               kill the run and raise CaptureLimitExceeded
+#   truncate-and-drain  keep the start, read and throw away the rest
+#   kill                keep the start and kill the run
+#   keep-tail           keep only the end, like `tail`
+POLICIES = ('raise', 'truncate-and-drain', 'kill', 'keep-tail')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CaptureLimit:
+    __slots__ = ('max_bytes', 'max_lines', 'policy')
+
+    max_bytes: Optional[int]
+    max_lines: Optional[int]
+    policy: str
+
+    def __init__(self, max_bytes: Optional[int] = None, max_lines: Optional[int] = None, policy: str = 'raise'):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {list(POLICIES)}', policy)
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError('max_bytes must not be negative', max_bytes)
+        if max_lines is not None and max_lines < 0:
+            raise ValueError('max_lines must not be negative', max_lines)
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.policy = policy
+
+    @property
+    def stops_run(self) -> bool:
+        return self.policy in ('raise', 'kill')
+
+    def describe(self) -> str:
+        limits = []
+        if self.max_bytes is not None:
+            limits.append(f'{self.max_bytes} bytes')
+        if self.max_lines is not None:
+            limits.append(f'{self.max_lines} lines')
+        return f'{" ".join(limits) or "unlimited"} {self.policy}'
+
+
+UNLIMITED = CaptureLimit()
+
+
+class CaptureBuffer:
+    # Collects one output stream within a CaptureLimit. `exceeded` is set as
+    # soon as anything had to be left out.
+    limit: CaptureLimit
+    exceeded: bool
+
+    def __init__(self, limit: CaptureLimit, store: bool = True):
+        self.limit = limit
+        self.exceeded = False
+        # Without `store` the head policies only count, for output that is
+        # passed on as it comes
+        self.store = store
+        self._buffer = bytearray()
+        self._kept = 0
+        # Newlines kept
+        self._lines = 0
+        self._on_exceeded: Optional[Callable[[], object]] = None
+
+    def on_exceeded(self, callback: Callable[[], object]):
+        self._on_exceeded = callback
+        if self.exceeded:
+            callback()
+
+    def write(self, data: bytes) -> int:
+        # Returns how much of the start of `data` is within the limit
+        if self.limit.policy == 'keep-tail':
+            self._tail(data)
+            return len(data)
+        if self.exceeded:
+            return 0
+        keep = self._head(data)
+        if self.exceeded and self._on_exceeded is not None:
+            self._on_exceeded()
+        return keep
+
+    def _head(self, data: bytes) -> int:
+        keep = len(data)
+        if self.limit.max_bytes is not None:
+            keep = min(keep, self.limit.max_bytes - self._kept)
+        if self.limit.max_lines is not None:
+            remaining = self.limit.max_lines - self._lines
+            if remaining <= 0:
+                keep = 0
+            position = -1
+            for _ in range(remaining):
+                position = data.find(b'\n', position + 1, keep)
+                if position == -1:
+                    break
+            if position != -1:
+                keep = min(keep, position + 1)
+        if self.store:
+            self._buffer += data[:keep]
+        self._kept += keep
+        self._lines += data.count(b'\n', 0, keep)
+        if keep < len(data):
+            self.exceeded = True
+        return keep
+
+    def _tail(self, data: bytes):
+        buffer = self._buffer
+        buffer += data
+        if self.limit.max_bytes is not None and len(buffer) > self.limit.max_bytes:
+            self.exceeded = True
+            # Deleting from the front of a bytearray doesn't move the rest
+            del buffer[:len(buffer) - self.limit.max_bytes]
+        if self.limit.max_lines is not None:
+            self._lines = buffer.count(b'\n') if self.exceeded else self._lines + data.count(b'\n')
+            # An unterminated last line counts too
+            lines = self._lines + (1 if buffer and buffer[-1:] != b'\n' else 0)
+            while lines > self.limit.max_lines:
+                self.exceeded = True
+                end = buffer.find(b'\n')
+                del buffer[:end + 1]
+                self._lines -= 1
+                lines -= 1
+
+    def getvalue(self) -> bytes:
+        return bytes(self._buffer)
+
+
+class Capture:
+    __slots__ = ('stdout', 'stderr', 'returncode', 'stdout_exceeded', 'stderr_exceeded')
+
+    stdout: bytes
+    stderr: Optional[bytes]
+    returncode: int
+    stdout_exceeded: bool
+    stderr_exceeded: bool
+
+    def __init__(
+        self,
+        stdout: bytes,
+        stderr: Optional[bytes],
+        returncode: int,
+        stdout_exceeded: bool = False,
+        stderr_exceeded: bool = False,
+    ):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.stdout_exceeded = stdout_exceeded
+        self.stderr_exceeded = stderr_exceeded
+
+    def __repr__(self):
+        return (
+            f'Capture(returncode={self.returncode}, stdout={len(self.stdout)} bytes, '
+            f'stderr={None if self.stderr is None else len(self.stderr)} bytes)'
+        )
+
+
+class CaptureLimitExceeded(Exception):
+    stream: str
+    limit: CaptureLimit
+    # None when the output was streamed or piped rather than captured
+    capture: Optional[Capture]
+
+    def __init__(self, stream: str, limit: CaptureLimit, capture: Optional[Capture]):
+        super().__init__(f'{stream} exceeded {limit.describe()}')
+        self.stream = stream
+        self.limit = limit
+        self.capture = capture
+
+
+def capture(
+    expression: 'ShalchemyExpression',
+    limit: CaptureLimit = UNLIMITED,
+    stderr_limit: Optional[CaptureLimit] = UNLIMITED,
+) -> Capture:
+    # Runs the expression and collects its stdout, and its stderr unless
+    # `stderr_limit` is None, each within its limit
+    from .reactor import pump_to
+    from .runner import _internal_run
+    stdout_buffer = CaptureBuffer(limit)
+    stderr_buffer = None
+    stderr_writer = None
+    if stderr_limit is not None:
+        stderr_buffer = CaptureBuffer(stderr_limit)
+        # The buffer only appends, so the reactor can fill it without a worker
+        stderr_writer, stream = pump_to(stderr_buffer, inline=True)
+    try:
+        result = _internal_run(expression, stdout=subprocess.PIPE, stderr=stderr_writer)
+    finally:
+        # The children have their copies. Closing ours lets the reactor see EOF.
+        if stderr_writer is not None:
+            os.close(stderr_writer)
+    if stderr_buffer is not None:
+        result.streams.append(stream)
+        if stderr_limit is not None and stderr_limit.stops_run:
+            def stop():
+                stream.stop()
+                result.kill()
+            stderr_buffer.on_exceeded(stop)
+
+    stdout = result.main.stdout
+    fd = stdout.fileno()
+    try:
+        while True:
+            chunk = os.read(fd, CHUNK_SIZE)
+            if not chunk:
+                break
+            stdout_buffer.write(chunk)
+            if stdout_buffer.exceeded and limit.stops_run:
+                result.kill()
+                break
+    finally:
+        stdout.close()
+        result.wait()
+
+    captured = Capture(
+        stdout_buffer.getvalue(),
+        stderr_buffer.getvalue() if stderr_buffer is not None else None,
+        result.main.returncode,
+        stdout_exceeded=stdout_buffer.exceeded,
+        stderr_exceeded=stderr_buffer is not None and stderr_buffer.exceeded,
+    )
+    if captured.stdout_exceeded and limit.policy == 'raise':
+        raise CaptureLimitExceeded('stdout', limit, captured)
+    if captured.stderr_exceeded and stderr_limit is not None and stderr_limit.policy == 'raise':
+        raise CaptureLimitExceeded('stderr', stderr_limit, captured)
+    return captured
+
+
+def enforce(
+    process: 'ThreadedProcess',
+    stream: str,
+    limit: CaptureLimit,
+    context: 'RunResult',
+    stages: Sequence[subprocess.Popen],
+    main: Optional[subprocess.Popen] = None,
+) -> int:
+    # Passes one output stream of a limited expression on while it is within
+    # the limit, then applies the policy to the rest. Reports `main`'s exit
+    # status as its own, so it can stand in for it as the last process.
+    buffer = CaptureBuffer(limit, store=limit.policy == 'keep-tail')
+    try:
+        while True:
+            chunk = os.read(process.stdin_fd, CHUNK_SIZE)
+            if not chunk:
+                break
+            if buffer.exceeded and limit.policy == 'truncate-and-drain':
+                continue
+            kept = buffer.write(chunk)
+            if limit.policy == 'keep-tail':
+                continue
+            if kept:
+                process.write(chunk[:kept])
+            if buffer.exceeded and limit.stops_run:
+                context.kill(stages)
+                if limit.policy == 'raise':
+                    context.errors.append(CaptureLimitExceeded(stream, limit, None))
+                break
+        if limit.policy == 'keep-tail':
+            process.write(buffer.getvalue())
+    except BrokenPipeError:
+        # The reader is gone. Closing our input passes that on upstream.
+        pass
+    finally:
+        os.close(process.stdin_fd)
+        process.stdin_fd = -1
+    return main.wait() if main is not None else 0
+
+
+def forward(data: Optional[bytes], stream: io.IOBase):
+    # Hands captured stderr on to where it would have gone
+    if not data:
+        return
+    if isinstance(stream, io.TextIOBase):
+        stream.write(data.decode(getattr(stream, 'encoding', None) or 'utf-8', errors='replace'))
+    else:
+        stream.write(data)
+    stream.flush()
@@ -0,0 +1,246 @@
+from typing import Any, Callable, Deque, Dict, Optional
+
+import collections
+import os
+
+from .expressions import ShalchemyExpression
+from .run_result import RunResult
+from .threaded import ThreadedProcess
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+
+CHUNK_SIZE = 256 * 1024
+# Input per independently compressed block when compressing in parallel
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+class Codec:
+    # One compression format. zlib, bz2 and lzma all release the GIL while
+    # they work on a buffer, so codec stages really do run in parallel with
+    # the rest of the program.
+    name: str
+    default_level: int
+
+    def __init__(
+        self,
+        name: str,
+        default_level: int,
+        compressor: Callable[[int], Any],
+        decompressor: Callable[[], Any],
+    ):
+        self.name = name
+        self.default_level = default_level
+        self._compressor = compressor
+        self._decompressor = decompressor
+
+    def compressor(self, level: Optional[int] = None) -> Any:
+        return self._compressor(self.default_level if level is None else level)
+
+    def decompressor(self) -> Any:
+        return self._decompressor()
+
+    def compress_block(self, data: bytes, level: Optional[int] = None) -> bytes:
+        # A complete stream on its own. Every format here accepts several
+        # streams one after another as one file, which is what makes
+        # compressing blocks in parallel possible.
+        compressor = self.compressor(level)
+        return compressor.compress(data) + compressor.flush()
+
+
+def _gzip() -> Codec:
+    import zlib
+    return Codec(
+        'gzip',
+        6,
+        lambda level: zlib.compressobj(level, zlib.DEFLATED, 31),
+        lambda: zlib.decompressobj(31),
+    )
+
+
+def _bzip2() -> Codec:
+    import bz2
+    return Codec('bzip2', 9, bz2.BZ2Compressor, bz2.BZ2Decompressor)
+
+
+def _xz() -> Codec:
+    import lzma
+    return Codec('xz', 6, lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor)
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int):
+        import zstandard
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+def _zstd() -> Codec:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd support needs the zstandard package: pip install shalchemy[zstd]')
+    return Codec('zstd', 3, _ZstdCompressor, lambda: zstandard.ZstdDecompressor().decompressobj())
+
+
+_FACTORIES: Dict[str, Callable[[], Codec]] = {
+    'gzip': _gzip,
+    'gz': _gzip,
+    'bzip2': _bzip2,
+    'bz2': _bzip2,
+    'xz': _xz,
+    'lzma': _xz,
+    'zstd': _zstd,
+    'zst': _zstd,
+}
+_codecs: Dict[str, Codec] = {}
+
+
+def codec(name: str) -> Codec:
+    # The modules are only imported for formats that get used
+    if name not in _FACTORIES:
+        raise ValueError(f'Unknown compression format, expected one of {sorted(_FACTORIES)}', name)
+    if name not in _codecs:
+        _codecs[name] = _FACTORIES[name]()
+    return _codecs[name]
+
+
+def _read(process: ThreadedProcess, size: int) -> bytes:
+    # Fills a whole block unless the input ends first
+    pieces = []
+    remaining = size
+    while remaining:
+        data = os.read(process.stdin_fd, min(remaining, CHUNK_SIZE))
+        if not data:
+            break
+        pieces.append(data)
+        remaining -= len(data)
+    return b''.join(pieces)
+
+
+class CodecExpression(ShalchemyExpression):
+    # Compresses or decompresses stdin to stdout in a thread, in place of a
+    # gzip or zcat process
+    __slots__ = ('codec', 'decompress', 'level', 'threads', 'block_size')
+
+    codec: Codec
+    decompress: bool
+    level: Optional[int]
+    threads: int
+    block_size: int
+
+    def __init__(
+        self,
+        format: str,
+        decompress: bool = False,
+        level: Optional[int] = None,
+        threads: int = 1,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        if threads < 1:
+            raise ValueError('threads must be at least 1', threads)
+        if block_size < 1:
+            raise ValueError('block_size must be at least 1', block_size)
+        self.codec = codec(format)
+        self.decompress = decompress
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+
+    def __reduce__(self):
+        return (CodecExpression, (self.codec.name, self.decompress, self.level, self.threads, self.block_size))
+
+    def _compress(self, process: ThreadedProcess):
+        compressor = self.codec.compressor(self.level)
+        while not process.cancelled.is_set():
+            data = os.read(process.stdin_fd, CHUNK_SIZE)
+            if not data:
+                break
+            process.write(compressor.compress(data))
+        process.write(compressor.flush())
+
+    def _compress_parallel(self, process: ThreadedProcess):
+        from concurrent.futures import Future, ThreadPoolExecutor
+        # Blocks are compressed out of order but written in order. Keeping
+        # a bounded number in flight bounds memory when the output is slow.
+        pending: Deque['Future[bytes]'] = collections.deque()
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='shalchemy: compress') as executor:
+            while not process.cancelled.is_set():
+                data = _read(process, self.block_size)
+                if not data:
+                    break
+                pending.append(executor.submit(self.codec.compress_block, data, self.level))
+                if len(pending) >= 2 * self.threads:
+                    process.write(pending.popleft().result())
+            while pending:
+                process.write(pending.popleft().result())
+
+    def _decompress(self, process: ThreadedProcess):
+        decompressor = self.codec.decompressor()
+        # Whether a stream has begun and not ended yet
+        partial = False
+        while not process.cancelled.is_set():
+            data = os.read(process.stdin_fd, CHUNK_SIZE)
+            if not data:
+                break
+            while data:
+                partial = True
+                process.write(decompressor.decompress(data))
+                if not getattr(decompressor, 'eof', False):
+                    break
+                # Concatenated streams, like the parallel compressor writes
+                partial = False
+                data = decompressor.unused_data
+                decompressor = self.codec.decompressor()
+        if partial:
+            raise EOFError(f'{self.codec.name} input ended in the middle of a stream')
+
+    def _main(self, process: ThreadedProcess) -> Optional[int]:
+        if self.decompress:
+            self._decompress(process)
+        elif self.threads > 1:
+            self._compress_parallel(process)
+        else:
+            self._compress(process)
+        return -9 if process.cancelled.is_set() else 0
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        process = ThreadedProcess(
+            self._main,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            name=self._repr(ParenthesisKind.NEVER),
+        )
+        context.add_process(process, self, kind='codec')
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        # A thread, not a process
+        return 0
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        if self.decompress:
+            return f'decompress({self.codec.name})'
+        options = [self.codec.name]
+        if self.level is not None:
+            options.append(f'level={self.level}')
+        if self.threads > 1:
+            options.append(f'threads={self.threads}')
+        return f'compress({", ".join(options)})'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
@@ -0,0 +1,178 @@
+from typing import cast, Any, Iterator, List, Optional, Union
+
+import contextlib
+import os
+import queue
+import selectors
+import subprocess
+import threading
+import time
+
+from .expressions import ShalchemyExpression
+from .run_result import RunResult
+
+
+Data = Union[str, bytes]
+
+
+class Coprocess:
+    # A long-running expression we talk to over its stdin and stdout, one
+    # request and one response at a time. Starting `bc` or `sqlite3` once and
+    # sending it thousands of requests is far cheaper than thousands of runs.
+    expression: ShalchemyExpression
+    until: bytes
+    encoding: str
+    result: Optional[RunResult]
+
+    def __init__(self, expression: ShalchemyExpression, until: Data = b'\n', encoding: str = 'utf-8'):
+        if not until:
+            raise ValueError('until must be a non-empty delimiter')
+        self.expression = expression
+        self.encoding = encoding
+        self.until = until.encode(encoding) if isinstance(until, str) else until
+        self.result = None
+        self._lock = threading.Lock()
+        self._buffer = b''
+        self.requests = 0
+        self.start()
+
+    def start(self):
+        from .runner import _internal_run
+        self.result = _internal_run(self.expression, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._stdin = next(process.stdin for process in self.result.processes if process.stdin is not None)
+        self._stdout = self.result.main.stdout
+        self._buffer = b''
+
+    @property
+    def alive(self) -> bool:
+        return self.result is not None and all(process.poll() is None for process in self.result.processes)
+
+    def _read_until(self, until: bytes, timeout: Optional[float]) -> bytes:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        fd = self._stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                end = self._buffer.find(until)
+                if end != -1:
+                    response = self._buffer[:end]
+                    self._buffer = self._buffer[end + len(until):]
+                    return response
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not selector.select(remaining):
+                        raise subprocess.TimeoutExpired(repr(self.expression), cast(float, timeout))
+                chunk = os.read(fd, 64 * 1024)
+                if not chunk:
+                    raise EOFError(f'{self.expression!r} exited before answering')
+                self._buffer += chunk
+
+    def request(self, data: Data, until: Optional[Data] = None, timeout: Optional[float] = None) -> Any:
+        # Returns everything up to the delimiter, as str if `data` was a str
+        text = isinstance(data, str)
+        payload = data.encode(self.encoding) if isinstance(data, str) else data
+        delimiter = self.until
+        if until is not None:
+            delimiter = until.encode(self.encoding) if isinstance(until, str) else until
+        with self._lock:
+            if self.result is None:
+                raise ValueError('Coprocess is closed')
+            try:
+                self._stdin.write(payload)
+                self._stdin.flush()
+            except BrokenPipeError:
+                raise EOFError(f'{self.expression!r} exited before answering')
+            response = self._read_until(delimiter, timeout)
+            self.requests += 1
+        return response.decode(self.encoding) if text else response
+
+    def kill(self):
+        if self.result is not None:
+            self.result.kill()
+            self.close()
+
+    def close(self, timeout: Optional[float] = None):
+        # Closing stdin asks the coprocess to finish like any filter would
+        with self._lock:
+            if self.result is None:
+                return
+            result, self.result = self.result, None
+        try:
+            self._stdin.close()
+        except BrokenPipeError:
+            pass
+        if timeout is not None:
+            try:
+                result.main.wait(timeout)
+            except subprocess.TimeoutExpired:
+                result.kill()
+        self._stdout.close()
+        result.wait()
+
+    def __enter__(self) -> 'Coprocess':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        state = 'running' if self.alive else 'stopped'
+        return f'<Coprocess {self.expression!r} {state}>'
+
+
+class CoprocessPool:
+    # N warm copies of a coprocess. A copy that died or failed a request is
+    # replaced with a fresh one when it is handed back.
+    size: int
+
+    def __init__(self, expression: ShalchemyExpression, size: int, until: Data = b'\n', encoding: str = 'utf-8'):
+        if size < 1:
+            raise ValueError('size must be at least 1', size)
+        self.expression = expression
+        self.size = size
+        self.until = until
+        self.encoding = encoding
+        self.restarts = 0
+        self._members: List[Coprocess] = []
+        self._idle: 'queue.Queue[Coprocess]' = queue.Queue()
+        for _ in range(size):
+            coprocess = Coprocess(expression, until=until, encoding=encoding)
+            self._members.append(coprocess)
+            self._idle.put(coprocess)
+
+    @contextlib.contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[Coprocess]:
+        try:
+            coprocess = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise subprocess.TimeoutExpired(repr(self.expression), cast(float, timeout))
+        healthy = False
+        try:
+            if not coprocess.alive:
+                self._restart(coprocess)
+            yield coprocess
+            healthy = True
+        finally:
+            if not healthy or not coprocess.alive:
+                # Its stream may be out of step with our requests now
+                self._restart(coprocess)
+            self._idle.put(coprocess)
+
+    def _restart(self, coprocess: Coprocess):
+        coprocess.kill()
+        coprocess.start()
+        self.restarts += 1
+
+    def request(self, data: Data, until: Optional[Data] = None, timeout: Optional[float] = None) -> Any:
+        with self.checkout(timeout) as coprocess:
+            return coprocess.request(data, until=until, timeout=timeout)
+
+    def close(self):
+        for coprocess in self._members:
+            coprocess.close()
+
+    def __enter__(self) -> 'CoprocessPool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,19 +1,19 @@
-from tempfile import TemporaryFile
-from typing import Any, cast, IO, List, Optional, Sequence, Union
+from typing import Any, cast, IO, Iterable, Iterator, List, Mapping, Optional, Sequence, Union, TYPE_CHECKING
 
 import io
-import shlex
-import textwrap
+import os
 import subprocess
 
+from . import trace
 from .arguments import UncompiledArgument, compile_arguments
+from .globbing import GlobArgument
 from .run_result import (
     FileResult,
     RunResult,
     ReadSubstitutePreparation,
-    StreamPipe,
     WriteSubstitutePreparation,
 )
+from .spawn import DEFAULT_OPTIONS, IoniceValue, RlimitValue, SpawnOptions
 from .types import (
     ParenthesisKind,
     PublicArgument,
@@ -23,17 +23,13 @@ from .types import (
     ShalchemyOutputStream,
 )
 
+if TYPE_CHECKING:
+    from .capture import Capture, CaptureLimit
+    from .xargs import XargsExpression
+
 
 def is_shalchemy_expression(object: Any) -> bool:
-    if isinstance(object, CommandExpression):
-        return True
-    if isinstance(object, PipeExpression):
-        return True
-    if isinstance(object, RedirectInExpression):
-        return True
-    if isinstance(object, RedirectOutExpression):
-        return True
-    return False
+    return isinstance(object, ShalchemyExpression)
 
 
 def is_shalchemy_file(object: Any) -> bool:
@@ -46,6 +42,7 @@ def is_shalchemy_file(object: Any) -> bool:
 
 def represent_file(file: Union[str, io.IOBase]):
     if isinstance(file, str):
+        import shlex
         return shlex.quote(file)
     elif isinstance(file, io.IOBase) and getattr(file, 'name', None):
         return f'File({getattr(file, "name")})'
@@ -54,6 +51,10 @@ def represent_file(file: Union[str, io.IOBase]):
 
 
 class ShalchemyExpression:
+    __slots__ = ()
+    # False for expressions that always run with stdin from /dev/null
+    _reads_stdin: bool = True
+
     def read_sub(self) -> 'ReadSubstitute':
         return ReadSubstitute(self)
 
@@ -89,6 +90,54 @@ class ShalchemyExpression:
             stderr=True,
         )
 
+    def with_(
+        self,
+        nice: Optional[int] = None,
+        ionice: Optional[IoniceValue] = None,
+        cpu_affinity: Optional[Iterable[int]] = None,
+        rlimit_as: Optional[RlimitValue] = None,
+        rlimit_cpu: Optional[RlimitValue] = None,
+        rlimit_nofile: Optional[RlimitValue] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+        cwd: Optional[str] = None,
+    ) -> 'OptionsExpression':
+        return OptionsExpression(
+            self,
+            SpawnOptions.from_keywords(
+                nice=nice,
+                ionice=ionice,
+                cpu_affinity=cpu_affinity,
+                rlimit_as=rlimit_as,
+                rlimit_cpu=rlimit_cpu,
+                rlimit_nofile=rlimit_nofile,
+                env=env,
+                cwd=cwd,
+            ),
+        )
+
+    def limit(
+        self,
+        max_bytes: Optional[int] = None,
+        max_lines: Optional[int] = None,
+        policy: str = 'raise',
+        stderr_bytes: Optional[int] = None,
+        stderr_lines: Optional[int] = None,
+        stderr_policy: str = 'keep-tail',
+    ) -> 'LimitedExpression':
+        from .capture import CaptureLimit
+        stderr_limit = None
+        if stderr_bytes is not None or stderr_lines is not None:
+            stderr_limit = CaptureLimit(stderr_bytes, stderr_lines, stderr_policy)
+        return LimitedExpression(self, CaptureLimit(max_bytes, max_lines, policy), stderr_limit)
+
+    def meter(self, name: str, stream: str = 'stdout') -> 'MeterExpression':
+        return MeterExpression(self, name, stream)
+
+    def capture(self) -> 'Capture':
+        # Both output streams in full, along with the exit code
+        from .capture import capture
+        return capture(self)
+
     def __bool__(self):
         from .runner import _internal_run
         result = _internal_run(self)
@@ -111,20 +160,70 @@ class ShalchemyExpression:
     def __iter__(self):
         return str(self).rstrip('\n').split('\n').__iter__()
 
+    def iter_chunks(self, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        from . import streaming
+        return streaming.iter_chunks(self, chunk_size=chunk_size or streaming.DEFAULT_CHUNK_SIZE)
+
+    def iter_records(
+        self,
+        sep: Union[str, bytes] = '\n',
+        encoding: Optional[str] = 'utf-8',
+        errors: str = 'strict',
+        keepends: bool = False,
+    ) -> Iterator[Union[str, bytes]]:
+        from . import streaming
+        return streaming.iter_records(
+            self,
+            sep,
+            encoding=encoding,
+            errors=errors,
+            keepends=keepends,
+        )
+
+    def iter_lines(self, encoding: str = 'utf-8', keepends: bool = False) -> Iterator[str]:
+        return cast(Iterator[str], self.iter_records('\n', encoding=encoding, keepends=keepends))
+
+    def iter_json_lines(self, encoding: str = 'utf-8', **json_kwargs: Any) -> Iterator[Any]:
+        from . import streaming
+        return streaming.iter_json_lines(self, encoding=encoding, **json_kwargs)
+
+    def iter_csv(self, dialect: str = 'excel', dicts: bool = False, **fmtparams: Any) -> Iterator[Any]:
+        from . import streaming
+        return streaming.iter_csv(self, dialect=dialect, dicts=dicts, **fmtparams)
+
+    def iter_tsv(self, dicts: bool = False, **fmtparams: Any) -> Iterator[Any]:
+        from . import streaming
+        return streaming.iter_csv(self, dialect='excel-tab', dicts=dicts, **fmtparams)
+
+    def to_numpy(self, dtype: Any = 'float64', binary: bool = False, delimiter: Optional[str] = None) -> Any:
+        from .arrays import to_numpy
+        return to_numpy(self, dtype=dtype, binary=binary, delimiter=delimiter)
+
     def _run(
         self,
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
     ) -> RunResult:
         raise NotImplementedError()
 
+    def _count_processes(self) -> int:
+        # The most child processes running this expression keeps alive at once
+        return 1
+
     def _repr(self, paren: ParenthesisKind) -> str:
         raise NotImplementedError()
 
 
 class CommandExpression(ShalchemyExpression):
-    _args: Sequence[Union[str, UncompiledArgument]]
+    __slots__ = ('_parent', '_tail', '_flat', '_kwarg_render')
+
+    # Curried expressions share their parent's arguments instead of copying
+    # them, so building `git.log.oneline(...)` only allocates the new tail.
+    _parent: Optional['CommandExpression']
+    _tail: Sequence[Union[str, UncompiledArgument]]
+    _flat: Optional[Sequence[Union[str, UncompiledArgument]]]
     _kwarg_render: KeywordArgumentRenderer
 
     def __init__(
@@ -132,17 +231,44 @@ class CommandExpression(ShalchemyExpression):
         *args: Union[str, UncompiledArgument],
         _kwarg_render: KeywordArgumentRenderer = None
     ):
-        self._args = args
+        self._parent = None
+        self._tail = args
+        self._flat = args
         # Bypass mypy complaints about "assigning to a method"
         setattr(self, '_kwarg_render', _kwarg_render)
 
+    def _extend(
+        self,
+        tail: Sequence[Union[str, UncompiledArgument]],
+        renderer: KeywordArgumentRenderer,
+    ) -> 'CommandExpression':
+        expression = CommandExpression.__new__(CommandExpression)
+        expression._parent = self
+        expression._tail = tail
+        expression._flat = None
+        setattr(expression, '_kwarg_render', renderer)
+        return expression
+
+    @property
+    def _args(self) -> Sequence[Union[str, UncompiledArgument]]:
+        if self._flat is None:
+            tails = []
+            node: Optional[CommandExpression] = self
+            while node is not None and node._flat is None:
+                tails.append(node._tail)
+                node = node._parent
+            flat: List[Union[str, UncompiledArgument]] = list(node._flat) if node is not None else []
+            for tail in reversed(tails):
+                flat.extend(tail)
+            self._flat = tuple(flat)
+        return self._flat
 
     def __call__(self, *args: PublicArgument, **kwargs: PublicKeywordArgument):
         if len(args) == 1 and len(kwargs) == 0 and isinstance(args[0], str):
-            return CommandExpression(
-                *self._args,
-                *shlex.split(args[0]),
-                _kwarg_render=getattr(self, '_kwarg_render'),
+            import shlex
+            return self._extend(
+                tuple(shlex.split(args[0])),
+                getattr(self, '_kwarg_render'),
             )
 
         renderer: KeywordArgumentRenderer
@@ -157,74 +283,119 @@ class CommandExpression(ShalchemyExpression):
             _kwarg_render=renderer,
         )
 
-        return CommandExpression(
-            *self._args,
-            *compiled,
-            _kwarg_render=renderer,
+        return self._extend(tuple(compiled), renderer)
+
+    def xargs(
+        self,
+        items: Iterable[PublicArgument],
+        max_args: Optional[int] = None,
+        max_procs: int = 1,
+        ordered: bool = True,
+        max_chars: Optional[int] = None,
+    ) -> 'XargsExpression':
+        from .xargs import XargsExpression
+        return XargsExpression(
+            self,
+            items,
+            max_args=max_args,
+            max_procs=max_procs,
+            ordered=ordered,
+            max_chars=max_chars,
         )
 
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return self.__dict__[attr]
-        return self.__call__(attr)
+        # Unset slots end up here too, don't turn them into subcommands. Nor
+        # dunders: pickle and copy probe for __getstate__, __deepcopy__ and
+        # friends and have to be told they don't exist.
+        if attr in CommandExpression.__slots__ or (attr.startswith('__') and attr.endswith('__')):
+            raise AttributeError(attr)
+        # An attribute name is always a single token so skip shlex
+        return self._extend((attr,), getattr(self, '_kwarg_render'))
+
+    def __reduce__(self):
+        # Ship the flattened arguments rather than the chain of parents
+        return (_command, (tuple(self._args), getattr(self, '_kwarg_render')))
+
+    def _count_processes(self) -> int:
+        count = 1
+        for arg in self._args:
+            if isinstance(arg, (ReadSubstitute, WriteSubstitute)):
+                count += arg.expression._count_processes()
+            elif isinstance(arg, UncompiledArgument):
+                count += arg.value.expression._count_processes()
+        return count
 
     def _run(
         self,
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
     ) -> RunResult:
-        opened_processes: List[subprocess.Popen] = []
-        opened_files: List[ShalchemyOutputStream] = []
-        opened_directories: List[str] = []
-        opened_stream_pipes: List[StreamPipe] = []
+        if context is None:
+            context = RunResult()
         prepared_args: List[Union[WriteSubstitutePreparation, ReadSubstitutePreparation]] = []
         arguments: List[str] = []
+        pass_fds: List[int] = []
 
-        for arg in self._args:
-            if isinstance(arg, (ReadSubstitute, WriteSubstitute)):
-                preparation = arg._prepare(
-                    stdin=stdin,
-                    stdout=stdout,
-                    stderr=stderr,
-                )
-                prepared_args.append(preparation)
-                arguments.append(preparation.filename)
-            elif isinstance(arg, UncompiledArgument):
-                preparation = arg.value._prepare(
-                    stdin=stdin,
-                    stdout=stdout,
-                    stderr=stderr,
+        try:
+            for arg in self._args:
+                if isinstance(arg, (ReadSubstitute, WriteSubstitute)):
+                    preparation = arg._prepare(
+                        stdin=stdin,
+                        stdout=stdout,
+                        stderr=stderr,
+                        context=context,
+                    )
+                    prepared_args.append(preparation)
+                    arguments.append(preparation.filename)
+                    pass_fds.extend(preparation.pass_fds)
+                elif isinstance(arg, UncompiledArgument):
+                    preparation = arg.value._prepare(
+                        stdin=stdin,
+                        stdout=stdout,
+                        stderr=stderr,
+                        context=context,
+                    )
+                    compiled_args = arg.compile(preparation.filename)
+                    prepared_args.append(preparation)
+                    arguments.extend(compiled_args)
+                    pass_fds.extend(preparation.pass_fds)
+                elif isinstance(arg, GlobArgument):
+                    arguments.extend(arg.expand(context.options))
+                else:
+                    arguments.append(arg)
+
+            options = context.options
+            gated = options.has_scheduling() and options.applies_after_spawn()
+            with trace.span('spawn', 'spawn', self):
+                process = subprocess.Popen(
+                    options.gated(arguments) if gated else arguments,
+                    stdin=cast(Union[IO, int, None], stdin),
+                    stdout=cast(Union[IO, int, None], stdout),
+                    stderr=cast(Union[IO, int, None], stderr),
+                    pass_fds=pass_fds,
+                    start_new_session=context.new_session,
+                    **options.popen_kwargs(),
                 )
-                compiled_args = arg.compile(preparation.filename)
-                prepared_args.append(preparation)
-                arguments.extend(compiled_args)
-            else:
-                arguments.append(arg)
-
-        process = subprocess.Popen(
-            arguments,
-            stdin=cast(Union[IO, int, None], stdin),
-            stdout=cast(Union[IO, int, None], stdout),
-            stderr=cast(Union[IO, int, None], stderr),
-        )
+                if gated:
+                    process.args = arguments
+                    options.release(process)
+        except BaseException:
+            # Nothing will be handed the substitutions' descriptors now
+            for preparation in prepared_args:
+                preparation._abort()
+            raise
+        context.add_process(process, self)
 
         for preparation in prepared_args:
-            context = preparation._run()
-            opened_processes.extend(context.processes)
-            opened_files.extend(context.files)
-            opened_directories.extend(context.directories)
-            opened_stream_pipes.extend(context.stream_pipes)
-
-        return RunResult(
-            main=process,
-            processes=[*opened_processes, process],
-            files=opened_files,
-            directories=opened_directories,
-            stream_pipes=opened_stream_pipes,
-        )
+            preparation._run(context)
+
+        context.main = process
+        return context
 
     def _repr(self, paren: ParenthesisKind):
+        import shlex
         result = []
         for arg in self._args:
             if isinstance(arg, str):
@@ -237,7 +408,13 @@ class CommandExpression(ShalchemyExpression):
         return f'$({self._repr(ParenthesisKind.NEVER)})'
 
 
+def _command(args: Sequence[Union[str, UncompiledArgument]], render: KeywordArgumentRenderer) -> CommandExpression:
+    return CommandExpression(*args, _kwarg_render=render)
+
+
 class PipeExpression(ShalchemyExpression):
+    __slots__ = ('lhs', 'rhs')
+
     lhs: ShalchemyExpression
     rhs: ShalchemyExpression
 
@@ -246,6 +423,8 @@ class PipeExpression(ShalchemyExpression):
             raise TypeError(f'{repr(lhs)} must be an ShalchemyExpression')
         if not is_shalchemy_expression(rhs):
             raise TypeError(f'{repr(rhs)} must be an ShalchemyExpression')
+        if not rhs._reads_stdin:
+            raise ValueError(f'{repr(rhs)} does not read stdin, so nothing can be piped into it')
         self.lhs = lhs
         self.rhs = rhs
 
@@ -254,24 +433,31 @@ class PipeExpression(ShalchemyExpression):
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
     ) -> RunResult:
-        context_lhs = self.lhs._run(
+        if context is None:
+            context = RunResult()
+        self.lhs._run(
             stdin=stdin,
             stdout=subprocess.PIPE,
             stderr=stderr,
+            context=context,
         )
-        context_rhs = self.rhs._run(
-            stdin=cast(io.IOBase, context_lhs.main.stdout),
-            stdout=stdout,
-            stderr=stderr,
-        )
-        return RunResult(
-            main=context_rhs.main,
-            processes=[*context_lhs.processes, *context_rhs.processes],
-            files=[*context_lhs.files, *context_rhs.files],
-            directories=[*context_lhs.directories, *context_rhs.directories],
-            stream_pipes=[*context_lhs.stream_pipes, *context_rhs.stream_pipes],
-        )
+        pipe = cast(io.IOBase, context.main.stdout)
+        try:
+            return self.rhs._run(
+                stdin=pipe,
+                stdout=stdout,
+                stderr=stderr,
+                context=context,
+            )
+        finally:
+            # The rhs has its own copy now. Keeping ours would stop the lhs
+            # from getting SIGPIPE when the rhs exits early.
+            pipe.close()
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes() + self.rhs._count_processes()
 
     def _repr(self, paren: ParenthesisKind = ParenthesisKind.COMPOUND_ONLY):
         repr_lhs = self.lhs._repr(ParenthesisKind.COMPOUND_ONLY)
@@ -286,57 +472,62 @@ class PipeExpression(ShalchemyExpression):
 
 
 class RedirectInExpression(ShalchemyExpression):
+    __slots__ = ('lhs', 'rhs')
+
     lhs: ShalchemyExpression
     rhs: ShalchemyFile
 
     def __init__(self, lhs: ShalchemyExpression, rhs: ShalchemyFile):
         self.lhs = lhs
         self.rhs = rhs
-        if not isinstance(rhs, (io.IOBase, str)):
-            raise TypeError('Expected a str or io.IOBase', rhs)
+        if not isinstance(rhs, (io.IOBase, str)) and not hasattr(rhs, '__iter__'):
+            raise TypeError('Expected a str, io.IOBase or an iterable', rhs)
+        if not lhs._reads_stdin:
+            raise ValueError(f'{repr(lhs)} does not read stdin, so it cannot be redirected')
 
-    def _make_os_file(self, file: ShalchemyFile) -> FileResult:
+    def _make_os_file(self, file: ShalchemyFile, options: SpawnOptions = DEFAULT_OPTIONS) -> FileResult:
         if isinstance(file, str):
-            osfile = cast(io.IOBase, open(file, 'rb'))
+            osfile = cast(io.IOBase, open(options.resolve(file), 'rb'))
             return FileResult(fileno=osfile.fileno(), open_files=[osfile])
 
-        try:
-            fileno = file.fileno()
-            return FileResult(fileno)
-        except io.UnsupportedOperation:
-            pass
+        if isinstance(file, io.IOBase):
+            try:
+                fileno = file.fileno()
+                return FileResult(fileno)
+            except io.UnsupportedOperation:
+                pass
 
-        tf: io.IOBase
-        if isinstance(file, io.BytesIO):
-            tf = cast(io.IOBase, TemporaryFile('wb+'))
-            tf.write(file.read())
-            tf.seek(0)
-        else:
-            tf = cast(io.IOBase, TemporaryFile('wt+'))
-            tf.write(file.read())
-            tf.seek(0)
-        return FileResult(tf.fileno(), open_files=[tf])
+        # StringIO, BytesIO and iterables of str or bytes are fed to the
+        # command through a pipe, as the command reads
+        from .reactor import pump_from
+        reader, stream = pump_from(file)
+        return FileResult(reader, streams=[stream], close_after_spawn=reader)
 
     def _run(
         self,
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
     ) -> RunResult:
-        file_result = self._make_os_file(self.rhs)
+        if context is None:
+            context = RunResult()
+        file_result = self._make_os_file(self.rhs, context.options)
+        context.files.extend(file_result.open_files)
+        context.streams.extend(file_result.streams)
 
-        context_lhs = self.lhs._run(
-            stdin=file_result.fileno,
-            stdout=stdout,
-            stderr=stderr,
-        )
-        return RunResult(
-            main=context_lhs.main,
-            processes=context_lhs.processes,
-            files=[*context_lhs.files, *file_result.open_files],
-            directories=context_lhs.directories,
-            stream_pipes=context_lhs.stream_pipes,
-        )
+        try:
+            return self.lhs._run(
+                stdin=file_result.fileno,
+                stdout=stdout,
+                stderr=stderr,
+                context=context,
+            )
+        finally:
+            file_result.spawned()
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes()
 
     def _repr(self, paren: ParenthesisKind):
         return f'{self.lhs._repr(ParenthesisKind.COMPOUND_ONLY)} < {represent_file(self.rhs)}'
@@ -346,30 +537,28 @@ class RedirectInExpression(ShalchemyExpression):
 
 
 class RedirectOutExpression(ShalchemyExpression):
+    __slots__ = ('lhs', 'rhs', 'append', 'redirect_stderr')
+
     lhs: ShalchemyExpression
     rhs: ShalchemyFile
     redirect_stderr: bool
     append: bool
-    _parents: List[ShalchemyExpression]
-    _process: subprocess.Popen
-    _file: io.TextIOWrapper
 
     def __init__(self, lhs, rhs, append: bool = False, stderr=False):
         self.lhs = lhs
         self.rhs = rhs
         self.append = append
         self.redirect_stderr = stderr
-        self._parents = []
 
 
-    def _make_os_file(self, file: ShalchemyFile, append: bool) -> FileResult:
+    def _make_os_file(self, file: ShalchemyFile, append: bool, options: SpawnOptions = DEFAULT_OPTIONS) -> FileResult:
         if isinstance(file, str):
             if file == '&1':
                 return FileResult(fileno=subprocess.STDOUT, open_files=[])
             elif file == '&2':
                 raise ValueError('Redirects to stderr (&2) is unsupported')
             mode = 'ab' if append else 'wb'
-            osfile = open(file, mode)
+            osfile = open(options.resolve(file), mode)
             return FileResult(fileno=osfile.fileno(), open_files=[cast(io.IOBase, osfile)])
 
         try:
@@ -384,51 +573,52 @@ class RedirectOutExpression(ShalchemyExpression):
         except io.UnsupportedOperation:
             pass
 
-        tf: io.IOBase
-        if isinstance(file, io.BytesIO):
-            tf = cast(io.IOBase, TemporaryFile('w+b'))
-            tf.write(file.read())
-            tf.seek(0)
-        else:
-            tf = cast(io.IOBase, TemporaryFile('w+t'))
-            tf.write(file.read())
-            tf.seek(0)
-        return FileResult(
-            tf.fileno(),
-            open_files=[tf],
-            stream_pipes=[StreamPipe(source=tf, dest=file, append=append)],
-        )
+        # Python-only streams are filled through a pipe while the command runs
+        if not append:
+            try:
+                file.truncate(0)
+                file.seek(0)
+            except io.UnsupportedOperation:
+                pass
+        from .reactor import pump_to
+        writer, stream = pump_to(file)
+        return FileResult(writer, streams=[stream], close_after_spawn=writer)
 
     def _run(
         self,
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
     ) -> RunResult:
+        if context is None:
+            context = RunResult()
         actual_stdout: Optional[ShalchemyOutputStream]
         actual_stderr: Optional[ShalchemyOutputStream]
         file_result: FileResult
         if self.redirect_stderr:
-            file_result = self._make_os_file(self.rhs, self.append)
+            file_result = self._make_os_file(self.rhs, self.append, context.options)
             actual_stdout = stdout
             actual_stderr = file_result.fileno
         else:
-            file_result = self._make_os_file(self.rhs, self.append)
+            file_result = self._make_os_file(self.rhs, self.append, context.options)
             actual_stdout = file_result.fileno
             actual_stderr = stderr
+        context.files.extend(file_result.open_files)
+        context.streams.extend(file_result.streams)
 
-        context_lhs = self.lhs._run(
-            stdin=stdin,
-            stdout=actual_stdout,
-            stderr=actual_stderr,
-        )
-        return RunResult(
-            main=context_lhs.main,
-            processes=context_lhs.processes,
-            files=[*context_lhs.files, *file_result.open_files],
-            directories=context_lhs.directories,
-            stream_pipes=[*context_lhs.stream_pipes, *file_result.stream_pipes],
-        )
+        try:
+            return self.lhs._run(
+                stdin=stdin,
+                stdout=actual_stdout,
+                stderr=actual_stderr,
+                context=context,
+            )
+        finally:
+            file_result.spawned()
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes()
 
     def _repr(self, paren: ParenthesisKind):
         if self.redirect_stderr and self.append:
@@ -446,39 +636,283 @@ class RedirectOutExpression(ShalchemyExpression):
         return f'$({self._repr(ParenthesisKind.NEVER)})'
 
 
+class OptionsExpression(ShalchemyExpression):
+    __slots__ = ('lhs', 'options')
+
+    lhs: ShalchemyExpression
+    options: SpawnOptions
+
+    def __init__(self, lhs: ShalchemyExpression, options: SpawnOptions):
+        if not is_shalchemy_expression(lhs):
+            raise TypeError(f'{repr(lhs)} must be an ShalchemyExpression')
+        self.lhs = lhs
+        self.options = options
+
+    @property
+    def _reads_stdin(self) -> bool:  # type: ignore
+        return self.lhs._reads_stdin
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        outer = context.options
+        context.options = outer.merged(self.options)
+        try:
+            return self.lhs._run(
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                context=context,
+            )
+        finally:
+            context.options = outer
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes()
+
+    def _repr(self, paren: ParenthesisKind):
+        return f'{self.lhs._repr(ParenthesisKind.COMPOUND_ONLY)} [{self.options.describe()}]'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
+
+
+class LimitedExpression(ShalchemyExpression):
+    # Bounds how much output is kept when the expression is captured into
+    # Python. Output going to a pipe or a file isn't affected.
+    __slots__ = ('lhs', 'limit', 'stderr_limit')
+
+    lhs: ShalchemyExpression
+    limit: 'CaptureLimit'
+    stderr_limit: Optional['CaptureLimit']
+
+    def __init__(self, lhs: ShalchemyExpression, limit: 'CaptureLimit', stderr_limit: Optional['CaptureLimit'] = None):
+        if not is_shalchemy_expression(lhs):
+            raise TypeError(f'{repr(lhs)} must be an ShalchemyExpression')
+        self.lhs = lhs
+        self.limit = limit
+        self.stderr_limit = stderr_limit
+
+    @property
+    def _reads_stdin(self) -> bool:  # type: ignore
+        return self.lhs._reads_stdin
+
+    def __bytes__(self):
+        from .capture import capture, forward
+        from .runner import _DEFAULT_STDERR, _defaults, _first_set
+        captured = capture(self.lhs, self.limit, self.stderr_limit)
+        if self.stderr_limit is not None:
+            forward(captured.stderr, _first_set(_defaults.get().stderr, _DEFAULT_STDERR))
+        return captured.stdout
+
+    def capture(self) -> 'Capture':
+        from .capture import UNLIMITED, capture
+        return capture(self.lhs, self.limit, self.stderr_limit or UNLIMITED)
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        # Streamed, piped or redirected, the output goes through a stage
+        # that applies the limits on the way
+        from .capture import enforce
+        from .threaded import ThreadedProcess
+        if context is None:
+            context = RunResult()
+        first = len(context.processes)
+        # Merged into stdout already, with 2>&1
+        limit_stderr = self.stderr_limit is not None and stderr != subprocess.STDOUT
+        out_reader, out_writer = os.pipe()
+        err_reader, err_writer = os.pipe() if limit_stderr else (None, None)
+        try:
+            main = self.lhs._run(
+                stdin=stdin,
+                stdout=out_writer,
+                stderr=err_writer if err_writer is not None else stderr,
+                context=context,
+            ).main
+        except BaseException:
+            for fd in (out_reader, err_reader):
+                if fd is not None:
+                    os.close(fd)
+            raise
+        finally:
+            for fd in (out_writer, err_writer):
+                if fd is not None:
+                    os.close(fd)
+        stages = context.processes[first:]
+
+        if err_reader is not None:
+            stderr_limit = cast('CaptureLimit', self.stderr_limit)
+            destination = 2 if stderr is None else stderr
+            try:
+                process = ThreadedProcess(
+                    lambda process: enforce(process, 'stderr', stderr_limit, context, stages),
+                    stdin=err_reader,
+                    stdout=destination,
+                    stderr=destination,
+                    name='limit stderr',
+                )
+            finally:
+                os.close(err_reader)
+            context.add_process(process, self, kind='limit')
+        try:
+            process = ThreadedProcess(
+                lambda process: enforce(process, 'stdout', self.limit, context, stages, main),
+                stdin=out_reader,
+                stdout=stdout,
+                stderr=stderr,
+                name='limit stdout',
+            )
+        finally:
+            os.close(out_reader)
+        context.add_process(process, self, kind='limit')
+        # Stands in for the limited stage, exit status included
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes()
+
+    def _repr(self, paren: ParenthesisKind):
+        limits = f'stdout {self.limit.describe()}'
+        if self.stderr_limit is not None:
+            limits += f', stderr {self.stderr_limit.describe()}'
+        return f'{self.lhs._repr(ParenthesisKind.COMPOUND_ONLY)} [{limits}]'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
+
+
+class MeterExpression(ShalchemyExpression):
+    # Runs one of the expression's streams through a relay thread that counts
+    # what passes, instead of connecting it straight to the other end. The
+    # counters end up in the RunResult's `meters` under `name`.
+    __slots__ = ('lhs', 'name', 'stream')
+
+    lhs: ShalchemyExpression
+    name: str
+    stream: str
+
+    def __init__(self, lhs: ShalchemyExpression, name: str, stream: str = 'stdout'):
+        if not is_shalchemy_expression(lhs):
+            raise TypeError(f'{repr(lhs)} must be an ShalchemyExpression')
+        if stream not in ('stdin', 'stdout'):
+            raise ValueError("stream must be 'stdin' or 'stdout'", stream)
+        if stream == 'stdin' and not lhs._reads_stdin:
+            raise ValueError(f'{repr(lhs)} does not read stdin, so there is nothing to meter')
+        self.lhs = lhs
+        self.name = name
+        self.stream = stream
+
+    @property
+    def _reads_stdin(self) -> bool:  # type: ignore
+        return self.lhs._reads_stdin
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        from .meter import Meter, relay, relay_output
+        from .threaded import ThreadedProcess
+        if context is None:
+            context = RunResult()
+        if self.name in context.meters:
+            raise ValueError(f'There is already a meter called {self.name!r}')
+        meter = context.meters[self.name] = Meter(self.name)
+        reader, writer = os.pipe()
+        if self.stream == 'stdin':
+            try:
+                process = ThreadedProcess(
+                    lambda process: relay(process, meter),
+                    stdin=stdin,
+                    stdout=writer,
+                    stderr=stderr,
+                    name=f'meter {self.name}',
+                )
+            finally:
+                os.close(writer)
+            context.add_process(process, self, kind='meter')
+            try:
+                main = self.lhs._run(stdin=reader, stdout=stdout, stderr=stderr, context=context).main
+            finally:
+                os.close(reader)
+            context.main = main
+            return context
+
+        try:
+            main = self.lhs._run(stdin=stdin, stdout=writer, stderr=stderr, context=context).main
+        finally:
+            os.close(writer)
+        try:
+            process = ThreadedProcess(
+                lambda process: relay_output(process, meter, main),
+                stdin=reader,
+                stdout=stdout,
+                stderr=stderr,
+                name=f'meter {self.name}',
+            )
+        finally:
+            os.close(reader)
+        context.add_process(process, self, kind='meter')
+        # Stands in for the metered stage, exit status included
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return self.lhs._count_processes()
+
+    def _repr(self, paren: ParenthesisKind):
+        return f'{self.lhs._repr(ParenthesisKind.COMPOUND_ONLY)} [meter {self.stream} {self.name}]'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
+
+
 class ProcessSubstituteExpression:
-    pass
+    __slots__ = ()
 
 
 class ReadSubstitute(ProcessSubstituteExpression):
-    __doc__ = textwrap.dedent(
-        '''
-            Process substitution is a technique to make the output of a command
-            look like a file to the receiving process. One very common use of
-            this is when using the diff command. Suppose you wanted to diff the
-            file you have on disk with something on the internet. Normally, you
-            would do:
+    """
+    Process substitution is a technique to make the output of a command
+    look like a file to the receiving process. One very common use of
+    this is when using the diff command. Suppose you wanted to diff the
+    file you have on disk with something on the internet. Normally, you
+    would do:
 
-            curl example.com/file.txt > tempfile.txt
-            diff file.txt tempfile.txt
-            rm tempfile.txt
+    curl example.com/file.txt > tempfile.txt
+    diff file.txt tempfile.txt
+    rm tempfile.txt
 
-            But actually you can do:
+    But actually you can do:
 
-            diff file.txt <(curl example.com/file.txt)
+    diff file.txt <(curl example.com/file.txt)
 
-            The <(command) syntax makes sh create a "file" in /dev/fd/xxxx. This
-            is called Process Substitution.
+    The <(command) syntax makes sh create a "file" in /dev/fd/xxxx. This
+    is called Process Substitution.
 
-            The way you do the same with shalchemy is:
-            diff('file.txt', curl('example.com/file.txt').read_sub())
+    The way you do the same with shalchemy is:
+    diff('file.txt', curl('example.com/file.txt').read_sub())
 
-            Once an expression's `read_sub` method is called, the result is a
-            ProcessSubstituteExpression which can no longer be composed with
-            other expressions. It can only be used as an argument directly to
-            other commands.
-        '''
-    ).strip()
+    Once an expression's `read_sub` method is called, the result is a
+    ProcessSubstituteExpression which can no longer be composed with
+    other expressions. It can only be used as an argument directly to
+    other commands.
+    """
+    __slots__ = ('expression',)
 
     expression: ShalchemyExpression
 
@@ -490,12 +924,14 @@ class ReadSubstitute(ProcessSubstituteExpression):
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: RunResult,
     ) -> ReadSubstitutePreparation:
         return ReadSubstitutePreparation(
             self.expression,
             stdin,
             stdout,
-            stderr
+            stderr,
+            context,
         )
 
     def _repr(self, paren: ParenthesisKind = None):
@@ -506,43 +942,43 @@ class ReadSubstitute(ProcessSubstituteExpression):
 
 
 class WriteSubstitute:
-    __doc__ = textwrap.dedent(
-        '''
-            Process write substitution is a technique to make the output of a
-            command look like a file to the receiving process. Write
-            substitution is less commonly used than read substitution, but
-            here's one (contrived) use-case:
-
-            Suppose for some reason you want tee to write the output of a
-            command to two different files. But one of them has to be uppercase
-            for whatever reason and the other has to be lowercase. Also you
-            want to see it in stdin. Normally what you would do is:
-
-            some_command | tee upper.txt lower.txt
-            tr [a-z] [A-Z] < upper.txt > actual_upper.txt
-            mv actual_upper.txt upper.txt
-            tr [A-A] [a-z] < lower.txt > actual_lower.txt
-            mv actual_lower.txt lower.txt
-
-            Very ugly. With write substitution you can do this instead:
-
-            some_command | tee >(tr [a-z] [A-Z] > upper.txt) >(tr [A-Z] [a-z] > lower.txt)            
-
-            The >(command) syntax makes sh create a "file" in /dev/fd/xxxx.
-            This is called Process Substitution.
-
-            The way you do the same with shalchemy is:
-            sh('some_command') | tee(
-                tr('[a-z]', '[A-Z]') > 'upper.txt').write_sub,
-                tr('[A-Z]', '[a-z]') > 'lower.txt').write_sub,
-            )
+    """
+    Process write substitution is a technique to make the output of a
+    command look like a file to the receiving process. Write
+    substitution is less commonly used than read substitution, but
+    here's one (contrived) use-case:
+
+    Suppose for some reason you want tee to write the output of a
+    command to two different files. But one of them has to be uppercase
+    for whatever reason and the other has to be lowercase. Also you
+    want to see it in stdin. Normally what you would do is:
+
+    some_command | tee upper.txt lower.txt
+    tr [a-z] [A-Z] < upper.txt > actual_upper.txt
+    mv actual_upper.txt upper.txt
+    tr [A-A] [a-z] < lower.txt > actual_lower.txt
+    mv actual_lower.txt lower.txt
+
+    Very ugly. With write substitution you can do this instead:
+
+    some_command | tee >(tr [a-z] [A-Z] > upper.txt) >(tr [A-Z] [a-z] > lower.txt)
+
+    The >(command) syntax makes sh create a "file" in /dev/fd/xxxx.
+    This is called Process Substitution.
+
+    The way you do the same with shalchemy is:
+    sh('some_command') | tee(
+        tr('[a-z]', '[A-Z]') > 'upper.txt').write_sub,
+        tr('[A-Z]', '[a-z]') > 'lower.txt').write_sub,
+    )
+
+    Once an expression's `write_sub` method is called, the result is a
+    ProcessSubstituteExpression which can no longer be composed with
+    other expressions. It can only be used as an argument directly to
+    other commands.3
+    """
+    __slots__ = ('expression',)
 
-            Once an expression's `write_sub` method is called, the result is a
-            ProcessSubstituteExpression which can no longer be composed with
-            other expressions. It can only be used as an argument directly to
-            other commands.3
-        '''
-    ).strip()
     expression: ShalchemyExpression
 
     def __init__(self, expression: ShalchemyExpression):
@@ -553,12 +989,14 @@ class WriteSubstitute:
         stdin: Optional[ShalchemyOutputStream],
         stdout: Optional[ShalchemyOutputStream],
         stderr: Optional[ShalchemyOutputStream],
+        context: RunResult,
     ) -> WriteSubstitutePreparation:
         return WriteSubstitutePreparation(
             self.expression,
             stdin,
             stdout,
-            stderr
+            stderr,
+            context,
         )
 
     def _repr(self, paren: ParenthesisKind = None):
@@ -0,0 +1,225 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import os
+import threading
+import time
+
+from .spawn import DEFAULT_OPTIONS, SpawnOptions
+from .types import ParenthesisKind
+
+
+# Directories whose listings are kept between expansions
+CACHE_SIZE = 256
+# File timestamps come from a coarse clock, so a directory changed again
+# within the same tick keeps its mtime. Listings younger than this aren't
+# cached, like git does with its index.
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+# (name, is_dir, is_symlink), where is_dir follows symlinks
+Entry = Tuple[str, bool, bool]
+
+
+class DirectoryCache:
+    # Entry listings of directories, reused for as long as the
+    # directory's mtime stays the same. Adding, removing or renaming an
+    # entry changes it. A subdirectory replaced by a symlink to a file
+    # without anything else changing is the one thing it can miss.
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._listings: Dict[str, Tuple[int, List[Entry]]] = {}
+
+    def listing(self, path: str) -> List[Entry]:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        key = os.path.abspath(path)
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is not None and cached[0] == mtime:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        entries = scan(path)
+        if time.time_ns() - mtime > RACY_WINDOW_NS:
+            with self._lock:
+                self._listings.pop(key, None)
+                while len(self._listings) >= self.size:
+                    # Dicts keep insertion order, so this is the oldest
+                    del self._listings[next(iter(self._listings))]
+                self._listings[key] = (mtime, entries)
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+cache = DirectoryCache()
+
+
+def scan(path: str) -> List[Entry]:
+    entries = []
+    try:
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    is_dir = entry.is_dir()
+                    is_symlink = entry.is_symlink()
+                except OSError:
+                    is_dir = is_symlink = False
+                entries.append((entry.name, is_dir, is_symlink))
+    except OSError:
+        pass
+    return entries
+
+
+def has_magic(component: str) -> bool:
+    return any(character in component for character in '*?[')
+
+
+_matchers: Dict[str, Callable[[str], Any]] = {}
+
+
+def matcher(component: str) -> Callable[[str], Any]:
+    if component not in _matchers:
+        import fnmatch
+        import re
+        _matchers[component] = re.compile(fnmatch.translate(component)).match
+    return _matchers[component]
+
+
+class GlobArgument:
+    # A pattern that is expanded into file names when the command runs
+    # rather than when the expression is built, relative to the cwd the
+    # command runs in. Like the shell, wildcards don't match names starting
+    # with a dot unless the pattern does, `**` matches any number of
+    # directories, and a pattern that matches nothing is passed on as it is
+    # unless `null` is set.
+    __slots__ = ('pattern', 'sort', 'cache', 'null', 'include_hidden')
+
+    pattern: str
+    sort: bool
+    cache: bool
+    null: bool
+    include_hidden: bool
+
+    def __init__(
+        self,
+        pattern: str,
+        sort: bool = True,
+        cache: bool = True,
+        null: bool = False,
+        include_hidden: bool = False,
+    ):
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError('A glob pattern must be a non-empty string', pattern)
+        self.pattern = pattern
+        self.sort = sort
+        self.cache = cache
+        self.null = null
+        self.include_hidden = include_hidden
+
+    def __reduce__(self):
+        return (GlobArgument, (self.pattern, self.sort, self.cache, self.null, self.include_hidden))
+
+    def _listing(self, path: str) -> List[Entry]:
+        return cache.listing(path) if self.cache else scan(path)
+
+    def _visible(self, name: str, component: str) -> bool:
+        return self.include_hidden or not name.startswith('.') or component.startswith('.')
+
+    def _descendants(self, prefix: str, options: SpawnOptions) -> Iterator[Entry]:
+        # Everything below prefix, for `**`, directories before their contents.
+        # Like bash's globstar it doesn't descend into symlinked directories,
+        # which could loop back up.
+        for name, is_dir, is_symlink in self._listing(options.resolve(prefix or os.curdir)):
+            if not self._visible(name, ''):
+                continue
+            path = os.path.join(prefix, name)
+            yield path, is_dir, is_symlink
+            if is_dir and not is_symlink:
+                yield from self._descendants(path, options)
+
+    def _walk(
+        self,
+        prefix: str,
+        components: Sequence[str],
+        directories_only: bool,
+        options: SpawnOptions,
+    ) -> Iterator[str]:
+        component, rest = components[0], components[1:]
+        last = not rest
+        if component == '**':
+            # Zero directories, then every directory below
+            candidates: List[str] = [prefix] if not last else []
+            for path, is_dir, is_symlink in self._descendants(prefix, options):
+                if last:
+                    # A symlink to a directory still matches a final `**/`
+                    if is_dir or not directories_only:
+                        candidates.append(path)
+                elif is_dir and not is_symlink:
+                    candidates.append(path)
+            for path in candidates:
+                if last:
+                    yield path
+                else:
+                    yield from self._walk(path, rest, directories_only, options)
+            return
+
+        if not has_magic(component):
+            path = os.path.join(prefix, component) if prefix else component
+            if not last:
+                yield from self._walk(path, rest, directories_only, options)
+            elif os.path.lexists(options.resolve(path)):
+                if not directories_only or os.path.isdir(options.resolve(path)):
+                    yield path
+            return
+
+        match = matcher(component)
+        for name, is_dir, _ in self._listing(options.resolve(prefix or os.curdir)):
+            if not match(name) or not self._visible(name, component):
+                continue
+            if not is_dir and (not last or directories_only):
+                continue
+            path = os.path.join(prefix, name) if prefix else name
+            if last:
+                yield path
+            else:
+                yield from self._walk(path, rest, directories_only, options)
+
+    def iterate(self, options: SpawnOptions = DEFAULT_OPTIONS) -> Iterator[str]:
+        # Matches one at a time, in directory order. Only useful unsorted.
+        pattern = self.pattern
+        prefix = ''
+        if os.path.isabs(pattern):
+            prefix = os.sep
+            pattern = pattern.lstrip(os.sep)
+        directories_only = pattern.endswith(os.sep)
+        components = [component for component in pattern.split(os.sep) if component]
+        if not components:
+            if os.path.lexists(options.resolve(self.pattern)):
+                yield self.pattern
+            return
+        for path in self._walk(prefix, components, directories_only, options):
+            yield path + os.sep if directories_only else path
+
+    def expand(self, options: SpawnOptions = DEFAULT_OPTIONS) -> List[str]:
+        paths = list(self.iterate(options))
+        if self.sort:
+            paths.sort()
+        if not paths and not self.null:
+            return [self.pattern]
+        return paths
+
+    def _repr(self, paren: ParenthesisKind = None):
+        # Left unquoted, which is how a shell would see it too
+        return self.pattern
+
+    def __repr__(self):
+        return f'GlobArgument({self.pattern!r})'
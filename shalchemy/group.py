@@ -0,0 +1,239 @@
+from tempfile import SpooledTemporaryFile
+from typing import Any, List, Optional
+
+import os
+import queue
+import selectors
+import subprocess
+
+from .expressions import ShalchemyExpression, is_shalchemy_expression
+from .run_result import RunResult
+from .spawn import SpawnOptions
+from .threaded import BackgroundRun, ThreadedProcess
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+
+CHUNK_SIZE = 64 * 1024
+# Per member: how much output that's ahead of its turn stays in memory
+# before the rest goes to a temporary file, or how long a line can get
+# before it's written out in pieces
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# How long the merge blocks before checking whether it was killed
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+class Member(BackgroundRun):
+    # One expression of a group, writing into a pipe the group reads
+    reader: int
+    spool: Optional[Any]
+    partial: bytearray
+    done: bool
+
+    def __init__(
+        self,
+        expression: ShalchemyExpression,
+        index: int,
+        process: ThreadedProcess,
+        finished: 'queue.Queue[Optional[Member]]',
+        options: SpawnOptions,
+        stdin: Any = subprocess.DEVNULL,
+    ):
+        self.reader, writer = os.pipe()
+        self.spool = None
+        self.partial = bytearray()
+        self.done = False
+        try:
+            super().__init__(
+                expression,
+                stdin=stdin,
+                stdout=writer,
+                stderr=process.stderr_fd,
+                finished=finished,
+                new_session=True,
+                tag=index,
+                options=options,
+            )
+        except BaseException:
+            os.close(self.reader)
+            raise
+        finally:
+            os.close(writer)
+
+    def close(self):
+        os.close(self.reader)
+        if self.spool is not None:
+            self.spool.close()
+
+
+class OrderedOutput:
+    # Writes each member's output in member order. The member whose turn it
+    # is goes straight through, the ones ahead of it are spooled, in memory
+    # up to `buffer_size` and on disk past that.
+    def __init__(self, process: ThreadedProcess, members: List[Member], buffer_size: int):
+        self.process = process
+        self.members = members
+        self.current = 0
+        for member in members[1:]:
+            member.spool = SpooledTemporaryFile(max_size=buffer_size)
+
+    def write(self, member: Member, data: bytes):
+        if member.tag == self.current:
+            self.process.write(data)
+        else:
+            member.spool.write(data)
+
+    def end(self, member: Member):
+        member.done = True
+        while self.current < len(self.members) and self.members[self.current].done:
+            self.current += 1
+            if self.current < len(self.members):
+                self._flush(self.members[self.current])
+
+    def _flush(self, member: Member):
+        spool = member.spool
+        member.spool = None
+        spool.seek(0)
+        while True:
+            data = spool.read(CHUNK_SIZE)
+            if not data:
+                break
+            self.process.write(data)
+        spool.close()
+
+
+class LineOutput:
+    # Writes whole lines as soon as any member finishes one, so lines from
+    # different members never mix. A line longer than `buffer_size` is
+    # written in pieces.
+    def __init__(self, process: ThreadedProcess, members: List[Member], buffer_size: int):
+        self.process = process
+        self.buffer_size = buffer_size
+
+    def write(self, member: Member, data: bytes):
+        partial = member.partial
+        end = data.rfind(b'\n')
+        if end == -1:
+            partial += data
+            if len(partial) >= self.buffer_size:
+                self.process.write(bytes(partial))
+                del partial[:]
+            return
+        if partial:
+            self.process.write(bytes(partial) + data[:end + 1])
+            del partial[:]
+        else:
+            self.process.write(data[:end + 1])
+        partial += data[end + 1:]
+
+    def end(self, member: Member):
+        member.done = True
+        if member.partial:
+            self.process.write(bytes(member.partial))
+            del member.partial[:]
+
+
+def merge_outputs(process: ThreadedProcess, members: List[Member], output: Any):
+    # Hands everything the members write to `output` as it arrives, until
+    # they have all closed their end or the stage is killed
+    with selectors.DefaultSelector() as selector:
+        for member in members:
+            selector.register(member.reader, selectors.EVENT_READ, member)
+        remaining = len(members)
+        while remaining and not process.cancelled.is_set():
+            for key, _ in selector.select(CANCEL_CHECK_INTERVAL):
+                member = key.data
+                data = os.read(member.reader, CHUNK_SIZE)
+                if data:
+                    output.write(member, data)
+                    continue
+                selector.unregister(member.reader)
+                remaining -= 1
+                output.end(member)
+
+
+def first_failure(members: List[Member]) -> int:
+    # The first failure in member order, like `wait` on each in turn
+    for member in members:
+        if member.returncode != 0:
+            return member.returncode if member.returncode is not None else 1
+    return 0
+
+
+class GroupExpression(ShalchemyExpression):
+    # Runs every member at once and merges their output into one stream.
+    # Like a race, members can't share one input, so they read /dev/null.
+    __slots__ = ('expressions', 'ordered', 'buffer_size')
+    _reads_stdin = False
+
+    expressions: List[ShalchemyExpression]
+    ordered: bool
+    buffer_size: int
+
+    def __init__(self, *expressions: ShalchemyExpression, ordered: bool = True, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        if not expressions:
+            raise ValueError('group needs at least one expression')
+        for expression in expressions:
+            if not is_shalchemy_expression(expression):
+                raise TypeError(f'{repr(expression)} must be an ShalchemyExpression')
+        if buffer_size < 1:
+            raise ValueError('buffer_size must be at least 1', buffer_size)
+        self.expressions = list(expressions)
+        self.ordered = ordered
+        self.buffer_size = buffer_size
+
+    def _group(self, process: ThreadedProcess, options: SpawnOptions) -> int:
+        finished: 'queue.Queue[Optional[Member]]' = queue.Queue()
+        members: List[Member] = []
+        try:
+            for index, expression in enumerate(self.expressions):
+                if process.cancelled.is_set():
+                    break
+                members.append(Member(expression, index, process, finished, options))
+            else:
+                output_class = OrderedOutput if self.ordered else LineOutput
+                merge_outputs(process, members, output_class(process, members, self.buffer_size))
+        finally:
+            if process.cancelled.is_set() or any(not member.done for member in members):
+                for member in members:
+                    member.kill()
+            for _ in members:
+                finished.get()
+            for member in members:
+                member.close()
+
+        if process.cancelled.is_set():
+            return -9
+        return first_failure(members)
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        options = context.options
+        process = ThreadedProcess(
+            lambda process: self._group(process, options),
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            name=self._repr(ParenthesisKind.NEVER),
+        )
+        context.add_process(process, self)
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return sum(expression._count_processes() for expression in self.expressions)
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        inner = ', '.join(expression._repr(ParenthesisKind.NEVER) for expression in self.expressions)
+        if not self.ordered:
+            inner += ', ordered=False'
+        return f'group({inner})'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
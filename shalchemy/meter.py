@@ -0,0 +1,153 @@
+from typing import Any, Deque, Optional, Tuple
+
+import collections
+import errno
+import os
+import select
+import time
+
+from .threaded import ThreadedProcess
+
+
+# At most one throughput sample per interval, kept for the window
+SAMPLE_INTERVAL = 0.01
+THROUGHPUT_WINDOW = 1.0
+# How long a relay blocks before checking whether it was killed
+CANCEL_CHECK_INTERVAL = 0.1
+# splice moves at most a pipe buffer per call anyway
+CHUNK_SIZE = 1024 * 1024
+
+
+class Meter:
+    # Counters for one metered edge, updated live by its relay.
+    # `starved` is time spent waiting for the writer to produce data,
+    # `stalled` time spent waiting for the reader to make room.
+    name: str
+    transferred: int
+    starved: float
+    stalled: float
+    started: Optional[float]
+    finished: Optional[float]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.transferred = 0
+        self.starved = 0.0
+        self.stalled = 0.0
+        self.started = None
+        self.finished = None
+        self._samples: Deque[Tuple[float, int]] = collections.deque()
+
+    def _start(self):
+        self.started = time.monotonic()
+        self._samples.append((self.started, 0))
+
+    def _add(self, count: int):
+        self.transferred += count
+        now = time.monotonic()
+        if now - self._samples[-1][0] >= SAMPLE_INTERVAL:
+            self._samples.append((now, self.transferred))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= THROUGHPUT_WINDOW:
+                self._samples.popleft()
+
+    def _finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def throughput(self) -> float:
+        # Bytes per second over about the last second, or over the whole
+        # run once it's done
+        if self.finished is not None or not self._samples:
+            return self.transferred / self.elapsed if self.elapsed else 0.0
+        since, transferred = self._samples[0]
+        duration = time.monotonic() - since
+        return (self.transferred - transferred) / duration if duration else 0.0
+
+    def __repr__(self):
+        return (
+            f'Meter({self.name!r}, transferred={self.transferred}, throughput={self.throughput:.0f}/s, '
+            f'starved={self.starved:.3f}s, stalled={self.stalled:.3f}s)'
+        )
+
+
+def _wait_for(process: ThreadedProcess, fd: int, event: int) -> bool:
+    # Returns False if the relay was killed while waiting
+    poller = select.poll()
+    poller.register(fd, event)
+    while not process.cancelled.is_set():
+        if poller.poll(CANCEL_CHECK_INTERVAL * 1000):
+            return True
+    return False
+
+
+def _ready(fd: int, event: int) -> bool:
+    poller = select.poll()
+    poller.register(fd, event)
+    return bool(poller.poll(0))
+
+
+def relay(process: ThreadedProcess, meter: Meter, splice: bool = True):
+    # Copies the relay's stdin to its stdout, counting as it goes. splice
+    # moves the data between the pipes inside the kernel. Where it can't,
+    # such as from a terminal, it falls back to read and write.
+    source = process.stdin_fd
+    dest = process.stdout_fd
+    flags = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+    splice = splice and hasattr(os, 'splice')
+    meter._start()
+    try:
+        while True:
+            count: Optional[int] = None
+            if splice:
+                try:
+                    count = os.splice(source, dest, CHUNK_SIZE, flags=flags)
+                except BlockingIOError:
+                    pass
+                except OSError as error:
+                    if error.errno != errno.EINVAL:
+                        raise
+                    splice = False
+                    continue
+            elif _ready(source, select.POLLIN) and _ready(dest, select.POLLOUT):
+                data = os.read(source, 64 * 1024)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(dest, view):]
+                count = len(data)
+            if count == 0:
+                return
+            if count:
+                meter._add(count)
+                continue
+            # Nothing moved. Find out which side we're waiting on.
+            waited = time.monotonic()
+            if not _ready(source, select.POLLIN):
+                if not _wait_for(process, source, select.POLLIN):
+                    return
+                meter.starved += time.monotonic() - waited
+            else:
+                if not _wait_for(process, dest, select.POLLOUT):
+                    return
+                meter.stalled += time.monotonic() - waited
+    except BrokenPipeError:
+        # The reader is gone. Closing our input passes that on upstream.
+        pass
+    finally:
+        meter._finish()
+
+
+def relay_output(process: ThreadedProcess, meter: Meter, main: Any) -> int:
+    # Meters a stage's output and then reports its exit status as our own,
+    # so the relay can stand in for it as the last process of a run
+    relay(process, meter)
+    for attribute in ('stdin_fd', 'stdout_fd'):
+        os.close(getattr(process, attribute))
+        setattr(process, attribute, -1)
+    return main.wait()
@@ -0,0 +1,26 @@
+from typing import Any, Callable, Iterable, List, Optional
+
+import multiprocessing
+
+
+def start_method() -> str:
+    # Forking a parent that runs the reactor and reaper threads can leave a
+    # worker holding one of their locks, so workers come from a fork server
+    # where there is one
+    methods = multiprocessing.get_all_start_methods()
+    return 'forkserver' if 'forkserver' in methods else 'spawn'
+
+
+def process_map(
+    function: Callable[[Any], Any],
+    expressions: Iterable[Any],
+    max_workers: Optional[int] = None,
+    chunksize: int = 1,
+) -> List[Any]:
+    # Calls `function(expression)` for every expression in a pool of worker
+    # processes and returns the results in order. Both are pickled, so
+    # `function` has to be importable by name.
+    from concurrent.futures import ProcessPoolExecutor
+    context = multiprocessing.get_context(start_method())
+    with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+        return list(executor.map(function, expressions, chunksize=chunksize))
@@ -1,10 +1,41 @@
-from typing import cast, List
+from typing import cast, List, Optional
 import argparse
 import io
 import json
 import os
 import sys
-import select
+import time
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def read_chunks(fd: int, chunk_size: int = CHUNK_SIZE):
+    # Blocking reads, the process sleeps until there is data or EOF
+    while True:
+        data = os.read(fd, chunk_size)
+        if not data:
+            return
+        yield data
+
+
+def pace(started: float, done: float, rate: Optional[float]):
+    # Sleep until `done` units are due at `rate` units per second
+    if not rate:
+        return
+    delay = started + done / rate - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def report(fields: dict):
+    print(json.dumps(fields), flush=True)
 
 
 def run_complain(args: argparse.Namespace, rest: List[str]):
@@ -26,18 +57,12 @@ def run_errcat(args: argparse.Namespace, rest: List[str]):
             with open(fname, 'r') as fileobj:
                 sys.stderr.write(fileobj.read())
         return
-    while True:
-        ready, _, _ = select.select([sys.stdin], [], [], 0.0)
-        stdin_fd = sys.stdin.fileno()
-        stdout_fd = sys.stdout.fileno()
-        stderr_fd = sys.stderr.fileno()
-        if sys.stdin in ready:
-            data = os.read(stdin_fd, 4096)
-            if len(data) == 0:
-                break
-            if args.both:
-                os.write(stdout_fd, data)
-            os.write(stderr_fd, data)
+    stdout_fd = sys.stdout.fileno()
+    stderr_fd = sys.stderr.fileno()
+    for data in read_chunks(sys.stdin.fileno()):
+        if args.both:
+            write_all(stdout_fd, data)
+        write_all(stderr_fd, data)
 
 
 def run_kwcat(args: argparse.Namespace, rest: List[str]):
@@ -57,17 +82,11 @@ def run_kwtee(args: argparse.Namespace, rest: List[str]):
             fp = cast(io.IOBase, open(filename, 'wb'))
             files.append(fp)
 
-    stdin_fd = sys.stdin.fileno()
     stdout_fd = sys.stdout.fileno()
-    while True:
-        ready, _, _ = select.select([sys.stdin], [], [], 0.0)
-        if sys.stdin in ready:
-            data = os.read(stdin_fd, 4096)
-            if len(data) == 0:
-                break
-            for file in files:
-                file.write(data)
-            os.write(stdout_fd, data)
+    for data in read_chunks(sys.stdin.fileno()):
+        for file in files:
+            file.write(data)
+        write_all(stdout_fd, data)
 
     for file in files:
         file.close()
@@ -77,6 +96,77 @@ def run_args(args: argparse.Namespace, rest: List[str]):
     print(json.dumps(sys.argv))
 
 
+def run_produce(args: argparse.Namespace, rest: List[str]):
+    stdout_fd = sys.stdout.fileno()
+    started = time.monotonic()
+    try:
+        if args.lines is not None:
+            line = b'x' * max(args.line_size - 1, 0) + b'\n'
+            # Write several lines per syscall unless pacing needs them one by one
+            per_write = 1 if args.rate else max(1, args.chunk_size // len(line))
+            written = 0
+            while written < args.lines:
+                count = min(per_write, args.lines - written)
+                write_all(stdout_fd, line * count)
+                written += count
+                pace(started, written, args.rate)
+        else:
+            chunk = b'x' * args.chunk_size
+            written = 0
+            while written < args.bytes:
+                size = min(args.chunk_size, args.bytes - written)
+                write_all(stdout_fd, chunk[:size])
+                written += size
+                pace(started, written, args.rate)
+    except BrokenPipeError:
+        # The reader went away, that's how `produce | head` ends. Nothing
+        # is buffered in sys.stdout since we write to the fd directly.
+        pass
+
+
+def run_consume(args: argparse.Namespace, rest: List[str]):
+    started = time.monotonic()
+    total = 0
+    chunks = 0
+    for data in read_chunks(sys.stdin.fileno(), args.chunk_size):
+        total += len(data)
+        chunks += 1
+    elapsed = time.monotonic() - started
+    report({
+        'bytes': total,
+        'chunks': chunks,
+        'seconds': elapsed,
+        'bytes_per_second': total / elapsed if elapsed > 0 else 0.0,
+    })
+
+
+def run_slowsink(args: argparse.Namespace, rest: List[str]):
+    started = time.monotonic()
+    total = 0
+    for data in read_chunks(sys.stdin.fileno(), args.chunk_size):
+        total += len(data)
+        if args.delay:
+            time.sleep(args.delay)
+        pace(started, total, args.rate)
+
+
+def run_latency(args: argparse.Namespace, rest: List[str]):
+    # --since is a time.time() taken by whoever started the pipeline,
+    # otherwise measure from when this process started reading
+    started = args.since if args.since is not None else time.time()
+    first_byte: Optional[float] = None
+    total = 0
+    for data in read_chunks(sys.stdin.fileno()):
+        if first_byte is None:
+            first_byte = time.time() - started
+        total += len(data)
+    report({
+        'first_byte_seconds': first_byte,
+        'total_seconds': time.time() - started,
+        'bytes': total,
+    })
+
+
 def probe_main():
     parser = argparse.ArgumentParser(description='shalchemyprobe is a tool for testing shalchemy')
     subparsers = parser.add_subparsers()
@@ -106,6 +196,29 @@ def probe_main():
     parser_args = subparsers.add_parser('args', help='args prints out the args provided')
     parser_args.set_defaults(func=run_args)
 
+    parser_produce = subparsers.add_parser('produce', help='produce writes a number of bytes or lines to stdout')
+    amount = parser_produce.add_mutually_exclusive_group(required=True)
+    amount.add_argument('--bytes', type=int)
+    amount.add_argument('--lines', type=int)
+    parser_produce.add_argument('--line-size', type=int, default=80, help='bytes per line including the newline')
+    parser_produce.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser_produce.add_argument('--rate', type=float, help='bytes or lines per second')
+    parser_produce.set_defaults(func=run_produce)
+
+    parser_consume = subparsers.add_parser('consume', help='consume drains stdin and reports the throughput as json')
+    parser_consume.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser_consume.set_defaults(func=run_consume)
+
+    parser_slowsink = subparsers.add_parser('slowsink', help='slowsink drains stdin slowly')
+    parser_slowsink.add_argument('--chunk-size', type=int, default=4096)
+    parser_slowsink.add_argument('--delay', type=float, default=0.0, help='seconds to sleep after each read')
+    parser_slowsink.add_argument('--rate', type=float, help='bytes per second')
+    parser_slowsink.set_defaults(func=run_slowsink)
+
+    parser_latency = subparsers.add_parser('latency', help='latency reports the time until the first byte of stdin as json')
+    parser_latency.add_argument('--since', type=float, help='a time.time() timestamp to measure from')
+    parser_latency.set_defaults(func=run_latency)
+
     known, rest = parser.parse_known_args()
     if not hasattr(known, 'func'):
         parser.print_help()
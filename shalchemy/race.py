@@ -0,0 +1,145 @@
+from tempfile import TemporaryFile
+from typing import cast, List, Optional
+
+import io
+import queue
+import subprocess
+import time
+
+from .expressions import ShalchemyExpression, is_shalchemy_expression
+from .run_result import RunResult
+from .spawn import SpawnOptions
+from .threaded import BackgroundRun, ThreadedProcess, copy_file_to_fd
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+
+class Contender(BackgroundRun):
+    # One alternative of a race. Its output is spooled to a temporary file
+    # because we only know whether to use it once it has exited.
+    output: io.IOBase
+
+    def __init__(
+        self,
+        expression: ShalchemyExpression,
+        stderr: int,
+        finished: 'queue.Queue[Optional[Contender]]',
+        options: SpawnOptions,
+    ):
+        self.output = cast(io.IOBase, TemporaryFile())
+        super().__init__(
+            expression,
+            stdin=subprocess.DEVNULL,
+            stdout=self.output,
+            stderr=stderr,
+            finished=finished,
+            new_session=True,
+            options=options,
+        )
+
+    def close(self):
+        self.output.close()
+
+
+class RaceExpression(ShalchemyExpression):
+    # Alternatives can't share one stdin, so they all get /dev/null
+    __slots__ = ('alternatives', 'hedge_delay')
+    _reads_stdin = False
+
+    alternatives: List[ShalchemyExpression]
+    hedge_delay: Optional[float]
+
+    def __init__(self, *alternatives: ShalchemyExpression, hedge_delay: Optional[float] = None):
+        if not alternatives:
+            raise ValueError('race needs at least one expression')
+        for alternative in alternatives:
+            if not is_shalchemy_expression(alternative):
+                raise TypeError(f'{repr(alternative)} must be an ShalchemyExpression')
+        self.alternatives = list(alternatives)
+        self.hedge_delay = hedge_delay
+
+    def _race(self, process: ThreadedProcess, options: SpawnOptions) -> int:
+        finished: 'queue.Queue[Optional[Contender]]' = queue.Queue()
+        process.on_kill(lambda: finished.put(None))
+        pending = list(self.alternatives)
+        running: List[Contender] = []
+        contenders: List[Contender] = []
+        winner: Optional[Contender] = None
+        returncode = 1
+        next_start = time.monotonic()
+
+        try:
+            while winner is None and (pending or running) and not process.cancelled.is_set():
+                now = time.monotonic()
+                # Start the next one when its hedge delay is up, or right
+                # away if everything started so far has already failed.
+                if pending and (not running or self.hedge_delay is None or now >= next_start):
+                    contender = Contender(pending.pop(0), process.stderr_fd, finished, options)
+                    contenders.append(contender)
+                    running.append(contender)
+                    next_start = now + (self.hedge_delay or 0.0)
+                    continue
+                timeout = None
+                if pending and self.hedge_delay is not None:
+                    timeout = max(0.0, next_start - now)
+                try:
+                    done = finished.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if done is None:
+                    break
+                running.remove(done)
+                if done.returncode == 0:
+                    winner = done
+                else:
+                    returncode = done.returncode if done.returncode is not None else 1
+        finally:
+            for contender in running:
+                contender.kill()
+            # Wait for the losers to be reaped and cleaned up
+            while running:
+                done = finished.get()
+                if done is not None:
+                    running.remove(done)
+
+        try:
+            if process.cancelled.is_set():
+                return -9
+            if winner is None:
+                return returncode
+            copy_file_to_fd(winner.output, process.stdout_fd)
+            return 0
+        finally:
+            for contender in contenders:
+                contender.close()
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        options = context.options
+        process = ThreadedProcess(
+            lambda process: self._race(process, options),
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            name=self._repr(ParenthesisKind.NEVER),
+        )
+        context.add_process(process, self)
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        # With hedging every alternative can be running at the same time
+        return sum(alternative._count_processes() for alternative in self.alternatives)
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        inner = ', '.join(alternative._repr(ParenthesisKind.NEVER) for alternative in self.alternatives)
+        return f'race({inner})'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
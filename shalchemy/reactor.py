@@ -0,0 +1,393 @@
+from typing import Any, Callable, List, Optional, Tuple
+
+import codecs
+import io
+import os
+import queue
+import selectors
+import threading
+import time
+
+from . import trace
+
+
+# Chunk sizes adapt per stream between these bounds. Fast streams grow
+# towards fewer, bigger syscalls, trickling ones shrink to save memory.
+MIN_CHUNK_SIZE = 4 * 1024
+INITIAL_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+# Chunks queued between the reactor and a stream's worker thread
+QUEUE_DEPTH = 4
+
+# In-memory objects whose methods can't block or call back into user code,
+# which the reactor may copy to and from itself
+INLINE_TYPES = (io.BytesIO, io.StringIO)
+
+
+class ReactorStream:
+    # One pipe fd driven by the reactor. The reactor owns the fd and closes
+    # it once the stream is finished.
+    fd: int
+    chunk_size: int
+    transferred: int
+    error: Optional[BaseException]
+    events = selectors.EVENT_READ
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.chunk_size = INITIAL_CHUNK_SIZE
+        self.transferred = 0
+        self.error = None
+        self.started = time.monotonic()
+        # Completion runs on the reactor thread, outside the run's context
+        self.tracer = trace.active()
+        # Set when on_ready has to wait on the stream's worker rather than
+        # on the pipe, so the worker knows to resume it
+        self.paused = False
+        self._done = threading.Event()
+
+    def _adapt(self, count: int, asked: int):
+        if count >= asked:
+            self.chunk_size = min(self.chunk_size * 2, MAX_CHUNK_SIZE)
+        elif count < asked // 4:
+            self.chunk_size = max(self.chunk_size // 2, MIN_CHUNK_SIZE)
+
+    def on_ready(self) -> Optional[bool]:
+        # Returns True once there is nothing left to do, or None to stop
+        # watching the pipe until the stream's worker resumes it
+        raise NotImplementedError()
+
+    def finish(self):
+        pass
+
+    def closed(self):
+        # Called by the reactor once it has closed the fd
+        self._complete()
+
+    def _complete(self):
+        tracer = self.tracer
+        if tracer is not None:
+            name = f'{type(self).__name__} fd {self.fd}'
+            tid = tracer.track(('stream', id(self)), f'python: {name}')
+            tracer.complete(name, 'copy', self.started, time.monotonic(), tid, {'bytes': self.transferred})
+        self._done.set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+
+class ReadStream(ReactorStream):
+    # Copies everything readable from a pipe into a Python sink. Unless the
+    # sink is known not to block, it runs on a worker thread of its own that
+    # the reactor hands chunks to through a bounded queue, so a slow sink
+    # holds back its own pipe and nothing else.
+    sink: Callable[[bytes], Any]
+
+    def __init__(
+        self,
+        fd: int,
+        sink: Callable[[bytes], Any],
+        finish: Optional[Callable[[], Any]] = None,
+        inline: bool = False,
+    ):
+        super().__init__(fd)
+        self.sink = sink
+        self._finish = finish
+        self.stopped = False
+        self._lock = threading.Lock()
+        self._queue: Optional['queue.Queue[Optional[bytes]]'] = None
+        if not inline:
+            # Unbounded so the reactor never blocks on it, it stops reading
+            # instead once QUEUE_DEPTH chunks are waiting
+            self._queue = queue.Queue()
+            threading.Thread(target=self._work, name=f'shalchemy: sink fd {fd}', daemon=True).start()
+
+    def stop(self):
+        # Lets go of the pipe the next time it's readable, even if some
+        # grandchild still holds the write end
+        self.stopped = True
+
+    def on_ready(self) -> Optional[bool]:
+        if self.stopped:
+            return True
+        if self._queue is not None:
+            with self._lock:
+                if self._queue.qsize() >= QUEUE_DEPTH:
+                    self.paused = True
+                    return None
+        asked = self.chunk_size
+        try:
+            data = os.read(self.fd, asked)
+        except BlockingIOError:
+            return False
+        if not data:
+            return True
+        self._adapt(len(data), asked)
+        self.transferred += len(data)
+        if self._queue is not None:
+            self._queue.put(data)
+        else:
+            self.sink(data)
+        return False
+
+    def finish(self):
+        if self._queue is None and self._finish is not None:
+            self._finish()
+
+    def closed(self):
+        if self._queue is None:
+            self._complete()
+        else:
+            self._queue.put(None)
+
+    def _work(self):
+        assert self._queue is not None
+        failed = False
+        while True:
+            data = self._queue.get()
+            with self._lock:
+                if self.paused:
+                    self.paused = False
+                    reactor().resume(self)
+            if data is None:
+                break
+            if failed:
+                continue
+            try:
+                self.sink(data)
+            except BaseException as exc:
+                # Drain the rest so the reactor can let go of the pipe
+                self.error = exc
+                self.stopped = True
+                failed = True
+        try:
+            if not failed and self._finish is not None:
+                self._finish()
+        except BaseException as exc:
+            self.error = self.error or exc
+        finally:
+            self._complete()
+
+
+class WriteStream(ReactorStream):
+    # Feeds a Python source into a pipe. Unless the source is known not to
+    # block, a worker thread of its own pulls from it and queues chunks for
+    # the reactor to write. The queue is bounded, so the source is only read
+    # about as fast as the pipe drains.
+    source: Callable[[int], bytes]
+    events = selectors.EVENT_WRITE
+
+    def __init__(self, fd: int, source: Callable[[int], bytes], inline: bool = False):
+        super().__init__(fd)
+        self.source = source
+        self._pending = memoryview(b'')
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._queue: Optional['queue.Queue[bytes]'] = None
+        if not inline:
+            self._queue = queue.Queue(QUEUE_DEPTH)
+            threading.Thread(target=self._work, name=f'shalchemy: source fd {fd}', daemon=True).start()
+
+    def _next(self) -> Optional[bytes]:
+        # The next chunk to write, b'' at the end, or None to wait for one
+        if self._queue is None:
+            return self.source(self.chunk_size)
+        with self._lock:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                self.paused = True
+                return None
+
+    def on_ready(self) -> Optional[bool]:
+        if not self._pending:
+            data = self._next()
+            if data is None:
+                return None
+            if not data:
+                return True
+            self._pending = memoryview(data)
+        asked = len(self._pending)
+        try:
+            written = os.write(self.fd, self._pending)
+        except BlockingIOError:
+            return False
+        except BrokenPipeError:
+            # The reader is gone, like a process killed by SIGPIPE
+            return True
+        self._adapt(written, min(asked, self.chunk_size))
+        self.transferred += written
+        self._pending = self._pending[written:]
+        return False
+
+    def closed(self):
+        if self._queue is not None:
+            # Unblock the worker if it's waiting for room, it stops after
+            self._stopped = True
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+        self._complete()
+
+    def _work(self):
+        assert self._queue is not None
+        while not self._stopped:
+            try:
+                data = self.source(self.chunk_size)
+            except BaseException as exc:
+                self.error = exc
+                data = b''
+            self._queue.put(data)
+            with self._lock:
+                if self.paused:
+                    self.paused = False
+                    reactor().resume(self)
+            if not data:
+                return
+
+
+def inline_source(source: Any) -> bool:
+    if type(source) in INLINE_TYPES:
+        return True
+    return type(source) in (list, tuple) and all(type(item) in (str, bytes) for item in source)
+
+
+def io_sink(dest: Any) -> Tuple[Callable[[bytes], Any], Optional[Callable[[], Any]]]:
+    # Text streams get an incremental decoder so multi-byte characters that
+    # straddle two reads come out right
+    if isinstance(dest, io.TextIOBase):
+        decoder = codecs.getincrementaldecoder(getattr(dest, 'encoding', None) or 'utf-8')(errors='replace')
+        return (
+            lambda data: dest.write(decoder.decode(data)),
+            lambda: dest.write(decoder.decode(b'', final=True)),
+        )
+    return dest.write, None
+
+
+def io_source(source: Any) -> Callable[[int], bytes]:
+    if isinstance(source, io.IOBase):
+        def read(size: int) -> bytes:
+            data = source.read(size)
+            return data.encode() if isinstance(data, str) else data
+        return read
+    iterator = iter(source)
+
+    def take(size: int) -> bytes:
+        for item in iterator:
+            data = item.encode() if isinstance(item, str) else bytes(item)
+            if data:
+                return data
+        return b''
+    return take
+
+
+class Reactor:
+    # One thread multiplexing every Python-side stream of every running
+    # expression. Streams are registered from any thread through a queue and
+    # a wakeup pipe, since selectors aren't thread-safe.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._incoming: List[Tuple[ReactorStream, bool]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._wake_reader, self._wake_writer = os.pipe()
+        os.set_blocking(self._wake_reader, False)
+        os.set_blocking(self._wake_writer, False)
+        self.active = 0
+
+    def register(self, stream: ReactorStream):
+        os.set_blocking(stream.fd, False)
+        self._add(stream, True)
+
+    def resume(self, stream: ReactorStream):
+        # Watches a paused stream's pipe again. Called from its worker.
+        self._add(stream, False)
+
+    def _add(self, stream: ReactorStream, new: bool):
+        with self._lock:
+            self._incoming.append((stream, new))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='shalchemy: reactor', daemon=True)
+                self._thread.start()
+        try:
+            os.write(self._wake_writer, b'\0')
+        except BlockingIOError:
+            # Already plenty of wakeups pending
+            pass
+
+    def _loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_reader, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select():
+                if key.fd == self._wake_reader:
+                    try:
+                        while os.read(self._wake_reader, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    with self._lock:
+                        incoming, self._incoming = self._incoming, []
+                    for stream, new in incoming:
+                        selector.register(stream.fd, stream.events, stream)
+                        if new:
+                            self.active += 1
+                    continue
+                stream = key.data
+                try:
+                    finished = stream.on_ready()
+                except BaseException as exc:
+                    stream.error = exc
+                    finished = True
+                if finished is None:
+                    # Its worker resumes it once there's something to do
+                    selector.unregister(stream.fd)
+                elif finished:
+                    selector.unregister(stream.fd)
+                    self.active -= 1
+                    self._close(stream)
+
+    def _close(self, stream: ReactorStream):
+        try:
+            stream.finish()
+        except BaseException as exc:
+            stream.error = stream.error or exc
+        finally:
+            os.close(stream.fd)
+            stream.closed()
+
+
+_reactor: Optional[Reactor] = None
+_reactor_lock = threading.Lock()
+
+
+def reactor() -> Reactor:
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = Reactor()
+        return _reactor
+
+
+def pump_to(dest: Any, inline: Optional[bool] = None) -> Tuple[int, ReadStream]:
+    # Returns a pipe write end for a child and the stream copying from its
+    # read end into `dest`. Only sinks that can't block may be `inline`.
+    reader, writer = os.pipe()
+    sink, finish = io_sink(dest)
+    if inline is None:
+        inline = type(dest) in INLINE_TYPES
+    stream = ReadStream(reader, sink, finish, inline)
+    reactor().register(stream)
+    return writer, stream
+
+
+def pump_from(source: Any) -> Tuple[int, WriteStream]:
+    reader, writer = os.pipe()
+    stream = WriteStream(writer, io_source(source), inline_source(source))
+    reactor().register(stream)
+    return reader, stream
@@ -0,0 +1,179 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, cast
+
+import os
+import queue
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import traceback
+
+
+ExitCallback = Callable[[Any], None]
+
+# Without pidfds or a SIGCHLD handler children are polled, backing off to this
+MAX_POLL_INTERVAL = 0.05
+
+
+class ExitNotifier:
+    # One thread that learns about every shalchemy child's exit as it
+    # happens. Real processes are watched through pidfds in a selector.
+    # Where pidfd_open isn't available a SIGCHLD handler wakes the thread up
+    # instead, and if even that can't be installed (it must happen on the
+    # main thread) it falls back to polling. Threaded stages report in
+    # themselves.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._incoming: List[Tuple[Any, ExitCallback]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._wake_reader, self._wake_writer = os.pipe()
+        os.set_blocking(self._wake_reader, False)
+        os.set_blocking(self._wake_writer, False)
+        self.sigchld = False
+        self.watching = 0
+
+    def _install_sigchld(self):
+        if hasattr(os, 'pidfd_open') or threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGCHLD)
+
+        def on_sigchld(signum, frame):
+            self._wake()
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(signal.SIGCHLD, on_sigchld)
+        self.sigchld = True
+
+    def _wake(self):
+        try:
+            os.write(self._wake_writer, b'\0')
+        except BlockingIOError:
+            pass
+
+    def watch(self, process: Any, callback: ExitCallback):
+        # `callback(process)` runs on the notifier thread once it has exited
+        add_done_callback = getattr(process, 'add_done_callback', None)
+        if add_done_callback is not None:
+            add_done_callback(callback)
+            return
+        with self._lock:
+            self._incoming.append((process, callback))
+            if self._thread is None:
+                self._install_sigchld()
+                self._thread = threading.Thread(target=self._loop, name='shalchemy: reaper', daemon=True)
+                self._thread.start()
+        self._wake()
+
+    def _loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_reader, selectors.EVENT_READ)
+        # Processes we can't get a pidfd for
+        polled: Dict[int, Tuple[Any, ExitCallback]] = {}
+        delay = 0.001
+        while True:
+            timeout = None if not polled or self.sigchld else delay
+            events = selector.select(timeout)
+            for key, _ in events:
+                if key.fd == self._wake_reader:
+                    try:
+                        while os.read(self._wake_reader, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                process, callback = key.data
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                self._reaped(process, callback)
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+            for process, callback in incoming:
+                self.watching += 1
+                if process.poll() is not None:
+                    self._reaped(process, callback)
+                    continue
+                try:
+                    pidfd = os.pidfd_open(process.pid)
+                except (AttributeError, OSError):
+                    polled[id(process)] = (process, callback)
+                    continue
+                selector.register(pidfd, selectors.EVENT_READ, (process, callback))
+            if polled:
+                exited = [key for key, (process, _) in polled.items() if process.poll() is not None]
+                for key in exited:
+                    self._reaped(*polled.pop(key))
+                delay = 0.001 if exited else min(delay * 2, MAX_POLL_INTERVAL)
+
+    def _reaped(self, process: Any, callback: ExitCallback):
+        # Reap it here so returncode is set before anyone hears about it
+        process.poll()
+        self.watching -= 1
+        try:
+            callback(process)
+        except Exception:
+            # Reported rather than raised, which would stop the thread and
+            # every other process's notification with it
+            sys.stderr.write(f'shalchemy: exit callback for {process.args!r} failed\n')
+            traceback.print_exc()
+
+
+_notifier: Optional[ExitNotifier] = None
+_notifier_lock = threading.Lock()
+
+
+def notifier() -> ExitNotifier:
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = ExitNotifier()
+        return _notifier
+
+
+def exit_order(processes: Sequence[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+    # Yields each process as soon as it has exited, whatever the order.
+    # Raises subprocess.TimeoutExpired if nothing exits within `timeout`
+    # seconds.
+    exited: 'queue.Queue[Any]' = queue.Queue()
+    watcher = notifier()
+    for process in processes:
+        watcher.watch(process, exited.put)
+    pending = {id(process): process for process in processes}
+    for _ in processes:
+        try:
+            process = exited.get(timeout=timeout)
+        except queue.Empty:
+            waiting = next(iter(pending.values()))
+            raise subprocess.TimeoutExpired(waiting.args, cast(float, timeout)) from None
+        del pending[id(process)]
+        yield process
+
+
+def as_completed(results: Sequence[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+    # Yields RunResults as every process of each one has exited. They still
+    # need wait() for cleanup, which won't block by then.
+    completed: 'queue.Queue[Any]' = queue.Queue()
+    watcher = notifier()
+    for result in results:
+        remaining = [len(result.processes)]
+        lock = threading.Lock()
+
+        def exited(process: Any, result: Any = result, remaining: List[int] = remaining, lock: threading.Lock = lock):
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                completed.put(result)
+        if not result.processes:
+            completed.put(result)
+        for process in result.processes:
+            watcher.watch(process, exited)
+    pending = {id(result): result for result in results}
+    for _ in results:
+        try:
+            result = completed.get(timeout=timeout)
+        except queue.Empty:
+            waiting = next(iter(pending.values()))
+            raise subprocess.TimeoutExpired(waiting.main.args, cast(float, timeout)) from None
+        del pending[id(result)]
+        yield result
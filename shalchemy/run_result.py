@@ -1,99 +1,253 @@
-from typing import TYPE_CHECKING, cast, List, Optional, Sequence
+from typing import TYPE_CHECKING, cast, Dict, List, Optional, Sequence
 
 import io
 import os
 import subprocess
-import shutil
-import tempfile
+import signal
+import threading
+import time
+
+from . import trace
+from .spawn import DEFAULT_OPTIONS, SpawnOptions
 
 if TYPE_CHECKING:
     from .expressions import ShalchemyExpression, ShalchemyOutputStream
-
-
-class StreamPipe:
-    source: io.IOBase
-    dest: io.IOBase
-    append: bool
-
-    def __init__(self, source: io.IOBase, dest: io.IOBase, append: bool):
-        self.source = source
-        self.dest = dest
-        self.append = append
-
-    def pipe(self):
-        if not self.append:
-            try:
-                self.dest.truncate(0)
-                self.dest.seek(0)
-            except io.UnsupportedOperation:
-                pass
-        self.source.seek(0)
-        self.dest.write(self.source.read())
+    from .meter import Meter
+    from .reactor import ReactorStream
+    from .scheduler import Reservation
+    from .trace import Tracer
 
 
 class FileResult:
     fileno: int
     open_files: List[io.IOBase]
-    stream_pipes: List[StreamPipe]
+    streams: List['ReactorStream']
+    # Our end of a reactor pipe, closed once the child has its copy
+    close_after_spawn: Optional[int]
 
     def __init__(
         self,
         fileno: int,
         open_files: Optional[List[io.IOBase]] = None,
-        stream_pipes: Optional[List[StreamPipe]] = None,
+        streams: Optional[List['ReactorStream']] = None,
+        close_after_spawn: Optional[int] = None,
     ):
         self.fileno = fileno
         self.open_files = open_files if open_files is not None else []
-        self.stream_pipes = stream_pipes if stream_pipes is not None else []
+        self.streams = streams if streams is not None else []
+        self.close_after_spawn = close_after_spawn
+
+    def spawned(self):
+        if self.close_after_spawn is not None:
+            os.close(self.close_after_spawn)
+            self.close_after_spawn = None
+
+
+class Stage:
+    expression: 'ShalchemyExpression'
+    kind: str
+    process: subprocess.Popen
+    started: float
+    finished: Optional[float]
+    # Set once the run has done its bookkeeping for the stage's exit
+    reported: threading.Event
+
+    def __init__(self, expression: 'ShalchemyExpression', kind: str, process: subprocess.Popen):
+        self.expression = expression
+        self.kind = kind
+        self.process = process
+        self.started = time.monotonic()
+        self.finished = None
+        self.reported = threading.Event()
+
+    @property
+    def label(self) -> str:
+        from .types import ParenthesisKind
+        return self.expression._repr(ParenthesisKind.NEVER)
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def _exited(self, process: subprocess.Popen):
+        if self.finished is None:
+            # Threaded stages know exactly when they returned
+            self.finished = getattr(process, 'finished_at', None) or time.monotonic()
+
+    def __repr__(self):
+        return f'Stage({self.kind}: {self.label}, pid={self.process.pid})'
 
 
 class RunResult:
+    # A single RunResult is shared by every node of an expression tree while
+    # it runs. Nodes append what they open instead of merging child results,
+    # so the bookkeeping stays linear in the size of the tree.
     main: subprocess.Popen
     file: 'ShalchemyOutputStream'
     processes: List[subprocess.Popen]
-    files: Sequence['ShalchemyOutputStream']
+    files: List['ShalchemyOutputStream']
     directories: List[str]
-    stream_pipes: List[StreamPipe]
+    # Python-side streams the reactor copies to and from
+    streams: List['ReactorStream']
+    stages: List[Stage]
+    # Spawn every process in its own session so kill() takes descendants too
+    new_session: bool
+    # Set by expressions configured with `with_` while their subtree runs
+    options: SpawnOptions
+    # Scheduler slots held for the processes of this run
+    reservation: Optional['Reservation']
+    timeout: Optional[float]
+    timed_out: bool
+    # Counters for metered edges, by name
+    meters: Dict[str, 'Meter']
+    # Raised by wait(), for stages that failed in a way no exit code tells
+    errors: List[BaseException]
+    tracer: Optional['Tracer']
 
     def __init__(
         self,
-        main: subprocess.Popen,
+        main: Optional[subprocess.Popen] = None,
         processes: Optional[List[subprocess.Popen]] = None,
         files: Optional[List['ShalchemyOutputStream']] = None,
         directories: Optional[List[str]] = None,
-        stream_pipes: List[StreamPipe] = None,
     ):
         if isinstance(main, subprocess.Popen):
             self.main = main
-        else:
+        elif main is not None:
             self.file = main
         self.processes = processes or []
         self.files = files or []
         self.directories = directories or []
-        self.stream_pipes = stream_pipes or []
+        self.streams = []
+        self.stages = []
+        self.new_session = False
+        self.options = DEFAULT_OPTIONS
+        self.reservation = None
+        self.timeout = None
+        self.timed_out = False
+        self.meters = {}
+        self.errors = []
+        # Captured here since stages exit on the reaper thread
+        self.tracer = trace.active()
+        self._timer: Optional[threading.Timer] = None
+
+    def add_process(
+        self,
+        process: subprocess.Popen,
+        expression: 'ShalchemyExpression',
+        kind: str = 'command',
+    ) -> Stage:
+        stage = Stage(expression, kind, process)
+        self.processes.append(process)
+        self.stages.append(stage)
+        from .reaper import notifier
+        notifier().watch(process, lambda process: self._exited(stage))
+        return stage
+
+    def _exited(self, stage: Stage):
+        # Runs on the reaper thread as soon as the process is gone. Its slot
+        # is given back right away rather than in wait(), which may be a
+        # long way off while the caller is still reading the output.
+        try:
+            stage._exited(stage.process)
+            if self.tracer is not None:
+                # Recorded even if nobody ever waits on the run
+                self.tracer.stage(stage)
+            if self.reservation is not None and stage.process.pid is not None:
+                # Threaded stages hold theirs for their own children until wait()
+                self.reservation.release()
+        except Exception as error:
+            # wait() raises it, where the caller can see it
+            self.errors.append(error)
+        finally:
+            stage.reported.set()
+
+    def mark_stages(self, first: int, kind: str):
+        # Nested substitutions keep the kind they were given first
+        for stage in self.stages[first:]:
+            if stage.kind == 'command':
+                stage.kind = kind
+
+    def start_timeout(self, timeout: float):
+        # A timer rather than wait(timeout) so the deadline also holds while
+        # the caller is still reading our output.
+        self.timeout = timeout
+        self._timer = threading.Timer(timeout, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        # Runs that finished right at the deadline didn't time out
+        if self.kill():
+            self.timed_out = True
 
     def wait(self):
-        for process in self.processes:
-            process.wait()
-        for sm in self.stream_pipes:
-            sm.pipe()
+        with trace.span('wait', 'wait'):
+            self._wait()
+
+    def _wait(self):
+        # add_process already watches every process, wait for what it heard
+        for stage in self.stages:
+            stage.reported.wait()
+        if self.reservation is not None:
+            # Threaded stages may have held slots for several children
+            self.reservation.release_all()
+        if self._timer is not None:
+            self._timer.cancel()
+        # Every writer has exited, so each stream ends at EOF shortly
+        for stream in self.streams:
+            stream.wait()
         self.cleanup()
+        for stream in self.streams:
+            if stream.error is not None:
+                raise stream.error
+        if self.errors:
+            raise self.errors[0]
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.main.args, cast(float, self.timeout))
+
+    def kill(self, processes: Optional[Sequence[subprocess.Popen]] = None) -> bool:
+        # Kills every process of the run, or just `processes`. Returns
+        # whether anything was still running.
+        killed = False
+        # Last stages first, so they can't see EOF from a killed upstream
+        # and exit cleanly before their own turn
+        for process in reversed(self.processes if processes is None else processes):
+            # Reap it if it already exited. A process that hasn't been
+            # reaped can't have had its pid reused.
+            if process.poll() is not None:
+                continue
+            try:
+                if self.new_session and process.pid is not None:
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                killed = True
+            except ProcessLookupError:
+                pass
+        return killed
 
     def cleanup(self):
+        with trace.span('cleanup', 'cleanup', files=len(self.files), directories=len(self.directories)):
+            self._cleanup()
+
+    def _cleanup(self):
         for file in self.files:
             if isinstance(file, io.IOBase):
                 file.close()
             else:
                 os.close(file)
-        for dir in self.directories:
-            shutil.rmtree(dir)
+        if self.directories:
+            import shutil
+            for dir in self.directories:
+                shutil.rmtree(dir)
 
 
 class ReadSubstitutePreparation:
-    tmpdir: str
     filename: str
-    writer: io.IOBase
-    context: RunResult
+    reader: int
 
     def __init__(
         self,
@@ -101,25 +255,37 @@ class ReadSubstitutePreparation:
         stdin: Optional['ShalchemyOutputStream'],
         stdout: Optional['ShalchemyOutputStream'],
         stderr: Optional['ShalchemyOutputStream'],
+        context: RunResult,
     ):
-        # Create a temporary directory so we can get a file called /tmp/tmpXXXXXX/fifo
-        self.tmpdir = tempfile.mkdtemp()
-        self.filename = os.path.join(self.tmpdir, 'fifo')
-        self.writer = cast(io.IOBase, open(self.filename, 'wb'))
-        self.context = expression._run(
-            stdin=stdin,
-            stdout=self.writer,
-            stderr=stderr,
-        )
+        # Like bash, hand the reading end of a pipe to the command as
+        # /dev/fd/N. It must stay open until the command has been spawned.
+        self.reader, writer = os.pipe()
+        self.filename = f'/dev/fd/{self.reader}'
+        first_stage = len(context.stages)
+        try:
+            expression._run(
+                stdin=stdin,
+                stdout=writer,
+                stderr=stderr,
+                context=context,
+            )
+        finally:
+            # Only the substituted command may hold the writing end,
+            # otherwise the reader never sees EOF.
+            os.close(writer)
+        context.mark_stages(first_stage, 'read_sub')
 
-    def _run(self):
-        return RunResult(
-            main=self.context.main,
-            processes=self.context.processes,
-            files=[*self.context.files, self.writer],
-            directories=[*self.context.directories, self.tmpdir],
-            stream_pipes=self.context.stream_pipes,
-        )
+    @property
+    def pass_fds(self) -> Sequence[int]:
+        return [self.reader]
+
+    def _run(self, context: RunResult):
+        # Once the command has its copy, ours would only keep the writer
+        # alive after the reader exits.
+        os.close(self.reader)
+
+    def _abort(self):
+        os.close(self.reader)
 
 
 class WriteSubstitutePreparation:
@@ -136,6 +302,7 @@ class WriteSubstitutePreparation:
         stdin: Optional['ShalchemyOutputStream'],
         stdout: Optional['ShalchemyOutputStream'],
         stderr: Optional['ShalchemyOutputStream'],
+        context: RunResult,
     ):
         self.expression = expression
         self.stdin = stdin
@@ -143,23 +310,29 @@ class WriteSubstitutePreparation:
         self.stderr = stderr
 
         # Create a temporary directory so we can get a file called /tmp/tmpXXXXXX/fifo
-        self.tmpdir = tempfile.mkdtemp()
-        self.filename = os.path.join(self.tmpdir, 'fifo')
-        os.mkfifo(self.filename, 0o600)
+        import tempfile
+        with trace.span('fifo setup', 'substitution', expression):
+            self.tmpdir = tempfile.mkdtemp()
+            self.filename = os.path.join(self.tmpdir, 'fifo')
+            os.mkfifo(self.filename, 0o600)
+        context.directories.append(self.tmpdir)
+
+    @property
+    def pass_fds(self) -> Sequence[int]:
+        return []
 
-    def _run(self) -> RunResult:
+    def _abort(self):
+        # The fifo's directory is removed with the rest of the context
+        pass
+
+    def _run(self, context: RunResult):
         reader = cast(io.IOBase, open(self.filename, 'rb'))
-        opened_directories = [self.tmpdir]
-        opened_files = [reader]
-        context = self.expression._run(
+        context.files.append(reader)
+        first_stage = len(context.stages)
+        self.expression._run(
             stdin=reader,
             stdout=self.stdout,
             stderr=self.stderr,
+            context=context,
         )
-        return RunResult(
-            main=context.main,
-            processes=context.processes,
-            files=[*context.files, *opened_files],
-            directories=[*context.directories, *opened_directories],
-            stream_pipes=context.stream_pipes,
-        )
+        context.mark_stages(first_stage, 'write_sub')
@@ -1,11 +1,32 @@
-from typing import cast, Optional
+from typing import cast, Any, Callable, Iterable, Iterator, List, Optional, TYPE_CHECKING
 
+import contextlib
+import contextvars
 import io
 import sys
-import shlex
-from .expressions import CommandExpression, ShalchemyExpression, ShalchemyFile
+from .expressions import (
+    CommandExpression,
+    RedirectInExpression,
+    RedirectOutExpression,
+    ShalchemyExpression,
+    ShalchemyFile,
+)
+from . import trace
 from .arguments import compile_arguments, default_kwarg_render
 from .run_result import RunResult
+from .scheduler import Priority, Scheduler, scheduler
+from .spawn import DEFAULT_OPTIONS, SpawnOptions
+
+if TYPE_CHECKING:
+    from .compression import CodecExpression
+    from .coproc import Coprocess, CoprocessPool
+    from .globbing import GlobArgument
+    from .group import GroupExpression
+    from .merge import MergeExpression
+    from .race import RaceExpression
+    from .shard import Reducer, ShardExpression
+    from .tee import TeeExpression
+    from .trace import Tracer
 
 
 # This stuff is hacks for pytest
@@ -14,10 +35,43 @@ _DEFAULT_STDOUT: io.IOBase = cast(io.IOBase, sys.stdout)
 _DEFAULT_STDERR: io.IOBase = cast(io.IOBase, sys.stderr)
 
 
+class Defaults:
+    # What runs started in the current context use when they don't say
+    # otherwise. Unset streams fall back to the module defaults above.
+    __slots__ = ('stdin', 'stdout', 'stderr', 'timeout', 'priority', 'options')
+
+    stdin: Optional[io.IOBase]
+    stdout: Optional[io.IOBase]
+    stderr: Optional[io.IOBase]
+    timeout: Optional[float]
+    priority: Priority
+    options: SpawnOptions
+
+    def __init__(
+        self,
+        stdin: Optional[io.IOBase] = None,
+        stdout: Optional[io.IOBase] = None,
+        stderr: Optional[io.IOBase] = None,
+        timeout: Optional[float] = None,
+        priority: Priority = 'normal',
+        options: SpawnOptions = DEFAULT_OPTIONS,
+    ):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timeout = timeout
+        self.priority = priority
+        self.options = options
+
+
+_defaults: 'contextvars.ContextVar[Defaults]' = contextvars.ContextVar('shalchemy_defaults', default=Defaults())
+
+
 class CommandCreator:
     def __call__(self, *args, **kwargs) -> CommandExpression:
         _kwarg_render = kwargs.pop('_kwarg_render',  default_kwarg_render)
         if len(args) == 1 and len(kwargs) == 0 and isinstance(args[0], str):
+            import shlex
             return CommandExpression(
                 *shlex.split(args[0]),
                 _kwarg_render=_kwarg_render,
@@ -34,18 +88,164 @@ class CommandCreator:
             _kwarg_render=_kwarg_render,
         )
 
+    def glob(
+        self,
+        pattern: str,
+        sort: bool = True,
+        cache: bool = True,
+        null: bool = False,
+        include_hidden: bool = False,
+    ) -> 'GlobArgument':
+        from .globbing import GlobArgument
+        return GlobArgument(pattern, sort=sort, cache=cache, null=null, include_hidden=include_hidden)
+
+    def race(self, *expressions: 'ShalchemyExpression', hedge_delay: Optional[float] = None) -> 'RaceExpression':
+        from .race import RaceExpression
+        return RaceExpression(*expressions, hedge_delay=hedge_delay)
+
+    def group(
+        self,
+        *expressions: 'ShalchemyExpression',
+        ordered: bool = True,
+        buffer_size: Optional[int] = None,
+    ) -> 'GroupExpression':
+        from .group import DEFAULT_BUFFER_SIZE, GroupExpression
+        return GroupExpression(*expressions, ordered=ordered, buffer_size=buffer_size or DEFAULT_BUFFER_SIZE)
+
+    def merge_sorted(
+        self,
+        expressions: Iterable['ShalchemyExpression'],
+        key: Optional[Callable[[str], Any]] = None,
+        numeric: bool = False,
+        reverse: bool = False,
+    ) -> 'MergeExpression':
+        from .merge import MergeExpression
+        return MergeExpression(expressions, key=key, numeric=numeric, reverse=reverse)
+
+    def shard(
+        self,
+        expression: 'ShalchemyExpression',
+        path: str,
+        jobs: Optional[int] = None,
+        reducer: Optional['Reducer'] = None,
+    ) -> 'ShardExpression':
+        from .shard import ShardExpression
+        return ShardExpression(expression, path, jobs=jobs, reducer=reducer)
+
+    def compress(
+        self,
+        format: str = 'gzip',
+        level: Optional[int] = None,
+        threads: int = 1,
+        block_size: Optional[int] = None,
+    ) -> 'CodecExpression':
+        from .compression import DEFAULT_BLOCK_SIZE, CodecExpression
+        return CodecExpression(format, level=level, threads=threads, block_size=block_size or DEFAULT_BLOCK_SIZE)
+
+    def decompress(self, format: str = 'gzip') -> 'CodecExpression':
+        from .compression import CodecExpression
+        return CodecExpression(format, decompress=True)
+
+    def coproc(self, expression: 'ShalchemyExpression', until: Any = b'\n', encoding: str = 'utf-8') -> 'Coprocess':
+        from .coproc import Coprocess
+        return Coprocess(expression, until=until, encoding=encoding)
+
+    def coproc_pool(
+        self,
+        expression: 'ShalchemyExpression',
+        size: int,
+        until: Any = b'\n',
+        encoding: str = 'utf-8',
+    ) -> 'CoprocessPool':
+        from .coproc import CoprocessPool
+        return CoprocessPool(expression, size, until=until, encoding=encoding)
+
+    def process_map(
+        self,
+        function: Callable[[Any], Any],
+        expressions: Iterable['ShalchemyExpression'],
+        max_workers: Optional[int] = None,
+        chunksize: int = 1,
+    ) -> List[Any]:
+        from .parallel import process_map
+        return process_map(function, expressions, max_workers=max_workers, chunksize=chunksize)
+
+    def tee(self, *sinks: Any, append: bool = False) -> 'TeeExpression':
+        from .tee import TeeExpression
+        return TeeExpression(*sinks, append=append)
+
+    @property
+    def scheduler(self) -> Scheduler:
+        return scheduler
+
+    @contextlib.contextmanager
+    def defaults(
+        self,
+        stdin: Optional[io.IOBase] = None,
+        stdout: Optional[io.IOBase] = None,
+        stderr: Optional[io.IOBase] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[Priority] = None,
+        **options: Any,
+    ) -> Iterator[Defaults]:
+        outer = _defaults.get()
+        inner = Defaults(
+            stdin=stdin if stdin is not None else outer.stdin,
+            stdout=stdout if stdout is not None else outer.stdout,
+            stderr=stderr if stderr is not None else outer.stderr,
+            timeout=timeout if timeout is not None else outer.timeout,
+            priority=priority if priority is not None else outer.priority,
+            options=outer.options.merged(SpawnOptions.from_keywords(**options)),
+        )
+        token = _defaults.set(inner)
+        try:
+            yield inner
+        finally:
+            _defaults.reset(token)
+
+    @contextlib.contextmanager
+    def trace(self, path: Optional[str] = None) -> Iterator['Tracer']:
+        # Records every run started inside the block as Chrome trace events,
+        # written to `path` at the end if given
+        with trace.scoped(path) as tracer:
+            yield tracer
+
+    def start(
+        self,
+        expression: 'ShalchemyExpression',
+        stdin: Optional[io.IOBase] = None,
+        stdout: Optional[io.IOBase] = None,
+        stderr: Optional[io.IOBase] = None,
+        priority: Optional[Priority] = None,
+        timeout: Optional[float] = None,
+    ) -> RunResult:
+        # Like run, but returns as soon as everything has been spawned. The
+        # caller must wait() on the result.
+        return _internal_run(
+            expression,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            priority=priority,
+            timeout=timeout,
+        )
+
     def run(
         self,
         expression: 'ShalchemyExpression',
         stdin: Optional[io.IOBase] = None,
         stdout: Optional[io.IOBase] = None,
         stderr: Optional[io.IOBase] = None,
+        priority: Optional[Priority] = None,
+        timeout: Optional[float] = None,
     ) -> int:
         result = _internal_run(
             expression,
             stdin=stdin,
             stdout=stdout,
-            stderr=stderr
+            stderr=stderr,
+            priority=priority,
+            timeout=timeout,
         )
         result.wait()
         return result.main.returncode
@@ -56,20 +256,63 @@ class ShellFile:
         pass
 
 
+def _first_set(*values: Optional[io.IOBase]) -> io.IOBase:
+    return cast(io.IOBase, next(value for value in values if value is not None))
+
+
+def _has_fileno(stream: Any) -> bool:
+    if isinstance(stream, int):
+        return True
+    try:
+        stream.fileno()
+        return True
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+
+
 def _internal_run(
     expression: 'ShalchemyExpression',
     stdin: Optional[io.IOBase] = None,
     stdout: Optional[io.IOBase] = None,
     stderr: Optional[io.IOBase] = None,
+    priority: Optional[Priority] = None,
+    timeout: Optional[float] = None,
 ) -> RunResult:
-    actual_stdin = stdin if stdin is not None else _DEFAULT_STDIN
-    actual_stdout = stdout if stdout is not None else _DEFAULT_STDOUT
-    actual_stderr = stderr if stderr is not None else _DEFAULT_STDERR
-    result = expression._run(
-        stdin=actual_stdin,
-        stdout=actual_stdout,
-        stderr=actual_stderr,
-    )
+    defaults = _defaults.get()
+    actual_stdin = _first_set(stdin, defaults.stdin, _DEFAULT_STDIN)
+    actual_stdout = _first_set(stdout, defaults.stdout, _DEFAULT_STDOUT)
+    actual_stderr = _first_set(stderr, defaults.stderr, _DEFAULT_STDERR)
+    # Python-only streams such as StringIO go through the same temporary
+    # file juggling as redirecting to them
+    if not _has_fileno(actual_stdin):
+        expression = RedirectInExpression(expression, actual_stdin)
+    if not _has_fileno(actual_stdout):
+        expression = RedirectOutExpression(expression, actual_stdout, append=True)
+    if not _has_fileno(actual_stderr):
+        expression = RedirectOutExpression(expression, actual_stderr, append=True, stderr=True)
+    if priority is None:
+        priority = defaults.priority
+    if timeout is None:
+        timeout = defaults.timeout
+    context = RunResult()
+    context.options = defaults.options
+    # Wait for slots for every process up front, then spawn them all
+    with trace.span('schedule', 'schedule'):
+        context.reservation = scheduler.acquire(expression._count_processes(), priority)
+    try:
+        with trace.span('start', 'start', expression):
+            result = expression._run(
+                stdin=actual_stdin,
+                stdout=actual_stdout,
+                stderr=actual_stderr,
+                context=context,
+            )
+    except BaseException:
+        context.kill()
+        context.wait()
+        raise
+    if timeout is not None:
+        context.start_timeout(timeout)
     return result
 
 sh = CommandCreator()
@@ -0,0 +1,171 @@
+from typing import Dict, List, Optional, Union
+
+import heapq
+import itertools
+import threading
+import time
+
+
+Priority = Union[str, int]
+
+PRIORITIES = {
+    'high': 0,
+    'normal': 1,
+    'low': 2,
+}
+
+
+def priority_rank(priority: Priority) -> int:
+    if isinstance(priority, int):
+        return priority
+    if priority not in PRIORITIES:
+        raise ValueError(f'priority must be an int or one of {list(PRIORITIES)}', priority)
+    return PRIORITIES[priority]
+
+
+class WaitStats:
+    granted: int
+    total_wait: float
+    max_wait: float
+
+    def __init__(self):
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float):
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.granted if self.granted else 0.0
+
+    def __repr__(self):
+        return f'WaitStats(granted={self.granted}, mean_wait={self.mean_wait:.6f}, max_wait={self.max_wait:.6f})'
+
+
+class Reservation:
+    # Slots held by one running expression. They are handed back one at a
+    # time as its processes are waited for.
+    scheduler: 'Scheduler'
+    count: int
+
+    def __init__(self, scheduler: 'Scheduler', count: int):
+        self.scheduler = scheduler
+        self.count = count
+
+    def release(self, count: int = 1):
+        with self.scheduler._lock:
+            count = min(count, self.count)
+            self.count -= count
+            self.scheduler._release(count)
+
+    def release_all(self):
+        self.release(self.count)
+
+
+class _Waiter:
+    count: int
+    priority: Priority
+    enqueued: float
+    granted: bool
+    cancelled: bool
+
+    def __init__(self, count: int, priority: Priority):
+        self.count = count
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.event = threading.Event()
+
+
+class Scheduler:
+    # Limits how many child processes the whole program runs at once. An
+    # expression asks for all of its processes together before spawning any
+    # of them, so two half-started pipelines can never deadlock each other.
+    # Waiters are served by priority and then in arrival order. The head of
+    # the queue is never overtaken, which keeps big requests from starving.
+    max_processes: Optional[int]
+    running: int
+
+    def __init__(self, max_processes: Optional[int] = None):
+        self.max_processes = max_processes
+        self.running = 0
+        self._lock = threading.Lock()
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._stats: Dict[Priority, WaitStats] = {}
+
+    def configure(self, max_processes: Optional[int]):
+        if max_processes is not None and max_processes < 1:
+            raise ValueError('max_processes must be at least 1', max_processes)
+        with self._lock:
+            self.max_processes = max_processes
+            self._dispatch()
+
+    @property
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, waiter in self._queue if not waiter.cancelled)
+
+    def stats(self) -> Dict[Priority, WaitStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def _fits(self, count: int) -> bool:
+        return self.max_processes is None or self.running + count <= self.max_processes
+
+    def _grant(self, waiter: _Waiter):
+        self.running += waiter.count
+        waiter.granted = True
+        self._stats.setdefault(waiter.priority, WaitStats()).record(time.monotonic() - waiter.enqueued)
+
+    def _dispatch(self):
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(waiter.count):
+                break
+            heapq.heappop(self._queue)
+            self._grant(waiter)
+            waiter.event.set()
+
+    def _release(self, count: int):
+        # Called with the lock held
+        self.running -= count
+        self._dispatch()
+
+    def acquire(self, count: int, priority: Priority = 'normal') -> Reservation:
+        rank = priority_rank(priority)
+        with self._lock:
+            if self.max_processes is not None:
+                # Something bigger than the limit runs once it has the host to itself
+                count = min(count, self.max_processes)
+            waiter = _Waiter(count, priority)
+            if not self._queue and self._fits(count):
+                self._grant(waiter)
+                return Reservation(self, count)
+            heapq.heappush(self._queue, (rank, next(self._sequence), waiter))
+        try:
+            waiter.event.wait()
+        except BaseException:
+            with self._lock:
+                if waiter.granted:
+                    self._release(waiter.count)
+                else:
+                    waiter.cancelled = True
+                    self._dispatch()
+            raise
+        return Reservation(self, count)
+
+
+scheduler = Scheduler()
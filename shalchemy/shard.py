@@ -0,0 +1,222 @@
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import errno
+import functools
+import os
+import queue
+import subprocess
+import threading
+
+from .expressions import ShalchemyExpression, is_shalchemy_expression, represent_file
+from .group import DEFAULT_BUFFER_SIZE, Member, OrderedOutput, first_failure, merge_outputs
+from .run_result import RunResult
+from .spawn import SpawnOptions
+from .threaded import ThreadedProcess, run_in_thread
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+
+CHUNK_SIZE = 1024 * 1024
+# How much is read at a time while looking for the end of a line
+SCAN_SIZE = 64 * 1024
+
+Reducer = Callable[[List[str]], Union[str, bytes]]
+
+
+def line_boundary(fd: int, position: int, size: int) -> int:
+    # The start of the first line that starts at or after `position`
+    if position <= 0:
+        return 0
+    offset = position - 1
+    while offset < size:
+        data = os.pread(fd, SCAN_SIZE, offset)
+        if not data:
+            break
+        index = data.find(b'\n')
+        if index != -1:
+            return offset + index + 1
+        offset += len(data)
+    return size
+
+
+def split_ranges(fd: int, jobs: int) -> List[Tuple[int, int]]:
+    # Up to `jobs` ranges of about the same size, each made of whole lines.
+    # Lines longer than a range leave fewer, never empty, ones.
+    size = os.fstat(fd).st_size
+    if size == 0:
+        return [(0, 0)]
+    starts = [0]
+    for index in range(1, jobs):
+        start = line_boundary(fd, index * size // jobs, size)
+        if starts[-1] < start < size:
+            starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def feed(source: int, dest: int, start: int, end: int):
+    # Moves one range of the file into a pipe. splice does it inside the
+    # kernel, so none of it passes through Python.
+    offset = start
+    try:
+        if hasattr(os, 'splice'):
+            try:
+                while offset < end:
+                    moved = os.splice(source, dest, min(end - offset, CHUNK_SIZE), offset_src=offset)
+                    if moved == 0:
+                        return
+                    offset += moved
+                return
+            except OSError as error:
+                if error.errno != errno.EINVAL:
+                    raise
+        while offset < end:
+            data = os.pread(source, min(end - offset, CHUNK_SIZE), offset)
+            if not data:
+                return
+            view = memoryview(data)
+            while view:
+                view = view[os.write(dest, view):]
+            offset += len(data)
+    except BrokenPipeError:
+        # The copy stopped reading early, like `head` does
+        pass
+    finally:
+        os.close(dest)
+
+
+class CollectOutput:
+    # Keeps every member's output for a reducer
+    def __init__(self, members: List[Member]):
+        self.outputs = {member.tag: bytearray() for member in members}
+
+    def write(self, member: Member, data: bytes):
+        self.outputs[member.tag] += data
+
+    def end(self, member: Member):
+        member.done = True
+
+    def values(self) -> List[str]:
+        return [bytes(self.outputs[tag]).decode('utf-8') for tag in sorted(self.outputs)]
+
+
+class ShardExpression(ShalchemyExpression):
+    # Runs a copy of an expression on each of several line-aligned ranges of
+    # a file at once, and concatenates their outputs in file order or
+    # combines them with a reducer
+    __slots__ = ('expression', 'path', 'jobs', 'reducer', 'buffer_size')
+    _reads_stdin = False
+
+    expression: ShalchemyExpression
+    path: str
+    jobs: int
+    reducer: Optional[Reducer]
+    buffer_size: int
+
+    def __init__(
+        self,
+        expression: ShalchemyExpression,
+        path: str,
+        jobs: Optional[int] = None,
+        reducer: Optional[Reducer] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ):
+        if not is_shalchemy_expression(expression):
+            raise TypeError(f'{repr(expression)} must be an ShalchemyExpression')
+        if not expression._reads_stdin:
+            raise ValueError(f'{repr(expression)} does not read stdin, so it cannot be sharded')
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if jobs < 1:
+            raise ValueError('jobs must be at least 1', jobs)
+        self.expression = expression
+        self.path = os.fspath(path)
+        self.jobs = jobs
+        self.reducer = reducer
+        self.buffer_size = buffer_size
+
+    def _shard(self, process: ThreadedProcess, source: int, ranges: Sequence[Tuple[int, int]], options: SpawnOptions) -> int:
+        finished: 'queue.Queue[Optional[Member]]' = queue.Queue()
+        members: List[Member] = []
+        feeders: List[threading.Thread] = []
+        output: Any = None
+        try:
+            for index, (start, end) in enumerate(ranges):
+                if process.cancelled.is_set():
+                    break
+                reader, writer = os.pipe()
+                try:
+                    members.append(Member(self.expression, index, process, finished, options, stdin=reader))
+                except BaseException:
+                    os.close(writer)
+                    raise
+                finally:
+                    os.close(reader)
+                feeders.append(run_in_thread(functools.partial(feed, source, writer, start, end), name=f'feed {start}-{end}'))
+            else:
+                if self.reducer is None:
+                    output = OrderedOutput(process, members, self.buffer_size)
+                else:
+                    output = CollectOutput(members)
+                merge_outputs(process, members, output)
+        finally:
+            if process.cancelled.is_set() or any(not member.done for member in members):
+                for member in members:
+                    member.kill()
+            for _ in members:
+                finished.get()
+            for member in members:
+                member.close()
+            # A feeder ends once its copy has exited, if not before. The
+            # file can't be closed under it, its number could get reused.
+            for feeder in feeders:
+                feeder.join()
+            os.close(source)
+
+        if process.cancelled.is_set():
+            return -9
+        # The reducer sees every output either way, a copy of `grep -c` with
+        # no matches still counted 0
+        returncode = first_failure(members)
+        if isinstance(output, CollectOutput):
+            reduced = self.reducer(output.values())
+            process.write(reduced if isinstance(reduced, bytes) else reduced.encode('utf-8'))
+        return returncode
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        options = context.options
+        # Opened here so a missing file raises like a redirect from it would
+        source = os.open(options.resolve(self.path), os.O_RDONLY)
+        try:
+            ranges = split_ranges(source, self.jobs)
+            process = ThreadedProcess(
+                lambda process: self._shard(process, source, ranges, options),
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=stderr,
+                name=self._repr(ParenthesisKind.NEVER),
+            )
+        except BaseException:
+            os.close(source)
+            raise
+        context.add_process(process, self)
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return self.jobs * self.expression._count_processes()
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        options = [self.expression._repr(ParenthesisKind.NEVER), represent_file(self.path), f'jobs={self.jobs}']
+        if self.reducer is not None:
+            options.append(f'reducer={getattr(self.reducer, "__name__", repr(self.reducer))}')
+        return f'shard({", ".join(options)})'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
@@ -0,0 +1,297 @@
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import functools
+import os
+import resource
+
+
+RlimitValue = Union[int, Tuple[int, int]]
+IoniceValue = Union[str, Tuple[str, int]]
+# Sorted (name, value) pairs, a value of None removes the variable
+EnvironmentOverlay = Tuple[Tuple[str, Optional[str]], ...]
+
+IOPRIO_CLASSES = {
+    'none': 0,
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# ioprio_set has no wrapper in libc or the os module
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'arm64': 30,
+    'riscv64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    'ppc64': 273,
+    's390x': 282,
+}
+
+# Holds a child until the parent has applied its settings, then turns into
+# the real program. The shell stops itself, so no code of ours runs between
+# fork and exec, and the settings carry over the exec.
+GATE = ('/bin/sh', '-c', 'kill -STOP $$ && exec "$@"', 'sh')
+
+
+def ioprio_value(ionice: IoniceValue) -> int:
+    if isinstance(ionice, str):
+        klass, level = ionice, 4 if ionice in ('realtime', 'best-effort') else 0
+    else:
+        klass, level = ionice
+    if klass not in IOPRIO_CLASSES:
+        raise ValueError(f'ionice class must be one of {list(IOPRIO_CLASSES)}', klass)
+    if not 0 <= level <= 7:
+        raise ValueError('ionice level must be between 0 and 7', level)
+    return (IOPRIO_CLASSES[klass] << IOPRIO_CLASS_SHIFT) | level
+
+
+@functools.lru_cache(maxsize=None)
+def ioprio_setter() -> Callable[[int], None]:
+    # Only ionice needs these, keep them out of `import shalchemy`
+    import ctypes
+    import ctypes.util
+    import platform
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    libc_name = ctypes.util.find_library('c')
+    if number is None or libc_name is None:
+        raise OSError(f'ionice is not supported on {platform.system()} {platform.machine()}')
+    syscall = ctypes.CDLL(libc_name, use_errno=True).syscall
+
+    def set_ioprio(value: int, pid: int = 0):
+        if syscall(number, IOPRIO_WHO_PROCESS, pid, value) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    return set_ioprio
+
+
+class SpawnOptions:
+    # Settings applied to every process spawned underneath an expression that
+    # was configured with `with_`. Unset (None) fields inherit from outer
+    # expressions, set ones override them.
+    __slots__ = ('nice', 'ionice', 'cpu_affinity', 'rlimits', 'env', 'cwd')
+
+    nice: Optional[int]
+    ionice: Optional[IoniceValue]
+    cpu_affinity: Optional[Tuple[int, ...]]
+    rlimits: Dict[str, RlimitValue]
+    env: EnvironmentOverlay
+    cwd: Optional[str]
+
+    def __init__(
+        self,
+        nice: Optional[int] = None,
+        ionice: Optional[IoniceValue] = None,
+        cpu_affinity: Optional[Iterable[int]] = None,
+        rlimits: Optional[Dict[str, RlimitValue]] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+        cwd: Optional[str] = None,
+    ):
+        if ionice is not None:
+            ioprio_value(ionice)
+        self.nice = nice
+        self.ionice = ionice
+        self.cpu_affinity = tuple(cpu_affinity) if cpu_affinity is not None else None
+        self.rlimits = dict(rlimits) if rlimits else {}
+        for name in self.rlimits:
+            if not hasattr(resource, name):
+                raise ValueError(f'Unknown resource limit {name}')
+        self.env = tuple(sorted((env or {}).items()))
+        for name, value in self.env:
+            if not isinstance(name, str) or not name or '=' in name:
+                raise ValueError('Environment variable names must be non-empty strings without "="', name)
+            if value is not None and not isinstance(value, str):
+                raise TypeError('Environment variable values must be str or None', name, value)
+        self.cwd = os.fspath(cwd) if cwd is not None else None
+
+    @staticmethod
+    def from_keywords(
+        nice: Optional[int] = None,
+        ionice: Optional[IoniceValue] = None,
+        cpu_affinity: Optional[Iterable[int]] = None,
+        rlimit_as: Optional[RlimitValue] = None,
+        rlimit_cpu: Optional[RlimitValue] = None,
+        rlimit_nofile: Optional[RlimitValue] = None,
+        env: Optional[Mapping[str, Optional[str]]] = None,
+        cwd: Optional[str] = None,
+    ) -> 'SpawnOptions':
+        # The keyword arguments accepted by `with_`
+        rlimits = {
+            name: value
+            for name, value in (
+                ('RLIMIT_AS', rlimit_as),
+                ('RLIMIT_CPU', rlimit_cpu),
+                ('RLIMIT_NOFILE', rlimit_nofile),
+            )
+            if value is not None
+        }
+        return SpawnOptions(
+            nice=nice,
+            ionice=ionice,
+            cpu_affinity=cpu_affinity,
+            rlimits=rlimits,
+            env=env,
+            cwd=cwd,
+        )
+
+    def merged(self, inner: 'SpawnOptions') -> 'SpawnOptions':
+        return SpawnOptions(
+            nice=inner.nice if inner.nice is not None else self.nice,
+            ionice=inner.ionice if inner.ionice is not None else self.ionice,
+            cpu_affinity=inner.cpu_affinity if inner.cpu_affinity is not None else self.cpu_affinity,
+            rlimits={**self.rlimits, **inner.rlimits},
+            env={**dict(self.env), **dict(inner.env)},
+            # A relative directory is relative to the one it is nested in
+            cwd=os.path.join(self.cwd, inner.cwd) if self.cwd and inner.cwd else inner.cwd or self.cwd,
+        )
+
+    def is_default(self) -> bool:
+        return (
+            self.nice is None and
+            self.ionice is None and
+            self.cpu_affinity is None and
+            not self.rlimits and
+            not self.env and
+            self.cwd is None
+        )
+
+    def has_scheduling(self) -> bool:
+        return self.nice is not None or self.ionice is not None or self.cpu_affinity is not None or bool(self.rlimits)
+
+    def applies_after_spawn(self) -> bool:
+        # Whether the parent can set everything on the child's pid itself.
+        # Linux has a call for each, elsewhere it takes a preexec_fn.
+        return (
+            hasattr(os, 'setpriority')
+            and (self.cpu_affinity is None or hasattr(os, 'sched_setaffinity'))
+            and (not self.rlimits or hasattr(resource, 'prlimit'))
+        )
+
+    def gated(self, arguments: List[str]) -> List[str]:
+        # The command line to spawn so release() can apply the settings
+        # before the program starts. The gate can't report a missing program
+        # the way Popen does, so look for it first.
+        import errno
+        import shutil
+        program = arguments[0]
+        if os.sep in program:
+            found = os.access(self.resolve(program), os.X_OK)
+        else:
+            environment = self.environment()
+            path = environment.get(b'PATH') if environment is not None else os.environb.get(b'PATH')
+            found = shutil.which(program, path=os.fsdecode(path) if path is not None else None) is not None
+        if not found:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), program)
+        return [*GATE, *arguments]
+
+    def release(self, process: Any):
+        # Waits for a gated child to stop itself, applies the settings and
+        # lets it go on to exec the program
+        import signal
+        _, status = os.waitpid(process.pid, os.WUNTRACED)
+        if not os.WIFSTOPPED(status):
+            # Killed before it got that far, and reaped now
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return
+        try:
+            self.apply(process.pid)
+        except BaseException:
+            # It must not run without the settings it was asked for
+            process.kill()
+            process.wait()
+            raise
+        os.kill(process.pid, signal.SIGCONT)
+
+    def apply(self, pid: int):
+        # Sets niceness, I/O priority, CPU affinity and limits on another
+        # process. preexec_fn would do it in the child between fork and
+        # exec, which isn't safe while other threads are running, and
+        # shalchemy always has some.
+        if self.nice:
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + self.nice)
+        if self.ionice is not None:
+            ioprio_setter()(ioprio_value(self.ionice), pid)
+        if self.cpu_affinity is not None:
+            os.sched_setaffinity(pid, self.cpu_affinity)
+        for name, value in self.rlimits.items():
+            limit = value if isinstance(value, tuple) else (value, value)
+            resource.prlimit(pid, getattr(resource, name), limit)
+
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        # Only where apply() can't be used
+        if not self.has_scheduling() or self.applies_after_spawn():
+            return None
+        # Resolve everything up front, the child should only make syscalls
+        nice = self.nice
+        ioprio = ioprio_value(self.ionice) if self.ionice is not None else None
+        set_ioprio = ioprio_setter() if ioprio is not None else None
+        cpu_affinity = self.cpu_affinity
+        rlimits: List[Tuple[int, Tuple[int, int]]] = []
+        for name, value in self.rlimits.items():
+            limit = value if isinstance(value, tuple) else (value, value)
+            rlimits.append((getattr(resource, name), limit))
+
+        def apply():
+            if nice:
+                os.nice(nice)
+            if set_ioprio is not None and ioprio is not None:
+                set_ioprio(ioprio)
+            if cpu_affinity is not None:
+                os.sched_setaffinity(0, cpu_affinity)
+            for which, limit in rlimits:
+                resource.setrlimit(which, limit)
+        return apply
+
+    def resolve(self, path: str) -> str:
+        if self.cwd is None:
+            return path
+        return os.path.join(self.cwd, path)
+
+    def environment(self) -> Optional[Dict[bytes, bytes]]:
+        # os.environ with the overlay laid on top, read at spawn time so
+        # later changes to it are seen
+        if not self.env:
+            return None
+        prepared = dict(os.environb)
+        for name, value in self.env:
+            if value is None:
+                prepared.pop(os.fsencode(name), None)
+            else:
+                prepared[os.fsencode(name)] = os.fsencode(value)
+        return prepared
+
+    def popen_kwargs(self) -> Dict[str, Any]:
+        if self.is_default():
+            return {}
+        kwargs: Dict[str, Any] = {}
+        preexec_fn = self.preexec_fn()
+        if preexec_fn is not None:
+            kwargs['preexec_fn'] = preexec_fn
+        if self.env:
+            kwargs['env'] = self.environment()
+        if self.cwd is not None:
+            kwargs['cwd'] = self.cwd
+        return kwargs
+
+    def describe(self) -> str:
+        parts = []
+        if self.nice is not None:
+            parts.append(f'nice={self.nice}')
+        if self.ionice is not None:
+            parts.append(f'ionice={self.ionice}')
+        if self.cpu_affinity is not None:
+            parts.append(f'cpu_affinity={",".join(str(cpu) for cpu in self.cpu_affinity)}')
+        for name, value in self.rlimits.items():
+            parts.append(f'{name.lower()}={value}')
+        for name, value in self.env:
+            parts.append(f'env:{name}={value}' if value is not None else f'env:-{name}')
+        if self.cwd is not None:
+            parts.append(f'cwd={self.cwd}')
+        return ' '.join(parts)
+
+
+DEFAULT_OPTIONS = SpawnOptions()
@@ -0,0 +1,131 @@
+from typing import Any, Dict, Iterator, List, Optional, Union, TYPE_CHECKING
+
+import codecs
+import csv
+import json
+import os
+import subprocess
+
+if TYPE_CHECKING:
+    from .expressions import ShalchemyExpression
+
+
+# Large enough to amortize the syscall, small enough to keep memory bounded
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+Record = Union[str, bytes]
+
+
+def iter_chunks(
+    expression: 'ShalchemyExpression',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    from .runner import _internal_run
+    result = _internal_run(expression, stdout=subprocess.PIPE)
+    stdout = result.main.stdout
+    fd = stdout.fileno()
+    try:
+        while True:
+            chunk = os.read(fd, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        # If the consumer stopped early, closing our end makes the child
+        # receive SIGPIPE on its next write instead of blocking forever.
+        stdout.close()
+        result.wait()
+
+
+def split_records(
+    chunks: Iterator[Record],
+    sep: Record,
+    keepends: bool = False,
+) -> Iterator[Record]:
+    empty = sep[:0]
+    overlap = len(sep) - 1
+    # Pieces of a record that spans several chunks, joined once it completes
+    partial: List[Any] = []
+    for chunk in chunks:
+        if overlap and partial:
+            # A multi-character separator may straddle the chunk boundary
+            last = partial.pop()
+            chunk = last[-overlap:] + chunk
+            if len(last) > overlap:
+                partial.append(last[:-overlap])
+        pieces = chunk.split(sep)
+        if len(pieces) == 1:
+            if chunk:
+                partial.append(chunk)
+            continue
+        partial.append(pieces[0])
+        head = empty.join(partial)
+        yield head + sep if keepends else head
+        for piece in pieces[1:-1]:
+            yield piece + sep if keepends else piece
+        partial = [pieces[-1]] if pieces[-1] else []
+    if partial:
+        yield empty.join(partial)
+
+
+def decode_chunks(
+    chunks: Iterator[bytes],
+    encoding: str = 'utf-8',
+    errors: str = 'strict',
+) -> Iterator[str]:
+    # Multibyte characters may straddle chunk boundaries, so decode incrementally
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_records(
+    expression: 'ShalchemyExpression',
+    sep: Record = '\n',
+    encoding: Optional[str] = 'utf-8',
+    errors: str = 'strict',
+    keepends: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Record]:
+    chunks = iter_chunks(expression, chunk_size=chunk_size)
+    if encoding is None:
+        if not isinstance(sep, bytes):
+            raise TypeError('sep must be bytes when encoding is None', sep)
+        return split_records(chunks, sep, keepends=keepends)
+    if not isinstance(sep, str):
+        raise TypeError('sep must be a str when an encoding is given', sep)
+    return split_records(
+        decode_chunks(chunks, encoding=encoding, errors=errors),
+        sep,
+        keepends=keepends,
+    )
+
+
+def iter_json_lines(
+    expression: 'ShalchemyExpression',
+    encoding: str = 'utf-8',
+    **json_kwargs: Any,
+) -> Iterator[Any]:
+    for line in iter_records(expression, '\n', encoding=encoding):
+        # NDJSON allows blank lines, e.g. a trailing one
+        if line.strip():
+            yield json.loads(line, **json_kwargs)
+
+
+def iter_csv(
+    expression: 'ShalchemyExpression',
+    dialect: Union[str, csv.Dialect] = 'excel',
+    encoding: str = 'utf-8',
+    dicts: bool = False,
+    **fmtparams: Any,
+) -> Iterator[Union[List[str], Dict[str, str]]]:
+    # The csv module wants lines with their endings so quoted newlines survive
+    lines = iter_records(expression, '\n', encoding=encoding, keepends=True)
+    if dicts:
+        return csv.DictReader(lines, dialect=dialect, **fmtparams)
+    return csv.reader(lines, dialect=dialect, **fmtparams)
@@ -0,0 +1,329 @@
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import errno
+import io
+import os
+import stat
+import threading
+
+from .expressions import ShalchemyExpression, is_shalchemy_expression, represent_file
+from .run_result import RunResult
+from .threaded import ThreadedProcess
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _libc_tee() -> Optional[Callable[[int, int, int, int], int]]:
+    # os has splice but not tee(2). ctypes releases the GIL around the call.
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        function = libc.tee
+    except (AttributeError, OSError, ImportError):
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    function.restype = ctypes.c_ssize_t
+
+    def tee(source: int, dest: int, length: int, flags: int = 0) -> int:
+        while True:
+            count = function(source, dest, length, flags)
+            if count >= 0:
+                return count
+            error = ctypes.get_errno()
+            if error != errno.EINTR:
+                raise OSError(error, os.strerror(error))
+    return tee
+
+
+_tee: Any = False
+_tee_lock = threading.Lock()
+
+
+def tee() -> Optional[Callable[[int, int, int, int], int]]:
+    global _tee
+    with _tee_lock:
+        if _tee is False:
+            _tee = _libc_tee()
+        return _tee
+
+
+def is_pipe(fd: int) -> bool:
+    return stat.S_ISFIFO(os.fstat(fd).st_mode)
+
+
+def write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def read_exactly(fd: int, size: int) -> bytes:
+    pieces = []
+    while size:
+        data = os.read(fd, size)
+        if not data:
+            break
+        pieces.append(data)
+        size -= len(data)
+    return b''.join(pieces)
+
+
+def splice_exactly(source: int, dest: int, size: int):
+    while size:
+        size -= os.splice(source, dest, size)
+
+
+class FdSink:
+    # A descriptor to copy into. `owned` ones are closed when the copy ends,
+    # which is what lets a sink expression see EOF.
+    fd: int
+    owned: bool
+    pipe: bool
+    name: str
+
+    def __init__(self, fd: int, owned: bool, name: str):
+        self.fd = fd
+        self.owned = owned
+        self.pipe = is_pipe(fd)
+        self.name = name
+
+
+class Fanout:
+    # Copies one pipe into every sink. Sinks that are pipes get the data
+    # with tee(2), which shares the pages instead of copying them, and one
+    # fd sink consumes it with splice. Data only passes through Python when
+    # there are Python sinks or when a pipe accepted part of a round. Every
+    # write blocks, so the slowest sink sets the pace for all of them.
+    def __init__(self, source: int, stdout: FdSink, fds: List[FdSink], python: List[Callable[[bytes], Any]]):
+        self.source = source
+        self.stdout = stdout
+        self.python = python
+        sinks = [stdout] + fds
+        self.tee = tee() if is_pipe(source) and hasattr(os, 'splice') else None
+        self.tees: List[FdSink] = []
+        # Written to from Python
+        self.writes: List[FdSink] = []
+        self.splice: Optional[FdSink] = None
+        if self.tee is None:
+            self.writes = sinks
+            return
+        self.tees = [sink for sink in sinks if sink.pipe]
+        self.writes = [sink for sink in sinks if not sink.pipe]
+        if not python and len(self.writes) <= 1:
+            # The last sink can take the data over instead of a copy
+            self.splice = self.writes.pop() if self.writes else self.tees.pop()
+
+    def _broken(self, sink: FdSink):
+        # A sink that stopped reading only drops out. The main output going
+        # away ends the stage, like a process getting SIGPIPE.
+        if sink is self.stdout:
+            raise BrokenPipeError()
+        for sinks in (self.tees, self.writes):
+            if sink in sinks:
+                sinks.remove(sink)
+        if self.splice is sink:
+            self.splice = None
+
+    def _deliver(self, data: bytes, lagging: Sequence[Tuple[FdSink, int]] = ()):
+        for sink in list(self.writes):
+            try:
+                write_all(sink.fd, data)
+            except BrokenPipeError:
+                self._broken(sink)
+        if self.splice is not None:
+            try:
+                write_all(self.splice.fd, data)
+            except BrokenPipeError:
+                self._broken(self.splice)
+        for sink, count in lagging:
+            try:
+                write_all(sink.fd, data[count:])
+            except BrokenPipeError:
+                self._broken(sink)
+        for callback in self.python:
+            callback(data)
+
+    def step(self) -> bool:
+        # Moves one round of data. Returns False at EOF.
+        size: Optional[int] = None
+        lagging: List[Tuple[FdSink, int]] = []
+        for sink in list(self.tees):
+            try:
+                count = self.tee(self.source, sink.fd, size or CHUNK_SIZE, 0)
+            except BrokenPipeError:
+                self._broken(sink)
+                continue
+            if size is None:
+                if count == 0:
+                    return False
+                size = count
+            elif count < size:
+                lagging.append((sink, count))
+
+        if self.splice is not None and not lagging:
+            try:
+                if size is None:
+                    return os.splice(self.source, self.splice.fd, CHUNK_SIZE) > 0
+                splice_exactly(self.source, self.splice.fd, size)
+                return True
+            except BrokenPipeError:
+                self._broken(self.splice)
+            except OSError as error:
+                # Some descriptors, such as terminals, can't be spliced into
+                if error.errno != errno.EINVAL:
+                    raise
+                self.writes.append(self.splice)
+                self.splice = None
+        data = read_exactly(self.source, size) if size else os.read(self.source, CHUNK_SIZE)
+        if not data:
+            return False
+        self._deliver(data, lagging)
+        return True
+
+
+def python_sink(sink: Any) -> Tuple[Callable[[bytes], Any], Optional[Callable[[], Any]]]:
+    from .reactor import io_sink
+    if isinstance(sink, io.IOBase):
+        return io_sink(sink)
+    if hasattr(sink, 'update'):
+        # hashlib objects and the like
+        return sink.update, None
+    return sink, None
+
+
+class TeeExpression(ShalchemyExpression):
+    # Copies stdin to stdout and to every sink: file paths, Python IO
+    # objects, callbacks or objects with `update` such as hashes, and
+    # expressions, which read the copy on their stdin
+    __slots__ = ('sinks', 'append')
+
+    sinks: List[Any]
+    append: bool
+
+    def __init__(self, *sinks: Any, append: bool = False):
+        for sink in sinks:
+            valid = (
+                isinstance(sink, (str, io.IOBase))
+                or is_shalchemy_expression(sink)
+                or callable(sink)
+                or hasattr(sink, 'update')
+            )
+            if not valid:
+                raise TypeError('tee sinks must be paths, IO objects, callables or expressions', sink)
+            if is_shalchemy_expression(sink) and not sink._reads_stdin:
+                raise ValueError(f'{repr(sink)} does not read stdin, so it cannot be a tee sink')
+        self.sinks = list(sinks)
+        self.append = append
+
+    def _tee(self, process: ThreadedProcess, fds: List[FdSink], python: List[Any], ready: threading.Event):
+        ready.wait()
+        finishes = []
+        callbacks = []
+        try:
+            if process.cancelled.is_set():
+                return -9
+            for sink in python:
+                callback, finish = python_sink(sink)
+                callbacks.append(callback)
+                if finish is not None:
+                    finishes.append(finish)
+            fanout = Fanout(process.stdin_fd, FdSink(process.stdout_fd, False, 'stdout'), fds, callbacks)
+            while not process.cancelled.is_set() and fanout.step():
+                pass
+            for finish in finishes:
+                finish()
+            return -9 if process.cancelled.is_set() else 0
+        finally:
+            for sink in fds:
+                if sink.owned:
+                    os.close(sink.fd)
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if context is None:
+            context = RunResult()
+        fds: List[FdSink] = []
+        python: List[Any] = []
+        expressions: List[Tuple[ShalchemyExpression, int]] = []
+        ready = threading.Event()
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.append else os.O_TRUNC)
+        try:
+            for sink in self.sinks:
+                if isinstance(sink, str):
+                    fds.append(FdSink(os.open(context.options.resolve(sink), flags, 0o666), True, sink))
+                elif is_shalchemy_expression(sink):
+                    reader, writer = os.pipe()
+                    fds.append(FdSink(writer, True, repr(sink)))
+                    expressions.append((sink, reader))
+                elif isinstance(sink, io.IOBase) and _fileno(sink) is not None:
+                    sink.flush()
+                    fds.append(FdSink(_fileno(sink), False, represent_file(sink)))
+                else:
+                    python.append(sink)
+        except BaseException:
+            for sink in fds:
+                if sink.owned:
+                    os.close(sink.fd)
+            for _, reader in expressions:
+                os.close(reader)
+            raise
+
+        process = ThreadedProcess(
+            lambda process: self._tee(process, fds, python, ready),
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            name=self._repr(ParenthesisKind.NEVER),
+        )
+        context.add_process(process, self, kind='tee')
+        # Like bash's >(...), sink expressions share the tee's stdout
+        output = process.stdout_fd
+        try:
+            for index, (expression, reader) in enumerate(expressions):
+                try:
+                    first_stage = len(context.stages)
+                    expression._run(stdin=reader, stdout=output, stderr=stderr, context=context)
+                    context.mark_stages(first_stage, 'tee')
+                finally:
+                    os.close(reader)
+        except BaseException:
+            for _, reader in expressions[index + 1:]:
+                os.close(reader)
+            process.kill()
+            raise
+        finally:
+            ready.set()
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return sum(sink._count_processes() for sink in self.sinks if is_shalchemy_expression(sink))
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        names = []
+        for sink in self.sinks:
+            if is_shalchemy_expression(sink):
+                names.append(f'>({sink._repr(ParenthesisKind.NEVER)})')
+            elif isinstance(sink, (str, io.IOBase)):
+                names.append(represent_file(sink))
+            else:
+                names.append(repr(sink))
+        return f'tee({", ".join(names)})'
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'
+
+
+def _fileno(stream: io.IOBase) -> Optional[int]:
+    try:
+        return stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
@@ -86,3 +86,17 @@ class TestArguments(TestCase):
             'TrUe',
         ])
 
+
+    def test_curried_sharing(self):
+        base = probe.args.show
+        left = base.left('x', flag=True)
+        right = base.right
+        self.assertEqual(json.loads(str(left))[1:], ['args', 'show', 'left', 'x', '--flag'])
+        self.assertEqual(json.loads(str(right))[1:], ['args', 'show', 'right'])
+        self.assertEqual(json.loads(str(base))[1:], ['args', 'show'])
+        self.assertIs(left._parent._parent, base)
+        self.assertEqual(type(base).__dictoffset__, 0)
+
+    def test_nested_lists(self):
+        stdout = str(probe.args(['a', ['b', ('c', ['d'])]], 'e'))
+        self.assertEqual(json.loads(stdout)[1:], ['args', 'a', 'b', 'c', 'd', 'e'])
@@ -0,0 +1,45 @@
+import unittest
+
+from shalchemy import sh
+from shalchemy.bin import printf, seq
+from shalchemy.test.base import TestCase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestToNumpy(TestCase):
+    def test_text(self):
+        result = seq('1', '100000').to_numpy()
+        self.assertEqual(result.shape, (100000,))
+        self.assertEqual(result.sum(), 5000050000)
+
+    def test_columns(self):
+        result = printf('%s', '1,2,3\n4,5,6\n').to_numpy(dtype='int64', delimiter=',')
+        self.assertEqual(result.tolist(), [[1, 2, 3], [4, 5, 6]])
+        result = printf('%s', '1 2\n3 4\n5 6').to_numpy(dtype='int64')
+        self.assertEqual(result.tolist(), [[1, 2], [3, 4], [5, 6]])
+        result = printf('%s', '1,2\n\n3,4\n').to_numpy(dtype='int64', delimiter=',')
+        self.assertEqual(result.tolist(), [[1, 2], [3, 4]])
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            printf('%s', '1,,3\n').to_numpy(delimiter=',')
+        with self.assertRaises(ValueError):
+            printf('%s', '1,2,\n').to_numpy(delimiter=',')
+        with self.assertRaises(ValueError):
+            printf('%s', '1\n2 3\n').to_numpy()
+        with self.assertRaises(ValueError):
+            printf('%s', '1 2\n3\n4 5 6\n').to_numpy()
+
+    def test_binary(self):
+        data = numpy.arange(100000, dtype='<u4')
+        with open(self.filename, 'wb') as file:
+            file.write(data.tobytes())
+        result = sh('cat', self.filename).to_numpy(dtype='<u4', binary=True)
+        self.assertTrue((result == data).all())
+        with self.assertRaises(ValueError):
+            sh('head -c 3 /dev/zero').to_numpy(dtype='<u4', binary=True)
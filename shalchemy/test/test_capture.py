@@ -0,0 +1,115 @@
+import io
+
+from shalchemy import sh
+from shalchemy.bin import cat, seq, wc, yes
+from shalchemy.capture import CaptureBuffer, CaptureLimit, CaptureLimitExceeded
+from shalchemy.test.base import TestCase
+
+
+def feed(limit: CaptureLimit, *chunks: bytes) -> CaptureBuffer:
+    buffer = CaptureBuffer(limit)
+    for chunk in chunks:
+        buffer.write(chunk)
+    return buffer
+
+
+class TestCaptureBuffer(TestCase):
+    def test_head(self):
+        buffer = feed(CaptureLimit(max_bytes=5, policy='truncate-and-drain'), b'abc', b'defg', b'h')
+        self.assertEqual(buffer.getvalue(), b'abcde')
+        self.assertTrue(buffer.exceeded)
+        buffer = feed(CaptureLimit(max_lines=2, policy='truncate-and-drain'), b'a\nb', b'\nc\n')
+        self.assertEqual(buffer.getvalue(), b'a\nb\n')
+        self.assertTrue(buffer.exceeded)
+        buffer = feed(CaptureLimit(max_bytes=4, max_lines=2), b'a\nb\n')
+        self.assertEqual(buffer.getvalue(), b'a\nb\n')
+        self.assertFalse(buffer.exceeded)
+
+    def test_tail(self):
+        buffer = feed(CaptureLimit(max_bytes=4, policy='keep-tail'), b'abc', b'defg', b'h')
+        self.assertEqual(buffer.getvalue(), b'efgh')
+        self.assertTrue(buffer.exceeded)
+        buffer = feed(CaptureLimit(max_lines=2, policy='keep-tail'), b'1\n2\n', b'3\n4', b'\n5')
+        self.assertEqual(buffer.getvalue(), b'4\n5')
+        buffer = feed(CaptureLimit(max_lines=2, policy='keep-tail'), b'1\n2\n')
+        self.assertEqual(buffer.getvalue(), b'1\n2\n')
+        self.assertFalse(buffer.exceeded)
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            CaptureLimit(10, policy='explode')
+
+
+class TestCaptureLimits(TestCase):
+    def test_within_limit(self):
+        self.assertEqual(str(seq('3').limit(max_bytes=100)), '1\n2\n3\n')
+
+    def test_raise(self):
+        with self.assertRaises(CaptureLimitExceeded) as caught:
+            bytes(yes.limit(max_bytes=1000))
+        self.assertEqual(caught.exception.stream, 'stdout')
+        self.assertEqual(caught.exception.capture.stdout, b'y\n' * 500)
+
+    def test_kill(self):
+        self.assertEqual(list(yes.limit(max_lines=3, policy='kill')), ['y', 'y', 'y'])
+        captured = (yes | cat).limit(max_bytes=10, policy='kill').capture()
+        self.assertTrue(captured.stdout_exceeded)
+        self.assertNotEqual(captured.returncode, 0)
+
+    def test_truncate_and_drain(self):
+        captured = seq('100000').limit(max_lines=2, policy='truncate-and-drain').capture()
+        self.assertEqual(captured.stdout, b'1\n2\n')
+        self.assertEqual(captured.returncode, 0)
+
+    def test_keep_tail(self):
+        self.assertEqual(str(seq('100000').limit(max_lines=2, policy='keep-tail')), '99999\n100000\n')
+
+    def test_stderr(self):
+        noisy = sh('sh', '-c', 'seq 100000 >&2; echo out; exit 3')
+        sink = io.StringIO()
+        with sh.defaults(stderr=sink):
+            self.assertEqual(str(noisy.limit(stderr_lines=2)), 'out\n')
+        self.assertEqual(sink.getvalue(), '99999\n100000\n')
+
+        captured = noisy.limit(stderr_bytes=7).capture()
+        self.assertEqual((captured.stdout, captured.stderr, captured.returncode), (b'out\n', b'100000\n', 3))
+        self.assertTrue(captured.stderr_exceeded)
+
+        with self.assertRaises(CaptureLimitExceeded) as caught:
+            sh('sh', '-c', 'yes >&2').limit(stderr_bytes=10, stderr_policy='raise').capture()
+        self.assertEqual(caught.exception.stream, 'stderr')
+        self.assertEqual(caught.exception.capture.stderr, b'y\n' * 5)
+
+    def test_capture(self):
+        captured = sh('sh', '-c', 'echo out; echo err >&2').capture()
+        self.assertEqual((captured.stdout, captured.stderr, captured.returncode), (b'out\n', b'err\n', 0))
+
+    def test_streaming(self):
+        limited = seq('100000').limit(100, policy='kill')
+        self.assertEqual(sum(len(chunk) for chunk in limited.iter_chunks()), 100)
+        self.assertEqual(len(list(limited.iter_lines())), 37)
+        drained = seq('100000').limit(max_lines=5, policy='truncate-and-drain')
+        self.assertEqual(list(drained.iter_lines()), ['1', '2', '3', '4', '5'])
+        self.assertEqual(int(drained | wc('-l')), 5)
+        tail = seq('100000').limit(max_lines=2, policy='keep-tail')
+        self.assertEqual(list(tail.iter_lines()), ['99999', '100000'])
+        sink = io.StringIO()
+        self.assertEqual(sh.run(seq('100000').limit(max_lines=2, policy='truncate-and-drain') > sink), 0)
+        self.assertEqual(sink.getvalue(), '1\n2\n')
+
+    def test_streaming_raise(self):
+        with self.assertRaises(CaptureLimitExceeded) as caught:
+            for _ in yes.limit(max_bytes=1000).iter_lines():
+                pass
+        self.assertEqual(caught.exception.stream, 'stdout')
+        self.assertIsNone(caught.exception.capture)
+        with self.assertRaises(CaptureLimitExceeded):
+            sh.run(sh('sh', '-c', 'yes >&2').limit(stderr_bytes=10, stderr_policy='raise') > io.StringIO())
+
+    def test_streaming_stderr(self):
+        noisy = sh('sh', '-c', 'seq 100000 >&2; echo out; exit 3')
+        sink = io.StringIO()
+        with sh.defaults(stderr=sink):
+            self.assertEqual(list(noisy.limit(stderr_lines=2).iter_lines()), ['out'])
+        self.assertEqual(sink.getvalue(), '99999\n100000\n')
+        self.assertEqual(sh.run(noisy.limit(stderr_lines=2), stderr=io.StringIO()), 3)
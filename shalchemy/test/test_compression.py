@@ -0,0 +1,50 @@
+import bz2
+import gzip
+import io
+import lzma
+import pickle
+
+from shalchemy import sh
+from shalchemy.bin import cat, seq, wc
+from shalchemy.test.base import TestCase
+
+DECOMPRESS = {
+    'gzip': gzip.decompress,
+    'bzip2': bz2.decompress,
+    'xz': lzma.decompress,
+}
+
+
+class TestCompression(TestCase):
+    def test_round_trip(self):
+        expected = ''.join(f'{number}\n' for number in range(1, 100001)).encode()
+        for format, decompress in DECOMPRESS.items():
+            compressed = bytes(seq('100000') | sh.compress(format, level=1))
+            self.assertEqual(decompress(compressed), expected)
+            restored = io.BytesIO()
+            sh.run(sh.decompress(format) < io.BytesIO(compressed), stdout=restored)
+            self.assertEqual(restored.getvalue(), expected)
+
+    def test_parallel(self):
+        expected = ''.join(f'{number}\n' for number in range(1, 200001)).encode()
+        for format, decompress in DECOMPRESS.items():
+            compressor = sh.compress(format, threads=4, block_size=64 * 1024)
+            compressed = bytes(seq('200000') | compressor)
+            self.assertEqual(decompress(compressed), expected)
+            self.assertEqual(bytes((cat < io.BytesIO(compressed)) | sh.decompress(format)), expected)
+
+    def test_files(self):
+        sh.run(seq('1000') | sh.compress() > self.filename)
+        self.assertEqual(str((sh.decompress() < self.filename) | wc('-l')).strip(), '1000')
+        self.assertEqual(str(sh('gzip', '-dc', self.filename) | wc('-l')).strip(), '1000')
+        self.assertEqual(str((sh.decompress('gz') < self.filename) | sh.compress('xz') | sh.decompress('xz') | wc('-l')).strip(), '1000')
+
+    def test_corrupt_input(self):
+        truncated = gzip.compress(b'hello' * 1000)[:-10]
+        self.assertEqual(sh.run(sh.decompress() < io.BytesIO(truncated), stdout=io.BytesIO(), stderr=io.StringIO()), 1)
+        with self.assertRaises(ValueError):
+            sh.compress('rar')
+
+    def test_pickle(self):
+        compressor = pickle.loads(pickle.dumps(sh.compress('xz', level=2, threads=2)))
+        self.assertEqual(repr(compressor), '$(compress(xz, level=2, threads=2))')
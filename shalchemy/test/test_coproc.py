@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import threading
+
+from shalchemy import sh
+from shalchemy.bin import cat
+from shalchemy.test.base import TestCase
+
+# Answers every line with its upper-cased text, dies on "die" and hangs on "hang"
+SERVER = '''
+import sys, time
+for line in sys.stdin:
+    line = line.strip()
+    if line == "die":
+        sys.exit(1)
+    if line == "hang":
+        time.sleep(60)
+    print(line.upper(), flush=True)
+'''
+
+
+def server():
+    return sh([sys.executable, '-u', '-c', SERVER])
+
+
+class TestCoprocess(TestCase):
+    def test_request(self):
+        with sh.coproc(cat) as coprocess:
+            self.assertEqual(coprocess.request('hello\n'), 'hello')
+            self.assertEqual(coprocess.request(b'bytes\n'), b'bytes')
+            self.assertEqual(coprocess.request('a;b;', until=';'), 'a')
+            self.assertEqual(coprocess.request('\n'), 'b;')
+            self.assertEqual(coprocess.requests, 4)
+            self.assertTrue(coprocess.alive)
+        self.assertFalse(coprocess.alive)
+        with self.assertRaises(ValueError):
+            coprocess.request('closed\n')
+
+    def test_pipeline(self):
+        with sh.coproc(cat | server()) as coprocess:
+            for word in ('one', 'two', 'three'):
+                self.assertEqual(coprocess.request(word + '\n'), word.upper())
+
+    def test_exit_and_timeout(self):
+        with sh.coproc(server()) as coprocess:
+            with self.assertRaises(EOFError):
+                coprocess.request('die\n')
+        with sh.coproc(server()) as coprocess:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                coprocess.request('hang\n', timeout=0.2)
+            coprocess.kill()
+
+    def test_pool(self):
+        results = []
+        with sh.coproc_pool(server(), 3) as pool:
+            def work(index: int):
+                results.append(pool.request(f'item{index}\n'))
+            threads = [threading.Thread(target=work, args=(index,)) for index in range(30)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sorted(results), sorted(f'ITEM{index}' for index in range(30)))
+            self.assertEqual(pool.restarts, 0)
+
+            with self.assertRaises(EOFError):
+                pool.request('die\n')
+            self.assertEqual(pool.restarts, 1)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                pool.request('hang\n', timeout=0.2)
+            self.assertEqual(pool.restarts, 2)
+            self.assertEqual([pool.request('ok\n') for _ in range(3)], ['OK'] * 3)
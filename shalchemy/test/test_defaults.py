@@ -0,0 +1,75 @@
+import io
+import subprocess
+import threading
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, pwd, printenv, sleep
+from shalchemy.test.base import TestCase, random_string
+
+
+class TestDefaults(TestCase):
+    def test_streams(self):
+        out = io.StringIO()
+        with sh.defaults(stdout=out):
+            sh.run(echo('inside'))
+        sh.run(echo('outside'))
+        self.assertEqual(out.getvalue(), 'inside\n')
+        self.assertEqual(self.read_stdout(), 'outside\n')
+
+    def test_nesting(self):
+        outer, inner = io.StringIO(), io.StringIO()
+        with sh.defaults(stdout=outer, env={'SHALCHEMY_TEST_A': 'a', 'SHALCHEMY_TEST_B': 'b'}):
+            with sh.defaults(stdout=inner, env={'SHALCHEMY_TEST_B': 'c'}):
+                sh.run(printenv('SHALCHEMY_TEST_A', 'SHALCHEMY_TEST_B'))
+            sh.run(printenv('SHALCHEMY_TEST_B'))
+            # Explicit arguments and `with_` still win
+            explicit = io.StringIO()
+            sh.run(printenv('SHALCHEMY_TEST_B').with_(env={'SHALCHEMY_TEST_B': 'd'}), stdout=explicit)
+        self.assertEqual(inner.getvalue(), 'a\nc\n')
+        self.assertEqual(outer.getvalue(), 'b\n')
+        self.assertEqual(explicit.getvalue(), 'd\n')
+
+    def test_threads(self):
+        results = {}
+
+        def worker(name: str):
+            sink = io.StringIO()
+            with sh.defaults(stdout=sink):
+                for _ in range(10):
+                    sh.run(echo(name) | cat)
+            results[name] = sink.getvalue()
+
+        names = [random_string() for _ in range(8)]
+        threads = [threading.Thread(target=worker, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in names:
+            self.assertEqual(results[name], f'{name}\n' * 10)
+        self.assertEqual(self.read_stdout(), '')
+
+    def test_timeout(self):
+        with sh.defaults(timeout=0.1):
+            with self.assertRaises(subprocess.TimeoutExpired):
+                sh.run(sleep('5') | cat)
+            self.assertEqual(sh.run(echo('quick')), 0)
+        with self.assertRaises(subprocess.TimeoutExpired):
+            sh.run(sleep('5'), timeout=0.1)
+        with sh.defaults(timeout=0.1):
+            with self.assertRaises(subprocess.TimeoutExpired):
+                list(sleep('5').iter_lines())
+
+    def test_options(self):
+        with sh.defaults(cwd='/'):
+            self.assertEqual(str(pwd).strip(), '/')
+
+    def test_timeout_after_exit(self):
+        from shalchemy.runner import _internal_run
+        result = _internal_run(echo('done'), timeout=0.05)
+        time.sleep(0.2)
+        # The timer fired after everything had exited on its own
+        result.wait()
+        self.assertEqual(result.main.returncode, 0)
+        self.assertFalse(result.timed_out)
@@ -0,0 +1,90 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+from shalchemy import sh, globbing
+from shalchemy.bin import echo, wc
+from shalchemy.test.base import TestCase
+
+
+class TestGlob(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        for name in ('b.log', 'a.log', 'c.txt', '.hidden.log', 'sub/d.log', 'sub/deeper/e.log'):
+            path = os.path.join(self.directory, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def expand(self, pattern, **kwargs):
+        return str(echo(sh.glob(pattern, **kwargs)).with_(cwd=self.directory)).split()
+
+    def test_expands_at_run_time(self):
+        command = echo(sh.glob('*.log')).with_(cwd=self.directory)
+        self.assertEqual(repr(echo(sh.glob('*.log'))), '$(echo *.log)')
+        self.assertEqual(str(command).split(), ['a.log', 'b.log'])
+        open(os.path.join(self.directory, 'f.log'), 'w').close()
+        self.assertEqual(str(command).split(), ['a.log', 'b.log', 'f.log'])
+
+    def test_patterns(self):
+        self.assertEqual(self.expand('[ab].log'), ['a.log', 'b.log'])
+        self.assertEqual(self.expand('*/*.log'), ['sub/d.log'])
+        self.assertEqual(self.expand('**/*.log'), ['a.log', 'b.log', 'sub/d.log', 'sub/deeper/e.log'])
+        self.assertEqual(self.expand('*/'), ['sub/'])
+        self.assertEqual(self.expand('.*'), ['.hidden.log'])
+        self.assertEqual(self.expand('*.log', include_hidden=True), ['.hidden.log', 'a.log', 'b.log'])
+        self.assertEqual(self.expand('sub/d.log'), ['sub/d.log'])
+        absolute = os.path.join(self.directory, '*.txt')
+        self.assertEqual(str(echo(sh.glob(absolute))).split(), [os.path.join(self.directory, 'c.txt')])
+
+    def test_symlink_loop(self):
+        os.symlink('..', os.path.join(self.directory, 'sub', 'loop'))
+        # `**` doesn't follow it, but spelled out it is still a directory
+        self.assertEqual(self.expand('**/*.log'), ['a.log', 'b.log', 'sub/d.log', 'sub/deeper/e.log'])
+        self.assertEqual(self.expand('sub/loop/*.log'), ['sub/loop/a.log', 'sub/loop/b.log'])
+        self.assertEqual(self.expand('sub/*/e.log'), ['sub/deeper/e.log'])
+        self.assertEqual(self.expand('**/'), ['sub/', 'sub/deeper/', 'sub/loop/'])
+        self.assertEqual(self.expand('sub/**'), ['sub/d.log', 'sub/deeper', 'sub/deeper/e.log', 'sub/loop'])
+
+    def test_no_match(self):
+        self.assertEqual(self.expand('*.csv'), ['*.csv'])
+        self.assertEqual(self.expand('*.csv', null=True), [])
+
+    def test_unsorted(self):
+        self.assertEqual(sorted(self.expand('*.log', sort=False)), ['a.log', 'b.log'])
+
+    def test_cache(self):
+        globbing.cache.clear()
+        # Listings of directories changed a moment ago aren't trusted
+        self.expand('*.log')
+        self.expand('*.log')
+        self.assertEqual(globbing.cache.hits, 0)
+        os.utime(self.directory, (0, 0))
+        self.expand('*.log')
+        self.assertEqual(self.expand('*.log'), ['a.log', 'b.log'])
+        self.assertEqual(globbing.cache.hits, 1)
+        # A new file changes the directory's mtime
+        open(os.path.join(self.directory, 'f.log'), 'w').close()
+        self.assertEqual(self.expand('*.log'), ['a.log', 'b.log', 'f.log'])
+        self.assertEqual(globbing.cache.hits, 1)
+        os.utime(self.directory, (0, 0))
+        self.expand('*.log', cache=False)
+        self.assertEqual(globbing.cache.hits, 1)
+
+    def test_xargs(self):
+        command = echo.xargs(sh.glob('**/*.log'), max_args=1).with_(cwd=self.directory)
+        self.assertEqual(str(command), 'a.log\nb.log\nsub/d.log\nsub/deeper/e.log\n')
+        unsorted = echo.xargs(sh.glob('**/*.log', sort=False), max_args=3).with_(cwd=self.directory)
+        self.assertEqual(int(unsorted | wc('-w')), 4)
+        self.assertEqual(str(echo.xargs(sh.glob('*.csv')).with_(cwd=self.directory)), '')
+
+    def test_pickle(self):
+        command = echo(sh.glob('*.log', sort=False))
+        loaded = pickle.loads(pickle.dumps(command))
+        self.assertEqual(repr(loaded), repr(command))
+        self.assertFalse(loaded._args[1].sort)
@@ -0,0 +1,58 @@
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, seq, sort, wc
+from shalchemy.test.base import TestCase
+
+
+def delayed(delay, *lines):
+    script = f'sleep {delay}; ' + '; '.join(f'echo {line}' for line in lines)
+    return sh('sh', '-c', script)
+
+
+class TestGroup(TestCase):
+    def test_ordered(self):
+        group = sh.group(delayed(0.2, 'a1', 'a2'), echo('b'), seq('3'))
+        self.assertEqual(repr(group), "$(group(sh -c 'sleep 0.2; echo a1; echo a2', echo b, seq 3))")
+        self.assertEqual(str(group), 'a1\na2\nb\n1\n2\n3\n')
+
+    def test_runs_concurrently(self):
+        started = time.monotonic()
+        self.assertEqual(str(sh.group(delayed(0.3, 'a'), delayed(0.3, 'b'), delayed(0.3, 'c'))), 'a\nb\nc\n')
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    def test_spill(self):
+        # Members ahead of their turn go past the memory buffer
+        group = sh.group(delayed(0.1, 'first'), seq('100000'), seq('100000'), buffer_size=1000)
+        lines = str(group).splitlines()
+        self.assertEqual(len(lines), 200001)
+        self.assertEqual(lines[:3], ['first', '1', '2'])
+        self.assertEqual(lines[100001], '1')
+
+    def test_interleaved(self):
+        group = sh.group(delayed(0.3, 'a'), delayed(0, 'b'), ordered=False)
+        self.assertEqual(str(group), 'b\na\n')
+        lines = str(sh.group(seq('20000'), seq('20000'), ordered=False)).splitlines()
+        self.assertEqual(sorted(lines, key=int), sorted([str(n) for n in range(1, 20001)] * 2, key=int))
+
+    def test_composes(self):
+        self.assertEqual(str(sh.group(echo('b'), echo('a')) | sort), 'a\nb\n')
+        self.assertEqual(int(sh.group(seq('10'), seq('5')) | wc('-l')), 15)
+        sh.run(sh.group(echo('a'), echo('b')) > self.filename)
+        self.assertEqual(self.read_file(), 'a\nb\n')
+        self.assertEqual(str(sh.group(echo('x'), sh.group(echo('y'), echo('z')))), 'x\ny\nz\n')
+        with self.assertRaises(ValueError):
+            echo('a') | sh.group(cat)
+
+    def test_returncode(self):
+        self.assertTrue(sh.group(echo('a'), echo('b')))
+        self.assertEqual(sh.run(sh.group(echo('a'), sh('sh', '-c', 'exit 3'), sh('false'))), 3)
+        self.assertEqual(sh.run(sh.group(echo('a'), sh('shalchemy_does_not_exist'))), 127)
+
+    def test_kill(self):
+        started = time.monotonic()
+        result = sh.start(sh.group(sh('sleep', '5'), echo('a')))
+        result.kill()
+        result.wait()
+        self.assertNotEqual(result.main.returncode, 0)
+        self.assertLess(time.monotonic() - started, 2)
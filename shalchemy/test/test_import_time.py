@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+from shalchemy.test.base import TestCase
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Only needed by optional features, so `import shalchemy` must not load them
+LAZY_MODULES = (
+    'tempfile',
+    'shutil',
+    'random',
+    'textwrap',
+    'dataclasses',
+    'shlex',
+    'json',
+    'csv',
+    'inspect',
+    'shalchemy.streaming',
+    'shalchemy.capture',
+    'shalchemy.reaper',
+)
+
+
+def import_profile():
+    # Returns {module: cumulative microseconds} for one fresh interpreter
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import shalchemy'],
+        env=env,
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    profile = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+class TestImportTime(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Make sure nothing is recompiled while measuring
+        subprocess.run(
+            [sys.executable, '-m', 'compileall', '-q', os.path.join(ROOT, 'shalchemy')],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def test_lazy_modules(self):
+        profile = import_profile()
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, profile)
+
+    def test_import_time(self):
+        # Loose enough for a slow machine, tight enough to catch a heavy
+        # import creeping back in. The best of a few runs drops the noise.
+        best = min(import_profile()['shalchemy'] for _ in range(5))
+        self.assertLess(best, 30_000)
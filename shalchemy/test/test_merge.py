@@ -0,0 +1,63 @@
+from shalchemy import sh
+from shalchemy.bin import cat, echo, head, seq, sort, wc
+from shalchemy.merge import Input, merge_blocks, numeric_key
+from shalchemy.test.base import TestCase
+
+
+def shell(script):
+    return sh('sh', '-c', script)
+
+
+class TestMergeSorted(TestCase):
+    def test_bytes(self):
+        merged = sh.merge_sorted([shell('seq 2000 | LC_ALL=C sort'), shell('seq 3 3 5000 | LC_ALL=C sort')])
+        expected = shell('(seq 2000; seq 3 3 5000) | LC_ALL=C sort')
+        self.assertEqual(str(merged), str(expected))
+
+    def test_numeric(self):
+        merged = sh.merge_sorted([seq('1', '3', '30'), seq('2', '3', '30'), seq('3', '3', '30')], numeric=True)
+        self.assertEqual(repr(merged), '$(merge_sorted([seq 1 3 30, seq 2 3 30, seq 3 3 30], numeric=True))')
+        self.assertEqual(str(merged).split(), [str(n) for n in range(1, 31)])
+        self.assertEqual(numeric_key(b' -2.5 apples'), (-2.5, b' -2.5 apples'))
+        self.assertEqual(numeric_key(b'apples'), (0.0, b'apples'))
+
+    def test_key_and_reverse(self):
+        merged = sh.merge_sorted([echo('-e', 'a\\nbbb'), echo('-e', 'cc\\ndddd')], key=len)
+        self.assertEqual(list(merged), ['a', 'cc', 'bbb', 'dddd'])
+        reverse = sh.merge_sorted([seq('9', '-2', '1'), seq('10', '-2', '2')], numeric=True, reverse=True)
+        self.assertEqual(str(reverse).split(), [str(n) for n in range(10, 0, -1)])
+
+    def test_unterminated_lines(self):
+        merged = sh.merge_sorted([sh(['printf', 'a\nc']), sh(['printf', 'b\nd\n'])])
+        self.assertEqual(str(merged), 'a\nb\nc\nd\n')
+
+    def test_large(self):
+        merged = sh.merge_sorted([seq('200000'), seq('200000')], numeric=True)
+        self.assertEqual(int(merged | wc('-l')), 400000)
+        lines = str(merged).split()
+        self.assertEqual(lines[:4], ['1', '1', '2', '2'])
+        self.assertEqual(lines[-1], '200000')
+
+    def test_blocks(self):
+        import os
+        inputs = []
+        for data in (b'a\nc\ne\n', b'b\nd\n', b''):
+            reader, writer = os.pipe()
+            os.write(writer, data)
+            os.close(writer)
+            inputs.append(Input(reader))
+        self.assertEqual(sum(merge_blocks(inputs), []), [b'a', b'b', b'c', b'd', b'e'])
+        for item in inputs:
+            os.close(item.fd)
+
+    def test_composes(self):
+        self.assertEqual(str(sh.merge_sorted([sh('yes', 'a'), sh('yes', 'b')]) | head('-n', '2')), 'a\na\n')
+        self.assertEqual(str(sh.merge_sorted([echo('b'), echo('a')]) | sort('-r')), 'b\na\n')
+        with self.assertRaises(ValueError):
+            echo('a') | sh.merge_sorted([cat])
+        with self.assertRaises(ValueError):
+            sh.merge_sorted([echo('a')], key=len, numeric=True)
+
+    def test_returncode(self):
+        self.assertEqual(sh.run(sh.merge_sorted([echo('a'), shell('exit 4')])), 4)
+        self.assertTrue(sh.merge_sorted([echo('a'), echo('b')]))
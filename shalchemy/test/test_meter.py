@@ -0,0 +1,60 @@
+import subprocess
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, head, seq, yes
+from shalchemy.test.base import TestCase
+
+
+class TestMeter(TestCase):
+    def test_pipe_edge(self):
+        expected = ''.join(f'{number}\n' for number in range(1, 100001))
+        result = sh.start(seq('100000').meter('numbers') | cat, stdout=subprocess.PIPE)
+        self.assertEqual(result.main.stdout.read().decode(), expected)
+        result.main.stdout.close()
+        result.wait()
+        meter = result.meters['numbers']
+        self.assertEqual(meter.transferred, len(expected))
+        self.assertGreater(meter.throughput, 0)
+        self.assertIsNotNone(meter.finished)
+        self.assertEqual(str(seq('3').meter('a') | cat.meter('b')), '1\n2\n3\n')
+
+    def test_exit_status(self):
+        self.assertEqual(sh.run(sh('sh', '-c', 'echo hi; exit 3').meter('out') > self.filename), 3)
+        self.assertEqual(self.read_file(), 'hi\n')
+        self.assertEqual(str(yes.meter('yes') | head('-n1')), 'y\n')
+
+    def test_redirects(self):
+        result = sh.start(echo('hello').meter('out') > self.filename)
+        result.wait()
+        self.assertEqual(result.meters['out'].transferred, 6)
+        self.assertEqual(str(cat.meter('in', stream='stdin') < self.filename), 'hello\n')
+        with self.assertRaises(ValueError):
+            sh.race(cat, cat).meter('in', stream='stdin')
+
+    def test_stalls(self):
+        slow_reader = sh('sh', '-c', 'sleep 0.3; cat > /dev/null')
+        result = sh.start(seq('200000').meter('edge') | slow_reader)
+        result.wait()
+        self.assertGreater(result.meters['edge'].stalled, 0.1)
+        slow_writer = sh('sh', '-c', 'sleep 0.3; echo done')
+        result = sh.start(slow_writer.meter('edge') | cat, stdout=subprocess.DEVNULL)
+        result.wait()
+        self.assertGreater(result.meters['edge'].starved, 0.1)
+        self.assertLess(result.meters['edge'].stalled, 0.1)
+
+    def test_live(self):
+        writer = sh('sh', '-c', 'echo first; sleep 0.5; echo second')
+        result = sh.start(writer.meter('edge') | cat, stdout=subprocess.DEVNULL)
+        meter = result.meters['edge']
+        deadline = time.monotonic() + 5
+        while meter.transferred < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(meter.transferred, 6)
+        self.assertIsNone(meter.finished)
+        result.wait()
+        self.assertEqual(meter.transferred, 13)
+
+    def test_duplicate_names(self):
+        with self.assertRaises(ValueError):
+            str(echo.meter('x') | cat.meter('x'))
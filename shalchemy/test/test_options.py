@@ -0,0 +1,118 @@
+import os
+import resource
+import sys
+
+from shalchemy import sh, bin
+from shalchemy.bin import cat
+from shalchemy.runner import _internal_run
+from shalchemy.spawn import IOPRIO_SET_SYSCALLS, SpawnOptions
+from shalchemy.test.base import TestCase, random_string
+
+python = sh(sys.executable, '-c')
+
+# ioprio_get, one past ioprio_set everywhere
+IOPRIO_GET_SYSCALLS = {machine: number + 1 for machine, number in IOPRIO_SET_SYSCALLS.items()}
+
+
+class TestSchedulingOptions(TestCase):
+    def test_nice(self):
+        self.assertEqual(int(bin.nice.with_(nice=5)), 5)
+        # Inherited by pipes and substitutions
+        self.assertEqual(int((bin.nice | cat).with_(nice=3)), 3)
+        self.assertEqual(int(cat(bin.nice.read_sub()).with_(nice=4)), 4)
+        # The innermost setting wins
+        self.assertEqual(int(bin.nice.with_(nice=2).with_(nice=7)), 2)
+        self.assertEqual(int(bin.nice), 0)
+
+    def test_ionice(self):
+        number = IOPRIO_GET_SYSCALLS.get(os.uname().machine)
+        if number is None:
+            self.skipTest(f'ioprio_get syscall number unknown for {os.uname().machine}')
+        script = f'import ctypes; print(ctypes.CDLL(None).syscall({number}, 1, 0) >> 13)'
+        self.assertEqual(int(python([script]).with_(ionice='idle')), 3)
+        self.assertEqual(int(python([script]).with_(ionice=('best-effort', 7))), 2)
+        with self.assertRaises(ValueError):
+            bin.true.with_(ionice='fastest')
+
+    def test_cpu_affinity(self):
+        cpu = min(os.sched_getaffinity(0))
+        script = 'import os; print(*sorted(os.sched_getaffinity(0)))'
+        self.assertEqual(int(python([script]).with_(cpu_affinity=[cpu])), cpu)
+
+    def test_rlimits(self):
+        limits = sh('sh', '-c', 'ulimit -n; ulimit -t').with_(rlimit_nofile=100, rlimit_cpu=50)
+        self.assertEqual(str(limits).split(), ['100', '50'])
+        script = 'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])'
+        self.assertEqual(int(python([script]).with_(rlimit_as=1 << 32)), 1 << 32)
+
+    def test_applied_from_parent(self):
+        # Set on the child's pid, not by a preexec_fn in the forked child
+        self.assertNotIn('preexec_fn', SpawnOptions(nice=1, rlimits={'RLIMIT_NOFILE': 100}).popen_kwargs())
+        result = _internal_run(bin.sleep('10').with_(nice=3, rlimit_nofile=(100, 200)))
+        try:
+            pid = result.main.pid
+            self.assertEqual(os.getpriority(os.PRIO_PROCESS, pid), os.getpriority(os.PRIO_PROCESS, 0) + 3)
+            self.assertEqual(resource.prlimit(pid, resource.RLIMIT_NOFILE), (100, 200))
+            self.assertEqual(result.main.args, ['sleep', '10'])
+        finally:
+            result.kill()
+            result.wait()
+        with self.assertRaises(FileNotFoundError):
+            sh.run(sh('shalchemy-does-not-exist').with_(nice=1))
+
+    def test_threaded_stages(self):
+        self.assertEqual(int(sh.race(bin.nice).with_(nice=6)), 6)
+        self.assertEqual(int(bin.nice.xargs([]).with_(nice=6) | bin.wc('-l')), 0)
+
+
+class TestEnvironmentOptions(TestCase):
+    def test_env(self):
+        os.environ['SHALCHEMY_TEST_OUTER'] = 'outer'
+        try:
+            script = 'import os; print(os.environ.get("SHALCHEMY_TEST_A"), os.environ.get("SHALCHEMY_TEST_OUTER"))'
+            expr = python([script]).with_(env={'SHALCHEMY_TEST_A': 'a'})
+            self.assertEqual(str(expr).strip(), 'a outer')
+            unset = python([script]).with_(env={'SHALCHEMY_TEST_OUTER': None})
+            self.assertEqual(str(unset).strip(), 'None None')
+            # Inner overlays are laid on top of outer ones
+            nested = (python([script]) | cat).with_(env={'SHALCHEMY_TEST_A': 'b'}).with_(
+                env={'SHALCHEMY_TEST_A': 'c', 'SHALCHEMY_TEST_OUTER': 'changed'},
+            )
+            self.assertEqual(str(nested).strip(), 'b changed')
+            self.assertNotIn('SHALCHEMY_TEST_A', os.environ)
+        finally:
+            del os.environ['SHALCHEMY_TEST_OUTER']
+
+    def test_env_follows_os_environ(self):
+        expr = bin.printenv('SHALCHEMY_TEST_OUTER').with_(env={'SHALCHEMY_TEST_A': 'x'})
+        self.assertFalse(expr)
+        os.environ['SHALCHEMY_TEST_OUTER'] = 'y'
+        try:
+            self.assertEqual(str(expr).strip(), 'y')
+        finally:
+            del os.environ['SHALCHEMY_TEST_OUTER']
+
+    def test_cwd(self):
+        directory = os.path.join('garbage', random_string())
+        os.mkdir(directory)
+        try:
+            real = os.path.realpath(directory)
+            self.assertEqual(str(bin.pwd.with_(cwd=directory)).strip(), real)
+            sh.run((bin.echo('hi') > 'out.txt').with_(cwd=directory))
+            self.assertEqual(str((cat < 'out.txt').with_(cwd=directory)).strip(), 'hi')
+            self.assertEqual(str(bin.pwd.with_(cwd='.').with_(cwd=directory)).strip(), real)
+        finally:
+            os.remove(os.path.join(directory, 'out.txt'))
+            os.rmdir(directory)
+
+    def test_env_validation(self):
+        with self.assertRaises(ValueError):
+            bin.true.with_(env={'A=B': 'c'})
+        with self.assertRaises(TypeError):
+            bin.true.with_(env={'A': 1})
+
+    def test_xargs_budget(self):
+        from shalchemy.xargs import command_line_budget
+        from shalchemy.spawn import SpawnOptions
+        big = SpawnOptions(env={'SHALCHEMY_TEST_BIG': 'x' * 10000})
+        self.assertLess(command_line_budget(bin.echo, options=big), command_line_budget(bin.echo) - 9000)
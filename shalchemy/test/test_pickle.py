@@ -0,0 +1,52 @@
+import copy
+import pickle
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, git, sort
+from shalchemy.expressions import CommandExpression
+from shalchemy.test.base import TestCase
+
+
+def shout(keyword, value):
+    return [f'--{keyword.upper()}={value}']
+
+
+def word_count(expression):
+    return len(str(expression).split())
+
+
+class TestPickle(TestCase):
+    def round_trip(self, expression):
+        loaded = pickle.loads(pickle.dumps(expression))
+        self.assertEqual(repr(loaded), repr(expression))
+        self.assertEqual(repr(copy.deepcopy(expression)), repr(expression))
+        return loaded
+
+    def test_dunders_are_not_subcommands(self):
+        for name in ('__deepcopy__', '__copy__', '__getnewargs_ex__', '__setstate__'):
+            with self.assertRaises(AttributeError):
+                getattr(git, name)
+        for name in ('__getstate__', '__reduce_ex__'):
+            self.assertNotIsInstance(getattr(git, name), CommandExpression)
+        self.assertEqual(repr(git.log), '$(git log)')
+
+    def test_expressions(self):
+        self.round_trip(git.log(oneline=True))
+        self.round_trip(echo('a') | sort > 'out.txt')
+        self.round_trip((cat < 'in.txt') >= 'err.txt')
+        self.round_trip(echo.with_(nice=5, env={'A': '1'}, cwd='/tmp'))
+        self.round_trip(sh.race(echo('a'), echo('b'), hedge_delay=1.5))
+        self.round_trip(echo.xargs(['a', 'b'], max_procs=2))
+
+    def test_substitutions(self):
+        expression = cat(echo('left').read_sub(), echo('right').read_sub())
+        self.assertEqual(str(self.round_trip(expression)), 'left\nright\n')
+        self.round_trip(sh('tee', output=cat.write_sub(), _kwarg_render=shout))
+
+    def test_runs_after_round_trip(self):
+        expression = self.round_trip(echo('hello') | sh('tr a-z A-Z'))
+        self.assertEqual(str(expression), 'HELLO\n')
+
+    def test_process_map(self):
+        expressions = [echo(*['word'] * count) for count in range(1, 6)]
+        self.assertEqual(sh.process_map(word_count, expressions, max_workers=2), [1, 2, 3, 4, 5])
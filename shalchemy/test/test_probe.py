@@ -0,0 +1,43 @@
+import json
+import time
+
+from shalchemy import bin
+from shalchemy.bin import head, wc
+from shalchemy.test.base import TestCase
+
+probe = bin.shalchemyprobe
+
+
+class TestProbe(TestCase):
+    def test_produce(self):
+        self.assertEqual(str(probe.produce('--lines', '3', '--line-size', '4')), 'xxx\nxxx\nxxx\n')
+        self.assertEqual(int(probe.produce('--bytes', '100000') | wc('-c')), 100000)
+        self.assertEqual(int(probe.produce('--lines', '1000000') | head('-n', '2') | wc('-l')), 2)
+
+    def test_consume(self):
+        report = json.loads(str(probe.produce('--bytes', '300000') | probe.consume))
+        self.assertEqual(report['bytes'], 300000)
+        self.assertGreater(report['bytes_per_second'], 0)
+
+    def test_rate(self):
+        started = time.monotonic()
+        report = json.loads(str(probe.produce('--lines', '20', '--rate', '100') | probe.consume))
+        self.assertEqual(report['bytes'], 20 * 80)
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    def test_slowsink(self):
+        started = time.monotonic()
+        self.assertTrue(probe.produce('--bytes', '4000') | probe.slowsink('--chunk-size', '1000', '--delay', '0.05'))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_latency(self):
+        since = time.time()
+        report = json.loads(str(bin.sleep('0.2') | probe.latency('--since', str(since))))
+        self.assertIsNone(report['first_byte_seconds'])
+        report = json.loads(str(probe.produce('--bytes', '10') | probe.latency('--since', str(since))))
+        self.assertEqual(report['bytes'], 10)
+        self.assertGreater(report['first_byte_seconds'], 0)
+
+    def test_errcat(self):
+        self.write_file('some text')
+        self.assertEqual(str(probe.errcat('--both') < self.filename), 'some text')
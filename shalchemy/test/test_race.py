@@ -0,0 +1,47 @@
+import os
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, false
+from shalchemy.test.base import TestCase, random_filename
+
+
+class TestRace(TestCase):
+    def test_first_success_wins(self):
+        start = time.monotonic()
+        result = str(sh.race(
+            sh('sh', '-c', 'sleep 10; echo slow'),
+            sh('sh', '-c', 'sleep 0.1; echo fast'),
+        ))
+        self.assertEqual(result, 'fast\n')
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_failures_are_skipped(self):
+        self.assertEqual(str(sh.race(false, sh('shalchemy_does_not_exist'), echo('third'))), 'third\n')
+        self.assertFalse(sh.race(false, false))
+
+    def test_hedge_delay(self):
+        # The second one only starts if the first hasn't won within the delay
+        result = str(sh.race(echo('first'), echo('second'), hedge_delay=5))
+        self.assertEqual(result, 'first\n')
+        result = str(sh.race(sh('sh -c "sleep 10; echo first"'), echo('second'), hedge_delay=0.1))
+        self.assertEqual(result, 'second\n')
+
+    def test_losers_are_killed(self):
+        marker = os.path.abspath(random_filename())
+        loser = sh('sh', '-c', f'sleep 1; touch {marker}')
+        self.assertEqual(str(sh.race(loser, echo('winner'))), 'winner\n')
+        time.sleep(1.5)
+        self.assertFalse(os.path.exists(marker))
+
+    def test_composes(self):
+        self.assertEqual(str(sh.race(false, echo('apple')) | sh('tr a-z A-Z')), 'APPLE\n')
+        self.assertEqual(str(sh.race(sh('sleep 10'), cat(echo('sub').read_sub()))), 'sub\n')
+        sh.run(sh.race(false, echo('apple')) > self.filename)
+        self.assertEqual(self.read_file(), 'apple\n')
+
+    def test_stdin_is_rejected(self):
+        with self.assertRaises(ValueError):
+            echo('x') | sh.race(cat, cat)
+        with self.assertRaises(ValueError):
+            sh.race(cat, cat).with_(nice=1) < self.filename
@@ -0,0 +1,84 @@
+import io
+import threading
+import time
+
+from shalchemy import sh, bin
+from shalchemy.bin import cat, tr
+from shalchemy.reactor import reactor
+from shalchemy.runner import _internal_run
+from shalchemy.test.base import TestCase
+
+
+class TestReactor(TestCase):
+    def test_iterable_source(self):
+        lines = (f'{index}\n' for index in range(1000))
+        self.assertEqual(int((cat < lines) | bin.wc('-l')), 1000)
+        self.assertEqual(str(cat < [b'a', 'b', b'', 'c']), 'abc')
+
+    def test_large_streams(self):
+        data = 'x' * (5 * 1024 * 1024)
+        out = io.StringIO()
+        sh.run((tr('x', 'y') < io.StringIO(data)) > out)
+        self.assertEqual(out.getvalue(), 'y' * len(data))
+        binary = io.BytesIO()
+        sh.run((cat < io.BytesIO(b'\0\1' * 100000)) > binary)
+        self.assertEqual(binary.getvalue(), b'\0\1' * 100000)
+
+    def test_split_characters(self):
+        # A multi-byte character split across reads must still decode
+        out = io.StringIO()
+        text = 'é' * 100000
+        sh.run((cat < io.StringIO(text)) > out)
+        self.assertEqual(out.getvalue(), text)
+
+    def test_many_concurrent_runs(self):
+        sh.run((cat < io.StringIO('warm up')) > io.StringIO())
+        threads = threading.active_count()
+        sinks = [io.StringIO() for _ in range(100)]
+        results = [_internal_run((cat < io.StringIO(str(index))) > sinks[index]) for index in range(100)]
+        # One reactor thread serves all of them
+        self.assertLessEqual(threading.active_count(), threads)
+        for result in results:
+            result.wait()
+        self.assertEqual([sink.getvalue() for sink in sinks], [str(index) for index in range(100)])
+        self.assertEqual(reactor().active, 0)
+
+    def test_reader_exits_early(self):
+        endless = iter(lambda: b'y\n' * 1000, None)
+        self.assertEqual(str((cat < endless) | bin.head('-n', '1')), 'y\n')
+
+    def test_slow_source_holds_back_nothing_else(self):
+        def slow():
+            time.sleep(1)
+            yield 'late\n'
+        result = _internal_run((cat < slow()) > io.StringIO())
+        try:
+            started = time.monotonic()
+            out = io.StringIO()
+            sh.run(bin.echo('x'), stdout=out)
+            self.assertEqual(out.getvalue(), 'x\n')
+            self.assertLess(time.monotonic() - started, 0.5)
+        finally:
+            result.wait()
+
+    def test_sink_runs_shalchemy(self):
+        # Sinks run off the reactor thread, so they may use it themselves
+        seen = []
+
+        class Sink(io.RawIOBase):
+            def writable(self):
+                return True
+
+            def write(self, data):
+                seen.append(str(cat < io.BytesIO(bytes(data))))
+                return len(data)
+
+        sh.run((cat < iter([b'a', b'b'])) > Sink())
+        self.assertEqual(''.join(seen), 'ab')
+
+    def test_source_error(self):
+        def broken():
+            yield 'a\n'
+            raise KeyError('source')
+        with self.assertRaises(KeyError):
+            sh.run((cat < broken()) > io.StringIO())
@@ -0,0 +1,99 @@
+import contextlib
+import io
+import os
+import subprocess
+import threading
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, sleep
+from shalchemy.reaper import as_completed, exit_order, notifier
+from shalchemy.runner import _internal_run
+from shalchemy.test.base import TestCase
+
+
+class TestReaper(TestCase):
+    def test_exit_order(self):
+        slow = _internal_run(sleep('0.3'))
+        fast = _internal_run(sleep('0.05'))
+        order = list(exit_order([slow.main, fast.main]))
+        self.assertEqual(order, [fast.main, slow.main])
+        slow.wait()
+        fast.wait()
+
+    def test_as_completed(self):
+        results = [_internal_run(sleep(delay) | cat) for delay in ('0.3', '0.2', '0.01')]
+        completed = list(as_completed(results))
+        self.assertEqual(completed, list(reversed(results)))
+        for result in results:
+            result.wait()
+
+    def test_many_pipelines_one_thread(self):
+        _internal_run(sleep('0')).wait()
+        threads = threading.active_count()
+        started = time.monotonic()
+        results = [_internal_run(sleep('0.2') | cat) for _ in range(200)]
+        self.assertLessEqual(threading.active_count(), threads)
+        for result in as_completed(results, timeout=30):
+            result.wait()
+            self.assertEqual(result.main.returncode, 0)
+        self.assertLess(time.monotonic() - started, 20)
+        self.assertEqual(notifier().watching, 0)
+
+    def test_threaded_stages(self):
+        result = _internal_run(sh.race(sleep('0.1')))
+        self.assertEqual(list(exit_order([result.main], timeout=5)), [result.main])
+        result.wait()
+        self.assertIsNotNone(result.stages[0].duration)
+
+    def test_timeout(self):
+        result = _internal_run(sleep('10'))
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(exit_order([result.main], timeout=0.05))
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(as_completed([result], timeout=0.05))
+        result.kill()
+        result.wait()
+
+    def test_callback_error(self):
+        errors = io.StringIO()
+        result = _internal_run(sleep('0'))
+
+        def broken(process):
+            raise ValueError('broken callback')
+        with contextlib.redirect_stderr(errors):
+            notifier().watch(result.main, broken)
+            deadline = time.monotonic() + 5
+            while 'broken callback' not in errors.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertIn('ValueError: broken callback', errors.getvalue())
+        result.wait()
+
+        class BrokenReservation:
+            def __init__(self, reservation):
+                self.reservation = reservation
+
+            def release(self):
+                self.reservation.release()
+                raise RuntimeError('bookkeeping failed')
+
+            def release_all(self):
+                self.reservation.release_all()
+        result = _internal_run(sleep('0.2'))
+        result.reservation = BrokenReservation(result.reservation)
+        with self.assertRaisesRegex(RuntimeError, 'bookkeeping failed'):
+            result.wait()
+
+    def test_watched_once(self):
+        watcher = notifier()
+        watched = []
+
+        def watch(process, callback, watch=watcher.watch):
+            watched.append(process)
+            watch(process, callback)
+        watcher.watch = watch
+        try:
+            _internal_run(echo('a') | cat > os.devnull).wait()
+        finally:
+            del watcher.watch
+        self.assertEqual(len(watched), 2)
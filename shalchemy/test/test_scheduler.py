@@ -0,0 +1,120 @@
+import threading
+import time
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, seq, sleep
+from shalchemy.scheduler import Scheduler
+from shalchemy.test.base import TestCase
+
+
+def acquire_in_thread(scheduler: Scheduler, count: int, priority, order: list):
+    def target():
+        reservation = scheduler.acquire(count, priority)
+        order.append(priority)
+        reservation.release_all()
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def wait_for_waiters(scheduler: Scheduler, count: int):
+    deadline = time.monotonic() + 5
+    while scheduler.waiting < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class TestScheduler(TestCase):
+    def tearDown(self):
+        super().tearDown()
+        sh.scheduler.configure(None)
+
+    def test_count_processes(self):
+        self.assertEqual(echo._count_processes(), 1)
+        self.assertEqual((echo | cat | cat)._count_processes(), 3)
+        self.assertEqual(cat(echo.read_sub(), (echo | cat).read_sub())._count_processes(), 4)
+        self.assertEqual(((echo > 'x') | cat).with_(nice=1)._count_processes(), 2)
+        self.assertEqual(sh.race(echo, echo | cat)._count_processes(), 3)
+        self.assertEqual(echo.xargs([], max_procs=4)._count_processes(), 4)
+
+    def test_priority_and_fifo(self):
+        scheduler = Scheduler(max_processes=1)
+        held = scheduler.acquire(1)
+        order: list = []
+        threads = []
+        for priority in ('low', 'normal', 'high', 'normal'):
+            threads.append(acquire_in_thread(scheduler, 1, priority, order))
+            wait_for_waiters(scheduler, len(threads))
+        held.release_all()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['high', 'normal', 'normal', 'low'])
+        self.assertEqual(scheduler.running, 0)
+        stats = scheduler.stats()
+        self.assertEqual(stats['normal'].granted, 3)
+        self.assertGreater(stats['low'].max_wait, 0)
+
+    def test_head_of_line(self):
+        # A small request may not overtake a bigger one that arrived first
+        scheduler = Scheduler(max_processes=2)
+        held = scheduler.acquire(1)
+        order: list = []
+        big = acquire_in_thread(scheduler, 2, 'normal', order)
+        wait_for_waiters(scheduler, 1)
+        small = acquire_in_thread(scheduler, 1, 'low', order)
+        wait_for_waiters(scheduler, 2)
+        self.assertEqual(scheduler.running, 1)
+        held.release_all()
+        big.join()
+        small.join()
+        self.assertEqual(order, ['normal', 'low'])
+
+    def test_oversized_request(self):
+        scheduler = Scheduler(max_processes=2)
+        reservation = scheduler.acquire(5)
+        self.assertEqual(reservation.count, 2)
+        reservation.release_all()
+        self.assertEqual(scheduler.running, 0)
+
+    def test_limit_concurrent_runs(self):
+        sh.scheduler.configure(2)
+        peak = []
+        returncodes = []
+
+        def run():
+            returncodes.append(sh.run(sleep('0.1') | cat))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            peak.append(sh.scheduler.running)
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(returncodes, [0, 0, 0, 0])
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(sh.scheduler.running, 0)
+        self.assertEqual(sh.run(echo('hi'), priority='high'), 0)
+
+    def test_release_on_error(self):
+        sh.scheduler.configure(2)
+        with self.assertRaises(OSError):
+            sh.run(echo | sh('shalchemy-does-not-exist'))
+        self.assertEqual(sh.scheduler.running, 0)
+
+    def test_run_while_streaming(self):
+        # seq has exited and given its slot back while its output is still
+        # being read, so runs started from the loop get one
+        sh.scheduler.configure(1)
+        seen = []
+
+        def stream():
+            for line in seq('3').iter_lines():
+                seen.append(str(echo(line)))
+
+        thread = threading.Thread(target=stream, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(seen, ['1\n', '2\n', '3\n'])
+        self.assertEqual(sh.scheduler.running, 0)
@@ -0,0 +1,78 @@
+import os
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, grep, head, md5sum, wc
+from shalchemy.shard import split_ranges
+from shalchemy.test.base import TestCase
+
+
+def total(outputs):
+    return f'{sum(int(output) for output in outputs)}\n'
+
+
+class TestShard(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rewrite(''.join(f'line {index}\n' for index in range(100000)))
+
+    def rewrite(self, content):
+        self.write_file(content)
+        self.fileobj.truncate()
+
+    def test_ranges(self):
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            ranges = split_ranges(fd, 7)
+            self.assertEqual(len(ranges), 7)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], os.fstat(fd).st_size)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(os.pread(fd, 1, start - 1), b'\n')
+        finally:
+            os.close(fd)
+
+    def test_long_lines(self):
+        self.rewrite('x' * 1000 + '\nshort\n')
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            self.assertEqual(split_ranges(fd, 8), [(0, 1001), (1001, 1007)])
+        finally:
+            os.close(fd)
+        self.assertEqual(str(sh.shard(cat, self.filename, jobs=8)), self.read_file())
+
+    def test_concatenated_in_order(self):
+        sharded = sh.shard(cat, self.filename, jobs=4)
+        self.assertEqual(repr(sharded), f'$(shard(cat, {self.filename}, jobs=4))')
+        self.assertEqual(str(sharded | md5sum), str(md5sum < self.filename))
+        counts = str(sh.shard(grep('-c', '7'), self.filename, jobs=3)).split()
+        self.assertEqual(len(counts), 3)
+        self.assertEqual(sum(map(int, counts)), int(grep('-c', '7') < self.filename))
+
+    def test_reducer(self):
+        self.assertEqual(str(sh.shard(wc('-l'), self.filename, jobs=4, reducer=total)), '100000\n')
+        expected = f'{int(grep("-c", "7") < self.filename)}\n'
+        self.assertEqual(str(sh.shard(grep('-c', '7'), self.filename, jobs=5, reducer=total)), expected)
+
+    def test_empty_file(self):
+        self.rewrite('')
+        self.assertEqual(str(sh.shard(wc('-l'), self.filename, jobs=4)).strip(), '0')
+
+    def test_composes(self):
+        self.assertEqual(str(sh.shard(cat, self.filename, jobs=4) | head('-n', '2')), 'line 0\nline 1\n')
+        with self.assertRaises(FileNotFoundError):
+            sh.run(sh.shard(cat, 'shalchemy-does-not-exist.txt'))
+        with self.assertRaises(ValueError):
+            echo('a') | sh.shard(cat, self.filename)
+        with self.assertRaises(ValueError):
+            sh.shard(sh.shard(cat, self.filename), self.filename)
+
+    def test_failure(self):
+        self.assertEqual(sh.run(sh.shard(grep('-e', 'nothing matches'), self.filename, jobs=2)), 1)
+        self.assertEqual(str(sh.shard(grep('-c', 'nope'), self.filename, jobs=2, reducer=total)), '0\n')
+        # Only the first half matches, the second copy exits 1
+        self.rewrite('match\n' + 'other\n' * 7)
+        self.assertEqual(str(sh.shard(grep('-c', 'match'), self.filename, jobs=2)), '1\n0\n')
+        reduced = sh.shard(grep('-c', 'match'), self.filename, jobs=2, reducer=total)
+        self.assertEqual(str(reduced), '1\n')
+        self.assertEqual(sh.run(reduced > os.devnull), 1)
@@ -0,0 +1,53 @@
+import json
+
+from shalchemy import bin, streaming
+from shalchemy.bin import cat, printf
+from shalchemy.test.base import TestCase
+
+
+class TestStreaming(TestCase):
+    def test_iter_lines(self):
+        result = list((cat('./fixtures/shuffled_words.txt') | bin.sort).iter_lines())
+        self.assertEqual(result, list(cat('./fixtures/shuffled_words.txt') | bin.sort))
+
+    def test_iter_records_nul(self):
+        result = sorted(bin.find('./fixtures', '-name', '*_words.txt', '-print0').iter_records('\0'))
+        self.assertEqual(result, ['./fixtures/shuffled_words.txt', './fixtures/sorted_words.txt'])
+
+    def test_iter_records_bytes(self):
+        result = list(printf('a::b::c::').iter_records(b'::', encoding=None))
+        self.assertEqual(result, [b'a', b'b', b'c'])
+        result = list(printf('a::b::c').iter_records(b'::', encoding=None, keepends=True))
+        self.assertEqual(result, [b'a::', b'b::', b'c'])
+
+    def test_iter_records_small_chunks(self):
+        # Separators and multibyte characters split across chunk boundaries
+        result = list(streaming.split_records(iter(['a:', ':b:', ':', 'c']), '::'))
+        self.assertEqual(result, ['a', 'b', 'c'])
+        chunks = streaming.decode_chunks(iter([b'\xc3', b'\xa9\n\xc3', b'\xa9']))
+        self.assertEqual(list(streaming.split_records(chunks, '\n')), ['é', 'é'])
+
+    def test_iter_json_lines(self):
+        records = [{'fruit': 'apple', 'count': 1}, {'fruit': 'banana', 'count': 2}]
+        text = ''.join(json.dumps(r) + '\n' for r in records) + '\n'
+        self.assertEqual(list(printf('%s', text).iter_json_lines()), records)
+
+    def test_iter_csv(self):
+        text = 'name,note\napple,"red\nor green"\nbanana,yellow\n'
+        self.assertEqual(list(printf('%s', text).iter_csv()), [
+            ['name', 'note'],
+            ['apple', 'red\nor green'],
+            ['banana', 'yellow'],
+        ])
+        self.assertEqual(list(printf('%s', text).iter_csv(dicts=True))[1], {'name': 'banana', 'note': 'yellow'})
+        self.assertEqual(list(printf('%s', 'a\tb\nc\td\n').iter_tsv()), [['a', 'b'], ['c', 'd']])
+
+    def test_early_stop(self):
+        for line in bin.yes('apple').iter_lines():
+            self.assertEqual(line, 'apple')
+            break
+        # Every stage of a pipe must see the consumer go away
+        for line in (bin.yes('apple') | bin.cat | bin.cat).iter_lines():
+            self.assertEqual(line, 'apple')
+            break
+        self.assertEqual(str(bin.yes('apple') | bin.head('-n', '1')), 'apple\n')
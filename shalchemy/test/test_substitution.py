@@ -1,3 +1,6 @@
+import os
+import time
+
 from shalchemy import sh, bin
 from shalchemy.bin import cat, diff, echo
 from shalchemy.test.base import TestCase, random_filename
@@ -57,3 +60,47 @@ class TestSubstitution(TestCase):
             )
         )
         self.assertEqual(result, 'Apple\nBanana\nCarrot\n')
+
+    def test_read_sub_large(self):
+        # The substituted command must be able to write more than one pipe
+        # buffer while the reader is still running
+        self.assertTrue(diff(
+            bin.seq('1', '200000').read_sub(),
+            (bin.seq('200000') | bin.sort('-n')).read_sub(),
+        ) > '/dev/null')
+
+    def test_stages(self):
+        from shalchemy.runner import _internal_run
+        result = _internal_run(diff(echo('a').read_sub(), echo('a').read_sub()) | cat)
+        result.wait()
+        self.assertEqual(
+            [(stage.kind, stage.label) for stage in result.stages],
+            [
+                ('read_sub', 'echo a'),
+                ('read_sub', 'echo a'),
+                ('command', 'diff <(echo a) <(echo a)'),
+                ('command', 'cat'),
+            ],
+        )
+        self.assertTrue(all(stage.duration is not None for stage in result.stages))
+
+    def test_stage_durations(self):
+        from shalchemy.runner import _internal_run
+        result = _internal_run(sh('sh', '-c', 'sleep 0.3') | sh('sh', '-c', 'sleep 0.05'))
+        result.wait()
+        slow, fast = [stage.duration for stage in result.stages]
+        self.assertGreaterEqual(slow, 0.3)
+        self.assertGreaterEqual(fast, 0.05)
+        self.assertLess(fast, 0.25)
+
+    def test_failed_spawn_closes_pipes(self):
+        before = len(os.listdir('/proc/self/fd'))
+        for _ in range(5):
+            with self.assertRaises(OSError):
+                sh.run(sh('shalchemy-does-not-exist')(echo('x').read_sub()))
+        # Background threads left over from earlier tests may briefly hold
+        # a descriptor of their own
+        deadline = time.monotonic() + 2
+        while len(os.listdir('/proc/self/fd')) != before and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), before)
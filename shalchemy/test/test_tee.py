@@ -0,0 +1,64 @@
+import hashlib
+import io
+import os
+
+from shalchemy import sh
+from shalchemy.bin import cat, echo, head, seq, wc
+from shalchemy.tee import tee
+from shalchemy.test.base import TestCase, random_filename
+
+NUMBERS = ''.join(f'{number}\n' for number in range(1, 200001))
+
+
+class TestTee(TestCase):
+    def test_tee_syscall(self):
+        self.assertIsNotNone(tee())
+
+    def test_sinks(self):
+        other = os.path.abspath(random_filename())
+        text = io.StringIO()
+        raw = io.BytesIO()
+        digest = hashlib.sha256()
+        chunks = []
+        with open(other, 'wb') as file:
+            output = str(seq('200000') | sh.tee(self.filename, file, text, raw, digest, chunks.append))
+        self.assertEqual(output, NUMBERS)
+        self.assertEqual(self.read_file(), NUMBERS)
+        with open(other) as file:
+            self.assertEqual(file.read(), NUMBERS)
+        os.remove(other)
+        self.assertEqual(text.getvalue(), NUMBERS)
+        self.assertEqual(raw.getvalue(), NUMBERS.encode())
+        self.assertEqual(digest.hexdigest(), hashlib.sha256(NUMBERS.encode()).hexdigest())
+        self.assertEqual(b''.join(chunks), NUMBERS.encode())
+
+    def test_expression_sinks(self):
+        # They share the tee's stdout, like >(...) in bash
+        counted = str((seq('200000') | sh.tee(wc('-l') > self.filename, cat > os.devnull)) | wc('-l'))
+        self.assertEqual(counted.strip(), '200000')
+        self.assertEqual(self.read_file().strip(), '200000')
+        self.assertEqual(sorted(str(echo('hi') | sh.tee(cat)).split()), ['hi', 'hi'])
+
+    def test_pipe_sinks(self):
+        # Every fd sink is a pipe, so everything goes through tee(2) and splice
+        slow = sh('sh', '-c', 'sleep 0.2; cat') > self.filename
+        self.assertEqual(str(seq('200000') | sh.tee(slow, head('-n1') > os.devnull) | cat), NUMBERS)
+        self.assertEqual(self.read_file(), NUMBERS)
+
+    def test_from_file(self):
+        with open(self.filename, 'w') as file:
+            file.write(NUMBERS)
+        raw = io.BytesIO()
+        self.assertEqual(str(sh.tee(raw) < self.filename), NUMBERS)
+        self.assertEqual(raw.getvalue(), NUMBERS.encode())
+
+    def test_append(self):
+        sh.run(echo('one') | sh.tee(self.filename) > os.devnull)
+        sh.run(echo('two') | sh.tee(self.filename, append=True) > os.devnull)
+        self.assertEqual(self.read_file(), 'one\ntwo\n')
+
+    def test_invalid(self):
+        with self.assertRaises(TypeError):
+            sh.tee(3)
+        with self.assertRaises(ValueError):
+            sh.tee(sh.race(echo))
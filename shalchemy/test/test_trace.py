@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from shalchemy import sh, trace
+from shalchemy.bin import cat, diff, echo, seq, sleep, sort, tee
+from shalchemy.test.base import TestCase, random_filename
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def spans(events):
+    return [event for event in events if event['ph'] == 'X']
+
+
+def track_names(events):
+    return {event['tid']: event['args']['name'] for event in events if event['name'] == 'thread_name'}
+
+
+class TestTrace(TestCase):
+    def test_disabled(self):
+        self.assertIsNone(trace.active())
+        self.assertIs(trace.span('spawn', 'spawn'), trace.NO_SPAN)
+
+    def test_spans(self):
+        with sh.trace() as tracer:
+            self.assertIs(trace.active(), tracer)
+            str(seq('10') | sort('-n'))
+            str(diff(echo('a').read_sub(), echo('a').read_sub()))
+            sh.run(echo('x') | tee(cat.write_sub()) > os.devnull)
+            str(cat < io.StringIO('streamed\n'))
+        self.assertIsNone(trace.active())
+
+        events = tracer.to_json()['traceEvents']
+        names = track_names(events)
+        recorded = spans(events)
+        by_name = {}
+        for event in recorded:
+            by_name.setdefault(event['name'], []).append(event)
+        for name in ('schedule', 'start', 'spawn', 'wait', 'cleanup', 'fifo setup'):
+            self.assertIn(name, by_name)
+        self.assertEqual(by_name['spawn'][0]['args'], {'expression': 'seq 10'})
+        copies = [event for event in recorded if event['cat'] == 'copy']
+        self.assertEqual([event['args'] for event in copies], [{'bytes': 9}])
+
+        # One track for every spawned process, labelled with its expression
+        stages = [name for name in names.values() if name.startswith('pid ')]
+        self.assertEqual(len(stages), 9)
+        self.assertTrue(any(name.endswith(': sort -n') for name in stages))
+        read_sub = [event for event in recorded if event['cat'] == 'read_sub']
+        self.assertEqual([event['name'] for event in read_sub], ['echo a', 'echo a'])
+        for event in recorded:
+            self.assertGreaterEqual(event['dur'], 0)
+
+    def test_write(self):
+        filename = random_filename()
+        try:
+            with sh.trace(filename):
+                str(echo('a'))
+            with open(filename) as file:
+                data = json.load(file)
+            self.assertIn('spawn', [event['name'] for event in spans(data['traceEvents'])])
+        finally:
+            os.remove(filename)
+
+    def test_scope(self):
+        def labels(tracer):
+            return [event['name'] for event in spans(tracer.to_json()['traceEvents']) if event['cat'] == 'command']
+
+        with sh.trace() as outer:
+            with sh.trace() as inner:
+                str(echo('inner'))
+            str(echo('outer'))
+            # Runs from other threads belong to whatever traces them there
+            thread = threading.Thread(target=lambda: str(echo('elsewhere')))
+            thread.start()
+            thread.join()
+            # Threaded stages run in the context they were started from
+            str(sh.group(echo('grouped')))
+        self.assertEqual(labels(inner), ['echo inner'])
+        self.assertEqual(sorted(labels(outer)), ['echo grouped', 'echo outer', 'group(echo grouped)'])
+
+    def test_unwaited(self):
+        with sh.trace() as tracer:
+            run = sh.start(sleep('10'))
+            run.kill()
+        # Never waited on, but its stage is recorded as it exits
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            stages = [event for event in spans(tracer.to_json()['traceEvents']) if event['cat'] == 'command']
+            if stages:
+                break
+            time.sleep(0.01)
+        self.assertEqual([event['name'] for event in stages], ['sleep 10'])
+        self.assertEqual(stages[0]['args']['returncode'], -9)
+
+    def test_environment(self):
+        filename = os.path.abspath(random_filename())
+        try:
+            subprocess.run(
+                [sys.executable, '-c', 'from shalchemy.bin import echo; str(echo("a"))'],
+                env=dict(os.environ, PYTHONPATH=ROOT, SHALCHEMY_TRACE=filename),
+                check=True,
+            )
+            with open(filename) as file:
+                data = json.load(file)
+            labels = [event['name'] for event in spans(data['traceEvents'])]
+            self.assertIn('echo a', labels)
+        finally:
+            os.remove(filename)
@@ -0,0 +1,55 @@
+from shalchemy import sh, xargs
+from shalchemy.bin import echo, wc
+from shalchemy.test.base import TestCase
+
+
+class TestXargs(TestCase):
+    def test_many_arguments(self):
+        items = [f'file{index:06d}' for index in range(200000)]
+        output = str(echo.xargs(items, max_procs=4))
+        self.assertEqual(output.split(), items)
+        # One big argv would fail with E2BIG, so it must have been split
+        self.assertGreater(len(output.splitlines()), 1)
+
+    def test_max_args(self):
+        self.assertEqual(str(echo.xargs(range(7), max_args=3)), '0 1 2\n3 4 5\n6\n')
+
+    def test_ordered(self):
+        command = sh('sh', '-c', 'sleep "$1"; echo "$1"', 'sh')
+        self.assertEqual(str(command.xargs(['0.3', '0.1', '0'], max_args=1, max_procs=3)), '0.3\n0.1\n0\n')
+        unordered = str(command.xargs(['0.3', '0.1', '0'], max_args=1, max_procs=3, ordered=False))
+        self.assertEqual(unordered, '0\n0.1\n0.3\n')
+
+    def test_composes(self):
+        self.assertEqual(int(echo.xargs(range(1000), max_args=10, max_procs=4) | wc('-l')), 100)
+        sh.run(echo.xargs(['apple', 'banana'], max_args=1) > self.filename)
+        self.assertEqual(self.read_file(), 'apple\nbanana\n')
+        with self.assertRaises(ValueError):
+            echo('piped') | echo.xargs(['a', 'b'])
+
+    def test_failures(self):
+        self.assertFalse(sh('false').xargs([1, 2, 3]))
+        self.assertEqual(sh.run(sh('false').xargs([1])), 123)
+        self.assertEqual(sh.run(sh('shalchemy_does_not_exist').xargs([1])), 127)
+
+    def test_reruns(self):
+        listed = echo.xargs(['a', 'b'])
+        self.assertEqual((str(listed), str(listed)), ('a b\n', 'a b\n'))
+        generated = echo.xargs(item for item in ['a', 'b'])
+        self.assertEqual(str(generated), 'a b\n')
+        with self.assertRaises(RuntimeError):
+            str(generated)
+
+    def test_batching(self):
+        batches = list(xargs.batch_arguments(['aaaa', 'bb', 'cccccc', 'd'], budget=28))
+        self.assertEqual(batches, [['aaaa', 'bb'], ['cccccc', 'd']])
+
+    def test_streams_head_batch(self):
+        import time
+        slow = sh('sh', '-c', 'echo "$1"; sleep 0.5', 'sh')
+        started = time.monotonic()
+        lines = slow.xargs(['a', 'b'], max_args=1).iter_lines()
+        self.assertEqual(next(lines), 'a')
+        # The first batch's output arrives before it exits
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(list(lines), ['b'])
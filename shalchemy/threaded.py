@@ -0,0 +1,260 @@
+from typing import Any, Callable, List, Optional, cast, TYPE_CHECKING
+
+import contextvars
+import io
+import os
+import queue
+import subprocess
+import threading
+import time
+import traceback
+
+from .run_result import RunResult
+from .spawn import SpawnOptions
+
+if TYPE_CHECKING:
+    from .expressions import ShalchemyExpression
+
+
+def _dup_input(stream: Any) -> int:
+    if stream is None:
+        return os.dup(0)
+    if stream == subprocess.DEVNULL:
+        return os.open(os.devnull, os.O_RDONLY)
+    if isinstance(stream, int):
+        return os.dup(stream)
+    return os.dup(stream.fileno())
+
+
+def _dup_output(stream: Any, default: int) -> int:
+    if stream is None:
+        return os.dup(default)
+    if stream == subprocess.DEVNULL:
+        return os.open(os.devnull, os.O_WRONLY)
+    if isinstance(stream, int):
+        return os.dup(stream)
+    return os.dup(stream.fileno())
+
+
+class ThreadedProcess:
+    # Stands in for a subprocess.Popen when a stage of an expression runs as
+    # Python code in a thread. It owns duplicates of the descriptors it was
+    # given, so the caller may close its copies right away just like it would
+    # after spawning a real process. Closing ours when the target returns is
+    # what lets the next stage see EOF.
+    pid: Optional[int] = None
+    args: str
+    stdin: Optional[io.IOBase]
+    stdout: Optional[io.IOBase]
+    stderr: Optional[io.IOBase]
+    stdin_fd: int
+    stdout_fd: int
+    stderr_fd: int
+    returncode: Optional[int]
+    finished_at: Optional[float]
+    cancelled: threading.Event
+
+    def __init__(
+        self,
+        target: Callable[['ThreadedProcess'], Optional[int]],
+        stdin: Any,
+        stdout: Any,
+        stderr: Any,
+        name: str = '',
+    ):
+        self.args = name
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self._target = target
+        self._on_kill: List[Callable[[], None]] = []
+        self._on_done: List[Callable[['ThreadedProcess'], None]] = []
+        self._lock = threading.Lock()
+
+        if stdin == subprocess.PIPE:
+            self.stdin_fd, writer = os.pipe()
+            self.stdin = open(writer, 'wb')
+        else:
+            self.stdin_fd = _dup_input(stdin)
+        if stdout == subprocess.PIPE:
+            reader, self.stdout_fd = os.pipe()
+            self.stdout = open(reader, 'rb')
+        else:
+            self.stdout_fd = _dup_output(stdout, 1)
+        if stderr == subprocess.STDOUT:
+            self.stderr_fd = os.dup(self.stdout_fd)
+        elif stderr == subprocess.PIPE:
+            reader, self.stderr_fd = os.pipe()
+            self.stderr = open(reader, 'rb')
+        else:
+            self.stderr_fd = _dup_output(stderr, 2)
+
+        # The stage runs in the caller's context, so its sh.defaults and
+        # sh.trace() carry over to what it starts
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._main,), name=f'shalchemy: {name}', daemon=True)
+        self._thread.start()
+
+    def _main(self):
+        returncode = 1
+        try:
+            result = self._target(self)
+            returncode = 0 if result is None else result
+        except BrokenPipeError:
+            # Same as a real process being killed by SIGPIPE
+            returncode = 128 + 13
+        except BaseException:
+            try:
+                os.write(self.stderr_fd, traceback.format_exc().encode())
+            except OSError:
+                pass
+        finally:
+            for fd in (self.stdin_fd, self.stdout_fd, self.stderr_fd):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            self.finished_at = time.monotonic()
+            with self._lock:
+                self.returncode = returncode
+                callbacks = list(self._on_done)
+            for callback in callbacks:
+                callback(self)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.stdout_fd, view)
+            view = view[written:]
+
+    def on_kill(self, callback: Callable[[], None]):
+        with self._lock:
+            self._on_kill.append(callback)
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            callback()
+
+    def add_done_callback(self, callback: Callable[['ThreadedProcess'], None]):
+        with self._lock:
+            self._on_done.append(callback)
+            finished = self.returncode is not None
+        if finished:
+            callback(self)
+
+    def poll(self) -> Optional[int]:
+        # Set last thing before the thread ends, after our fds are closed
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise subprocess.TimeoutExpired(self.args, timeout or 0.0)
+        return cast(int, self.returncode)
+
+    def kill(self):
+        with self._lock:
+            self.cancelled.set()
+            callbacks = list(self._on_kill)
+        for callback in callbacks:
+            callback()
+
+    def terminate(self):
+        self.kill()
+
+    def send_signal(self, signal: int):
+        self.kill()
+
+    def __repr__(self):
+        return f'<ThreadedProcess: {self.args} returncode: {self.returncode}>'
+
+
+def run_in_thread(target: Callable[[], None], name: str = '') -> threading.Thread:
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(target,), name=f'shalchemy: {name}', daemon=True)
+    thread.start()
+    return thread
+
+
+def copy_file_to_fd(source: io.IOBase, fd: int):
+    source.flush()
+    in_fd = source.fileno()
+    offset = 0
+    size = os.fstat(in_fd).st_size
+    try:
+        while offset < size:
+            sent = os.sendfile(fd, in_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+        return
+    except OSError:
+        # sendfile can't write to every kind of descriptor on every platform
+        if offset:
+            raise
+    source.seek(0)
+    while True:
+        data = source.read(64 * 1024)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+class BackgroundRun:
+    # Runs an expression with a RunResult of its own and puts itself on the
+    # `finished` queue once everything it spawned has exited. Lets a
+    # ThreadedProcess juggle several child expressions at once.
+    expression: 'ShalchemyExpression'
+    context: RunResult
+    returncode: Optional[int]
+    tag: Any
+
+    def __init__(
+        self,
+        expression: 'ShalchemyExpression',
+        stdin: Any,
+        stdout: Any,
+        stderr: Any,
+        finished: 'queue.Queue[Any]',
+        new_session: bool = False,
+        tag: Any = None,
+        options: Optional[SpawnOptions] = None,
+    ):
+        from .types import ParenthesisKind
+        self.expression = expression
+        self.context = RunResult()
+        self.context.new_session = new_session
+        if options is not None:
+            self.context.options = options
+        self.returncode = None
+        self.tag = tag
+        self._finished = finished
+        try:
+            expression._run(
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                context=self.context,
+            )
+        except OSError:
+            # Usually the binary doesn't exist. Report it like sh would.
+            self.context.kill()
+            self.context.wait()
+            self.returncode = 127
+            finished.put(self)
+            return
+        run_in_thread(self._wait, name=expression._repr(ParenthesisKind.NEVER))
+
+    def _wait(self):
+        try:
+            self.context.wait()
+            self.returncode = self.context.main.returncode
+        finally:
+            self._finished.put(self)
+
+    def kill(self):
+        self.context.kill()
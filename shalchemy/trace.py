@@ -0,0 +1,202 @@
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+if TYPE_CHECKING:
+    from .expressions import ShalchemyExpression
+    from .run_result import Stage
+
+
+class Tracer:
+    # Records what runs do as Chrome trace events, which chrome://tracing
+    # and Perfetto can show as a timeline. Every spawned process and every
+    # Python thread that did something gets a track of its own.
+    # Timestamps are time.monotonic(), like Stage uses.
+    path: Optional[str]
+    events: List[Dict[str, Any]]
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.events = []
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._tracks: Dict[Hashable, int] = {}
+        self._stages: List[Tuple['Stage', int]] = []
+
+    def track(self, key: Hashable, name: str) -> int:
+        with self._lock:
+            if key in self._tracks:
+                return self._tracks[key]
+            tid = len(self._tracks) + 1
+            self._tracks[key] = tid
+        # Tracks are listed in the order they first showed up
+        self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+        self.events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'sort_index': tid}})
+        return tid
+
+    def thread_track(self) -> int:
+        thread = threading.current_thread()
+        # Idents get reused once a thread is gone, names tell them apart
+        return self.track(('thread', thread.ident, thread.name), f'python: {thread.name}')
+
+    def complete(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        tid: Optional[int] = None,
+        args: Optional[Dict[str, Any]] = None,
+    ):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': max(end - start, 0.0) * 1e6,
+            'pid': self.pid,
+            'tid': tid if tid is not None else self.thread_track(),
+        }
+        if args:
+            event['args'] = args
+        # list.append is atomic, no lock needed
+        self.events.append(event)
+
+    def stage(self, stage: 'Stage'):
+        # The span from spawning a stage to its exit, on its own track.
+        # Called as the stage exits, which can be before a substitution has
+        # marked its kind, so the event itself is made in to_json().
+        process = stage.process
+        if process.pid is not None:
+            name = f'pid {process.pid}: {stage.label}'
+        else:
+            name = f'thread: {stage.label}'
+        # Every stage is recorded once, so it always gets a new track. An
+        # id() could be a stage from earlier that has since been freed.
+        tid = self.track(object(), name)
+        self._stages.append((stage, tid))
+
+    def to_json(self) -> Dict[str, Any]:
+        events = list(self.events)
+        for stage, tid in list(self._stages):
+            events.append({
+                'name': stage.label,
+                'cat': stage.kind,
+                'ph': 'X',
+                'ts': stage.started * 1e6,
+                'dur': max((stage.finished or time.monotonic()) - stage.started, 0.0) * 1e6,
+                'pid': self.pid,
+                'tid': tid,
+                'args': {'kind': stage.kind, 'returncode': stage.process.returncode},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: Optional[str] = None):
+        import json
+        path = path or self.path
+        if path is None:
+            raise ValueError('No path to write the trace to')
+        with open(path, 'w') as file:
+            json.dump(self.to_json(), file)
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: Optional[Dict[str, Any]]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.category, self.start, time.monotonic(), args=self.args)
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+# Set by sh.trace() for the runs started inside it. Like sh.defaults, it
+# follows the context, so other threads' runs stay out of the trace.
+_tracer: 'contextvars.ContextVar[Optional[Tracer]]' = contextvars.ContextVar('shalchemy_tracer', default=None)
+# Set by SHALCHEMY_TRACE for everything no sh.trace() block covers
+_process_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def active() -> Optional[Tracer]:
+    tracer = _tracer.get()
+    return tracer if tracer is not None else _process_tracer
+
+
+def span(name: str, category: str, expression: Optional['ShalchemyExpression'] = None, **args: Any) -> Any:
+    # Times a with block on the current thread's track. Costs a context
+    # variable lookup when nothing is being traced.
+    tracer = active()
+    if tracer is None:
+        return NO_SPAN
+    if expression is not None:
+        from .types import ParenthesisKind
+        args['expression'] = expression._repr(ParenthesisKind.NEVER)
+    return Span(tracer, name, category, args)
+
+
+@contextlib.contextmanager
+def scoped(path: Optional[str] = None) -> Iterator[Tracer]:
+    # Traces the runs started in the current context until the block ends.
+    # Blocks nest, and the innermost one gets the runs.
+    tracer = Tracer(path)
+    token = _tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _tracer.reset(token)
+        if path is not None:
+            tracer.write()
+
+
+def start(path: Optional[str] = None) -> Tracer:
+    # Traces runs from every thread, outside of any sh.trace() block
+    global _process_tracer
+    with _tracer_lock:
+        if _process_tracer is not None:
+            raise RuntimeError('A trace is already being recorded')
+        _process_tracer = Tracer(path)
+        return _process_tracer
+
+
+def stop() -> Optional[Tracer]:
+    # Stops recording and writes the trace if it was given a path
+    global _process_tracer
+    with _tracer_lock:
+        tracer, _process_tracer = _process_tracer, None
+    if tracer is not None and tracer.path is not None:
+        tracer.write()
+    return tracer
+
+
+def start_from_environment():
+    # SHALCHEMY_TRACE=path traces the whole program and writes it at exit
+    path = os.environ.get('SHALCHEMY_TRACE')
+    if not path or _process_tracer is not None:
+        return
+    import atexit
+    start(path)
+    atexit.register(stop)
@@ -9,6 +9,7 @@ if TYPE_CHECKING:
         WriteSubstitute,
     )
     from .arguments import UncompiledArgument
+    from .globbing import GlobArgument
 
 
 PublicArgument = Union[
@@ -17,6 +18,7 @@ PublicArgument = Union[
     float,
     'ReadSubstitute',
     'WriteSubstitute',
+    'GlobArgument',
 ]
 
 PublicKeywordArgument = Union[
@@ -28,7 +30,7 @@ PublicKeywordArgument = Union[
     'WriteSubstitute',
 ]
 
-InternalArgument = Union[str, 'UncompiledArgument']
+InternalArgument = Union[str, 'UncompiledArgument', 'GlobArgument']
 
 ShalchemyFile = Union[
     str,
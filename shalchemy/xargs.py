@@ -0,0 +1,251 @@
+from tempfile import TemporaryFile
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, TYPE_CHECKING
+
+import os
+import queue
+import subprocess
+
+from .expressions import CommandExpression, ShalchemyExpression
+from .run_result import RunResult
+from .spawn import DEFAULT_OPTIONS, SpawnOptions
+from .threaded import BackgroundRun, ThreadedProcess, copy_file_to_fd
+from .types import ParenthesisKind, ShalchemyOutputStream
+
+if TYPE_CHECKING:
+    from .types import PublicArgument
+
+
+# POSIX asks xargs to leave this much room for the command to set variables
+ARG_MAX_HEADROOM = 2048
+POINTER_SIZE = 8
+
+
+def arg_max() -> int:
+    try:
+        value = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError):
+        value = -1
+    return value if value > 0 else 128 * 1024
+
+
+def argv_size(arguments: Iterable[Any]) -> int:
+    # execve copies every string plus its NUL terminator and a pointer to it
+    return sum(len(os.fsencode(str(argument))) + 1 + POINTER_SIZE for argument in arguments)
+
+
+def environment_size(environ: Optional[Mapping[Any, Any]] = None) -> int:
+    if environ is None:
+        environ = os.environb
+    return sum(
+        len(os.fsencode(key)) + len(os.fsencode(value)) + 2 + POINTER_SIZE
+        for key, value in environ.items()
+    )
+
+
+def command_line_budget(
+    command: CommandExpression,
+    max_chars: Optional[int] = None,
+    options: SpawnOptions = DEFAULT_OPTIONS,
+) -> int:
+    base = argv_size(arg if isinstance(arg, str) else arg._repr() for arg in command._args)
+    # Batches are spawned with the environment `with_(env=...)` asked for
+    budget = arg_max() - environment_size(options.environment()) - base - ARG_MAX_HEADROOM
+    if max_chars is not None:
+        budget = min(budget, max_chars)
+    if budget <= 0:
+        raise ValueError('The environment and command leave no room for arguments', command)
+    return budget
+
+
+def batch_arguments(
+    items: Iterable['PublicArgument'],
+    budget: int,
+    max_args: Optional[int] = None,
+) -> Iterator[List[str]]:
+    batch: List[str] = []
+    size = 0
+    for item in items:
+        argument = str(item)
+        needed = len(os.fsencode(argument)) + 1 + POINTER_SIZE
+        full = size + needed > budget or (max_args is not None and len(batch) >= max_args)
+        if batch and full:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(argument)
+        size += needed
+    if batch:
+        yield batch
+
+
+class Batch(BackgroundRun):
+    # With ordered output, a batch started before its turn spools to a
+    # temporary file. The batch whose turn it is writes straight through.
+    output: Optional[Any]
+
+    def __init__(
+        self,
+        expression: CommandExpression,
+        index: int,
+        spool: bool,
+        process: ThreadedProcess,
+        finished: 'queue.Queue[Optional[Batch]]',
+        options: SpawnOptions,
+    ):
+        self.output = TemporaryFile() if spool else None
+        super().__init__(
+            expression,
+            stdin=subprocess.DEVNULL,
+            stdout=self.output if self.output is not None else process.stdout_fd,
+            stderr=process.stderr_fd,
+            finished=finished,
+            tag=index,
+            options=options,
+        )
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+
+
+class XargsExpression(ShalchemyExpression):
+    # Arguments come from `items`, so every batch gets /dev/null as stdin
+    __slots__ = ('command', 'items', 'max_args', 'max_procs', 'ordered', 'max_chars', 'used')
+    _reads_stdin = False
+
+    command: CommandExpression
+    items: Iterable['PublicArgument']
+    max_args: Optional[int]
+    max_procs: int
+    ordered: bool
+    max_chars: Optional[int]
+    # Iterators, such as another expression's iter_lines(), are consumed as
+    # the batches run rather than up front, so they only last for one run
+    used: bool
+
+    def __init__(
+        self,
+        command: CommandExpression,
+        items: Iterable['PublicArgument'],
+        max_args: Optional[int] = None,
+        max_procs: int = 1,
+        ordered: bool = True,
+        max_chars: Optional[int] = None,
+    ):
+        if max_procs < 1:
+            raise ValueError('max_procs must be at least 1', max_procs)
+        if max_args is not None and max_args < 1:
+            raise ValueError('max_args must be at least 1', max_args)
+        self.command = command
+        self.items = items
+        self.max_args = max_args
+        self.max_procs = max_procs
+        self.ordered = ordered
+        self.max_chars = max_chars
+        self.used = False
+
+    def batches(self, options: SpawnOptions = DEFAULT_OPTIONS) -> Iterator[CommandExpression]:
+        from .globbing import GlobArgument
+        budget = command_line_budget(self.command, self.max_chars, options)
+        renderer = getattr(self.command, '_kwarg_render')
+        items = self.items
+        if isinstance(items, GlobArgument):
+            # Expanded now, relative to where the batches will run. Unsorted
+            # matches are batched as they're found. No matches, no batches.
+            items = sorted(items.iterate(options)) if items.sort else items.iterate(options)
+        for arguments in batch_arguments(items, budget, self.max_args):
+            yield self.command._extend(tuple(arguments), renderer)
+
+    def _xargs(self, process: ThreadedProcess, options: SpawnOptions) -> int:
+        finished: 'queue.Queue[Optional[Batch]]' = queue.Queue()
+        process.on_kill(lambda: finished.put(None))
+        batches = enumerate(self.batches(options))
+        running: Dict[int, Batch] = {}
+        # Ordered output: batches that finished before an earlier one did
+        done: Dict[int, Batch] = {}
+        next_output = 0
+        returncode = 0
+        exhausted = False
+
+        try:
+            while not process.cancelled.is_set():
+                while not exhausted and len(running) < self.max_procs and returncode != 127:
+                    try:
+                        index, batch_expression = next(batches)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    spool = self.ordered and index != next_output
+                    running[index] = Batch(batch_expression, index, spool, process, finished, options)
+                if not running:
+                    break
+                finished_batch = finished.get()
+                if finished_batch is None:
+                    break
+                del running[finished_batch.tag]
+                if finished_batch.returncode == 127:
+                    returncode = 127
+                elif finished_batch.returncode != 0 and returncode == 0:
+                    # Same as GNU xargs when any invocation fails
+                    returncode = 123
+                if self.ordered:
+                    done[finished_batch.tag] = finished_batch
+                    while next_output in done:
+                        flushed = done.pop(next_output)
+                        if flushed.output is not None:
+                            copy_file_to_fd(flushed.output, process.stdout_fd)
+                        flushed.close()
+                        next_output += 1
+        finally:
+            for batch in running.values():
+                batch.kill()
+            while running:
+                finished_batch = finished.get()
+                if finished_batch is not None:
+                    del running[finished_batch.tag]
+                    finished_batch.close()
+            for batch in done.values():
+                batch.close()
+
+        if process.cancelled.is_set():
+            return -9
+        return returncode
+
+    def _run(
+        self,
+        stdin: Optional[ShalchemyOutputStream],
+        stdout: Optional[ShalchemyOutputStream],
+        stderr: Optional[ShalchemyOutputStream],
+        context: Optional[RunResult] = None,
+    ) -> RunResult:
+        if isinstance(self.items, Iterator):
+            if self.used:
+                raise RuntimeError(f'{repr(self)} can only run once, an earlier run used up its iterator of items')
+            self.used = True
+        if context is None:
+            context = RunResult()
+        options = context.options
+        process = ThreadedProcess(
+            lambda process: self._xargs(process, options),
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            name=self._repr(ParenthesisKind.NEVER),
+        )
+        context.add_process(process, self)
+        context.main = process
+        return context
+
+    def _count_processes(self) -> int:
+        return self.max_procs * self.command._count_processes()
+
+    def _repr(self, paren: ParenthesisKind = ParenthesisKind.NEVER):
+        options: List[str] = []
+        if self.max_procs != 1:
+            options.append(f'-P {self.max_procs}')
+        if self.max_args is not None:
+            options.append(f'-n {self.max_args}')
+        return ' '.join(['xargs', *options, self.command._repr(ParenthesisKind.NEVER)])
+
+    def __repr__(self):
+        return f'$({self._repr(ParenthesisKind.NEVER)})'